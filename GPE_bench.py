@@ -0,0 +1,207 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import numpy as np
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib import fused_xy_kernel
+from GPElib.gpu_dgpe_conservative import DGPE_ODE
+from scipy.integrate import solve_ivp
+from time import time
+import sys
+import torch
+
+# Micro-benchmarks of the numerical kernels.
+# Usage: python GPE_bench.py [rhs|ensemble|split_step|kinetic|precision|longdouble|observables] [n_repeats]
+
+geometries = [(4096, 1, 1), (64, 64, 1), (16, 16, 16), (30, 30, 30)]
+
+def make_generator(N_tuple, **kwargs):
+	return DynamicsGenerator(N_part_per_well=1., N_wells=N_tuple, beta=1., W=0.1,
+							 time=1., step=0.01, gamma=0.01, calculation_type='lyap', **kwargs)
+
+def evals_per_second(fun, n_repeats):
+	fun()
+	t0 = time()
+	for i in range(n_repeats):
+		fun()
+	return n_repeats / (time() - t0)
+
+def bench_rhs(n_repeats):
+	print('RHS evaluations per second (conservative + relaxation)')
+	for N_tuple in geometries:
+		lyap = make_generator(N_tuple)
+		psi = np.random.randn(2 * lyap.N_wells)
+		out = np.zeros_like(psi)
+
+		def separate():
+			lyap.psi = psi
+			return lyap.RelaxationXY_fast() + lyap.HamiltonianXY_fast()
+
+		res = [('separate', evals_per_second(separate, n_repeats))]
+		backends = ['gather', 'roll'] if fused_xy_kernel.numba is None else ['gather', 'roll', 'numba']
+		for backend in backends:
+			lyap.fused_kernel.backend = backend
+			res.append(('fused_' + backend, evals_per_second(
+				lambda: lyap.HamiltonianWithRelaxationXY_fused(psi, out), n_repeats)))
+		print(N_tuple, ', '.join('%s: %.1f' % r for r in res))
+
+def bench_ensemble(n_repeats, batch=64, n_steps=20):
+	print('RK4 trajectory-steps per second: one trajectory at a time vs run_ensemble, batch = ' + str(batch))
+	for N_tuple in [(8, 8, 1), (64, 1, 1), (4, 4, 4)]:
+		lyap = make_generator(N_tuple)
+		PSI0 = np.random.randn(batch, 2 * lyap.N_wells)
+
+		def single():
+			for b in range(batch):
+				psi = PSI0[b].copy()
+				for i in range(1, n_steps):
+					lyap.rk4.step(lyap.full_XY_out, (i - 1) * lyap.step, psi, lyap.step, out=psi)
+
+		res = [('single', evals_per_second(single, n_repeats) * batch * n_steps),
+			   ('ensemble', evals_per_second(lambda: lyap.run_ensemble(PSI0, n_steps=n_steps, relaxation=True),
+											 n_repeats) * batch * n_steps)]
+		print(N_tuple, ', '.join('%s: %.1f' % r for r in res))
+
+def bench_split_step(n_repeats, T=20.):
+	# n_repeats is unused, every integrator is run once over the time T
+	print('Wall time per unit of simulated time and max relative energy error over T = ' + str(T))
+	for N_tuple in [(64, 64, 1), (16, 16, 16)]:
+		lyap = make_generator(N_tuple)
+		N = lyap.N_wells
+		psi0 = np.random.RandomState(0).randn(2 * N)
+		E0 = lyap.calc_energy_XY(psi0[:N], psi0[N:], 0)
+
+		def run_stepper(stepper, dt):
+			lyap.step = dt
+			psi = psi0.copy()
+			err = 0.
+			n_steps = int(round(T / dt))
+			t0 = time()
+			for i in range(n_steps):
+				stepper(psi, out=psi)
+				if (i % 10 == 0):
+					err = max(err, np.abs(lyap.calc_energy_XY(psi[:N], psi[N:], 0) - E0))
+			return (time() - t0) / T, err / np.abs(E0)
+
+		res = []
+		for dt in [0.02, 0.05]:
+			res.append(('split_step dt=' + str(dt), run_stepper(lyap.split_step_XY, dt)))
+		lyap.split_stepper.exact_hopping = lyap.fft_hopping_XY
+		res.append(('split_step fft dt=0.05', run_stepper(lyap.split_step_XY, 0.05)))
+		lyap.split_stepper.exact_hopping = None
+		res.append(('RK4 dt=0.01', run_stepper(
+			lambda psi, out: lyap.rk4.step(lyap.conservative_XY_out, 0., psi, lyap.step, out=out), 0.01)))
+
+		t0 = time()
+		sol = solve_ivp(lyap.full_eq_of_motion_conservative, (0., T), psi0, method='RK45', rtol=1e-8, atol=1e-8,
+						t_eval=np.linspace(0., T, 101))
+		wall = (time() - t0) / T
+		err = max(np.abs(lyap.calc_energy_XY(sol.y[:N, i], sol.y[N:, i], 0) - E0) for i in range(sol.y.shape[1]))
+		res.append(('RK45 rtol=1e-8', (wall, err / np.abs(E0))))
+		print(N_tuple, ', '.join('%s: %.3fs, dE/E %.1e' % (r[0], r[1][0], r[1][1]) for r in res))
+
+def bench_kinetic(n_repeats, n_times=16):
+	print('calc_energy_XY_global evaluations per second: neighbour gathers vs FFT kinetic energy, ' + str(n_times) + ' time points')
+	for N_tuple in [(64, 64, 1), (30, 30, 30), (64, 64, 64)]:
+		lyap = make_generator(N_tuple)
+		PSI = np.random.randn(n_times, 2 * lyap.N_wells)
+		res = [('gather', evals_per_second(lambda: lyap.calc_energy_XY_global(PSI), n_repeats))]
+		lyap.fft_hopping = True
+		res.append(('fft', evals_per_second(lambda: lyap.calc_energy_XY_global(PSI), n_repeats)))
+		lyap.fft_hopper.workers = -1
+		res.append(('fft all cores', evals_per_second(lambda: lyap.calc_energy_XY_global(PSI), n_repeats)))
+		print(N_tuple, ', '.join('%s: %.1f' % r for r in res))
+
+def bench_precision(n_repeats, N_tuple=(30, 30, 30), n_steps=200):
+	print('float64 vs float32 on ' + str(N_tuple) + ': RK4 steps per second (NumPy), RHS evaluations per second (torch), '
+		  'relative drift of E and N after ' + str(n_steps) + ' steps, reduced in float64')
+	psi_init = 1. + 0.3 * np.random.RandomState(0).randn(2 * np.prod(N_tuple))
+	for FloatPrecision, torch_FloatPrecision in [(np.float64, torch.float64), (np.float32, torch.float32)]:
+		lyap = make_generator(N_tuple, FloatPrecision=FloatPrecision, torch_FloatPrecision=torch_FloatPrecision)
+		psi0 = psi_init.astype(FloatPrecision)
+		E0 = lyap.calc_energy_XY_global(psi0[None])[0]
+		N0 = lyap.calc_nop_XY_global(psi0[None])[0]
+
+		psi = psi0.copy()
+		t0 = time()
+		for i in range(n_steps):
+			lyap.rk4.step(lyap.conservative_XY_out, 0., psi, lyap.step, out=psi)
+		steps_per_second = n_steps / (time() - t0)
+		dE = np.abs(lyap.calc_energy_XY_global(psi[None])[0] - E0) / np.abs(E0)
+		dN = np.abs(lyap.calc_nop_XY_global(psi[None])[0] - N0) / N0
+
+		ode = DGPE_ODE(lyap.torch_device, lyap.N_wells, lyap.J, lyap.anisotropy, lyap.gamma,
+					   lyap.nn_idx_1, lyap.nn_idx_2, lyap.nn_idy_1, lyap.nn_idy_2, lyap.nn_idz_1, lyap.nn_idz_2,
+					   lyap.h_dis_x_flat, lyap.h_dis_y_flat,
+					   lyap.beta_disorder_array_flattened, lyap.beta_flat, lyap.e_disorder_flat).to(torch_FloatPrecision)
+		psi_torch = torch.from_numpy(psi0).to(lyap.torch_device)
+		with torch.no_grad():
+			torch_evals = evals_per_second(lambda: ode(0., psi_torch), n_repeats)
+		print(FloatPrecision.__name__, 'NumPy RK4: %.1f, torch RHS: %.1f, dE/E: %.1e, dN/N: %.1e' % (steps_per_second, torch_evals, dE, dN))
+	torch.set_default_dtype(torch.float64)
+
+def bench_longdouble(n_repeats):
+	print('Evaluations per second in float64 and np.longdouble (eps = %.1e): HamiltonianXY_fast, RK4 step, calc_traj_shift_XY'
+		  % np.finfo(np.longdouble).eps)
+	for N_tuple in [(64, 64, 1), (16, 16, 16), (30, 30, 30)]:
+		res = []
+		for FloatPrecision in [np.float64, np.longdouble]:
+			lyap = make_generator(N_tuple, FloatPrecision=FloatPrecision)
+			N = lyap.N_wells
+			psi = np.random.RandomState(0).randn(2 * N).astype(FloatPrecision)
+			psi1 = psi + np.asarray(1e-10, dtype=FloatPrecision)
+			out = np.zeros_like(psi)
+
+			def rhs():
+				lyap.psi = psi
+				return lyap.HamiltonianXY_fast()
+
+			name = FloatPrecision.__name__
+			res.append((name + ' rhs', evals_per_second(rhs, n_repeats)))
+			res.append((name + ' RK4', evals_per_second(
+				lambda: lyap.rk4.step(lyap.conservative_XY_out, 0., psi, lyap.step, out=out), n_repeats)))
+			res.append((name + ' shift', evals_per_second(
+				lambda: lyap.calc_traj_shift_XY(psi[:N], psi[N:], psi1[:N], psi1[N:]), n_repeats)))
+		print(N_tuple, ', '.join('%s: %.1f' % r for r in res))
+
+def bench_observables(n_repeats):
+	print('Evaluations per second of the local observables (E, N, L, participation rate) on a single XY state')
+	for N_tuple in geometries:
+		lyap = make_generator(N_tuple, dimensionality=3 if N_tuple[2] > 1 else (2 if N_tuple[1] > 1 else 1))
+		rng = np.random.RandomState(0)
+		lyap.set_init_XY(rng.randn(lyap.N_wells), rng.randn(lyap.N_wells))
+		print(N_tuple, '%.1f' % evals_per_second(lambda: lyap.set_constants_of_motion_local(0, 0), n_repeats))
+
+benchmarks = {'rhs': bench_rhs, 'ensemble': bench_ensemble, 'split_step': bench_split_step, 'kinetic': bench_kinetic,
+			  'precision': bench_precision, 'longdouble': bench_longdouble,
+			  'observables': bench_observables}
+
+if __name__ == '__main__':
+	names = sys.argv[1:2] if len(sys.argv) > 1 else list(benchmarks.keys())
+	n_repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+	for name in names:
+		benchmarks[name](n_repeats)
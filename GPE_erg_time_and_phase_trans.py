@@ -29,6 +29,7 @@ import numpy as np
 from GPElib.dynamics_generator import DynamicsGenerator
 from GPElib.instability_generator import InstabilityGenerator
 from GPElib.visualisation import Visualisation
+from GPElib.results_store import ResultsStore
 import matplotlib
 print(matplotlib.matplotlib_fname())
 import matplotlib.pyplot as plt
@@ -115,6 +116,8 @@ lyap_dynamic = InstabilityGenerator(N_part_per_well=1.,
 grname = 'GPE_phase_' + unique_id
 vis = Visualisation(is_local=0,  HOMEDIR='/data/tarkhov/data/', GROUP_NAMES=grname)
 vis_backup = Visualisation(is_local=0,  HOMEDIR='/data/tarkhov/data/backups/', GROUP_NAMES=grname)
+# per-trajectory arrays, one writer per job; merge with ResultsStore(...).merge(filename) after all jobs are done
+results = ResultsStore(vis.HOMEDIR + grname + '_results', writer_id=my_id)
 
 # vis = Visualisation(is_local=1,  HOMEDIR='/Users/tarkhov/tmp/', GROUP_NAMES=grname)
 # vis_backup = Visualisation(is_local=1,  HOMEDIR='/Users/tarkhov/tmp/backups/', GROUP_NAMES=grname)
@@ -147,15 +150,7 @@ if backup_present == False:
 	lmbdas_no_regr = []
 	chosen_trajs = []
 	effective_nonlinearity = []
-	energies = []
-	temperatures = []
-	temperatures_Amp = []
-	temperatures_Ph = []
-	energies_true = []
-	order_parameters = []
-	order_parameters_1 = []
 	distances = []
-	numb_of_part = []
 	next_traj = 0
 	next_seed = 0
 	backup_id = -1
@@ -167,15 +162,7 @@ else:
 	lmbdas_no_regr = backup['lambdas_no_regr']
 	chosen_trajs = backup['chosen']
 	effective_nonlinearity = backup['eff_nonl']
-	energies = backup['energies']
-	temperatures = backup['temperatures']
-	temperatures_Amp = backup['temperatures_Amp']
-	temperatures_Ph = backup['temperatures_Ph']
-	energies_true = backup['energies_true']
-	order_parameters = backup['order_parameters']
-	order_parameters_1 = backup['order_parameters_1']
 	distances = backup['distance']
-	numb_of_part = backup['numb_of_part']
 	curr_traj = backup['curr_traj']
 	perturb_seeds = backup['pert_seeds']
 	curr_seed = backup['curr_seed']
@@ -183,6 +170,19 @@ else:
 	backup_id = backup['backup_id']
 
 
+def stored_results():
+	# the per-trajectory arrays of this job from the results store, in the layout of the former
+	# np.concatenate (np.hstack for energies, numb_of_part) accumulation; read once for the final npz,
+	# the backups leave them out since the store already holds them
+	arrays = {}
+	for name in ['energies', 'temperatures', 'temperatures_Amp', 'temperatures_Ph', 'energies_true',
+				 'order_parameters', 'order_parameters_1', 'numb_of_part']:
+		if results.n_records == 0:
+			arrays[name] = []
+		else:
+			arrays[name] = results.read(name, writer_ids=[my_id], concatenate=(name in ['energies', 'numb_of_part']))
+	return arrays
+
 def save_backup(backup_id):
 	if backup_id == 0:
 		init_conds =  [lyap.X[:,:,:,0], lyap.Y[:,:,:,0]]
@@ -197,13 +197,6 @@ def save_backup(backup_id):
 	                 lambdas=lmbdas, lambdas_no_regr=lmbdas_no_regr,
 	                 eff_nonl=effective_nonlinearity,
 	                 init_conds=init_conds,
-			         numb_of_part=numb_of_part, energies=energies,
-					temperatures = temperatures,
-				temperatures_Amp = temperatures_Amp,
-                                        temperatures_Ph = temperatures_Ph,
-				energies_true = energies_true,
-					order_parameters = order_parameters,
-					order_parameters_1 = order_parameters_1,
 			          pert_seeds=perturb_seeds,
 			         chosen=chosen_trajs, step=lyap.step, time=lyap.time, n_steps=lyap.n_steps,
 			         my_info=[seed_from, seed_to, my_id], needed_trajs=needed_trajs,
@@ -233,8 +226,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 			lyap.X = lyap.X * 0.
 			lyap.Y = lyap.Y * 0.
-			lyap.RHO = lyap.RHO * 0.
-			lyap.THETA = lyap.THETA * 0.
+			lyap.invalidate()
 			lyap.icurr = 0
 			lyap.inext = 1
 
@@ -320,8 +312,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 				lyap.X *= 0
 				lyap.Y *= 0
-				lyap.RHO *= 0
-				lyap.THETA *= 0
+				lyap.invalidate()
 				lyap.icurr = 0
 				lyap.inext = 1
 
@@ -334,8 +325,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 				lyap.X *= 0
 				lyap.Y *= 0
-				lyap.RHO *= 0
-				lyap.THETA *= 0
+				lyap.invalidate()
 				lyap.icurr = 0
 				lyap.inext = 1
 
@@ -361,8 +351,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 				lyap.X *= 0
 				lyap.Y *= 0
-				lyap.RHO *= 0
-				lyap.THETA *= 0
+				lyap.invalidate()
 				lyap.icurr = 0
 				lyap.inext = 1
 
@@ -375,8 +364,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 				lyap.X *= 0
 				lyap.Y *= 0
-				lyap.RHO *= 0
-				lyap.THETA *= 0
+				lyap.invalidate()
 				lyap.icurr = 0
 				lyap.inext = 1
 
@@ -411,39 +399,20 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 				lmbdas_no_regr = backup['lambdas_no_regr']
 				chosen_trajs = backup['chosen']
 				effective_nonlinearity = backup['eff_nonl']
-				energies = backup['energies']
-				temperatures = backup['temperatures']
-				energies_true = backup['energies_true']
-				order_parameters = backup['order_parameters']
-				order_parameters_1 = backup['order_parameters_1']
 				distances = backup['distance']
-				numb_of_part = backup['numb_of_part']
 				curr_traj = backup['curr_traj']
 				curr_seed = backup['curr_seed']
 				time_finished = backup['time_finished']
 				backup_id = backup['backup_id']
 
-				if len(energies_true) == 0:
-					energies_true = energy_i
-					temperatures = temperature_i
-					temperatures_Ph = temperature_Ph_i
-
-					temperatures_Amp = temperature_Amp_i
-					order_parameters = order_parameter_i
-					order_parameters_1 = order_parameter_i_1
-				else:
-					# print energies_true.shape, energy_i.shape
-					energies_true = np.concatenate((energies_true, energy_i), axis=0)
-					temperatures = np.concatenate((temperatures, temperature_i), axis=0)
-					temperatures_Amp = np.concatenate((temperatures_Amp, temperature_Amp_i), axis=0)
-					temperatures_Ph = np.concatenate((temperatures_Ph, temperature_Ph_i), axis=0)
-					# print 'stack axis 0: ', order_parameters.shape, order_parameter_i.shape
-					order_parameters = np.concatenate((order_parameters, order_parameter_i), axis=0)
-					order_parameters_1 = np.concatenate((order_parameters_1, order_parameter_i_1), axis=0)
-
-				energies = np.hstack((energies, lyap.energy))
-
-				numb_of_part = np.hstack((numb_of_part, lyap.number_of_particles))
+				# the per-trajectory arrays go to the results store instead of being concatenated and re-saved;
+				# a job restarted between the append and save_backup finds its record there already
+				if not results.has(traj_seed=int(traj_seed), k_traj=int(k_traj)):
+					results.append({'energies_true': energy_i[0], 'temperatures': temperature_i[0],
+									'temperatures_Amp': temperature_Amp_i[0], 'temperatures_Ph': temperature_Ph_i[0],
+									'order_parameters': order_parameter_i[0], 'order_parameters_1': order_parameter_i_1[0],
+									'energies': lyap.energy, 'numb_of_part': lyap.number_of_particles},
+								   traj_seed=int(traj_seed), pert_seed=int(pert_seed), k_traj=int(k_traj))
 
 
 				save_backup(k_traj)
@@ -456,13 +425,7 @@ print("\n\nChecksum: ", lyap.consistency_checksum)
 np.savez_compressed(vis.filename(my_id),
          lambdas=lmbdas, lambdas_no_regr=lmbdas_no_regr,
          eff_nonl=effective_nonlinearity,
-         numb_of_part=numb_of_part, energies=energies,
-        temperatures = temperatures,
-		temperatures_Amp = temperatures_Amp,
-                                        temperatures_Ph = temperatures_Ph,
-		energies_true = energies_true,
-		order_parameters = order_parameters,
-		order_parameters_1 = order_parameters_1,
+         **stored_results(),
          chosen=chosen_trajs, step=lyap.step, time=lyap.time, n_steps=lyap.n_steps,
          my_info=[seed_from, seed_to, my_id], needed_trajs=needed_trajs,
          checksum=lyap.consistency_checksum, error_code=lyap.error_code,
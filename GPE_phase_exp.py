@@ -220,8 +220,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 			lyap.X = lyap.X * 0.
 			lyap.Y = lyap.Y * 0.
-			lyap.RHO = lyap.RHO * 0.
-			lyap.THETA = lyap.THETA * 0.
+			lyap.invalidate()
 			lyap.icurr = 0
 			lyap.inext = 1
 
@@ -270,8 +269,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 			y0 = lyap.Y[:,:,:,0].copy()
 			lyap.X *= 0
 			lyap.Y *= 0
-			lyap.RHO *= 0
-			lyap.THETA *= 0
+			lyap.invalidate()
 			lyap.icurr = 0
 			lyap.inext = 1
 
@@ -286,8 +284,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 			
 			lyap.X *= 0
 			lyap.Y *= 0
-			lyap.RHO *= 0
-			lyap.THETA *= 0
+			lyap.invalidate()
 			lyap.icurr = 0
 			lyap.inext = 1
 
@@ -346,8 +343,7 @@ for i_traj, traj_seed in enumerate(needed_trajs):
 
 				lyap.X *= 0
 				lyap.Y *= 0
-				lyap.RHO *= 0
-				lyap.THETA *= 0
+				lyap.invalidate()
 				lyap.icurr = 0
 				lyap.inext = 1
 
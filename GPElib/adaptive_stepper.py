@@ -0,0 +1,262 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+from scipy.integrate import RK45, DOP853
+
+class AdaptiveRKStepper(object):
+	# Embedded-pair Runge-Kutta integrator with step-size control and dense output,
+	# RK45 (Dormand-Prince 5(4)) or DOP853, with the tableaus, error norms and step-size rules of
+	# scipy.integrate, so that rtol/atol mean the same as in the scipy path.
+	# The stage buffers are preallocated and the right-hand side is a pure function f(t, y, out),
+	# so a step does not allocate state-sized arrays.
+	SAFETY = 0.9
+	MIN_FACTOR = 0.2
+	MAX_FACTOR = 10.
+
+	def __init__(self, size, method='RK45', rtol=1e-6, atol=1e-6, max_step=np.inf, FloatPrecision=np.float64):
+		if method not in ['RK45', 'DOP853']:
+			raise ValueError('Unknown adaptive method ' + str(method) + ', use RK45 or DOP853')
+		self.size = size
+		self.method = method
+		self.rtol = rtol
+		self.atol = atol
+		self.max_step = max_step
+		self.FloatPrecision = FloatPrecision
+
+		# the tableaus are cast to FloatPrecision, np.dot(..., out=) needs the dtypes of the stage buffers
+		solver = RK45 if method == 'RK45' else DOP853
+		tableau = lambda a: np.asarray(a, dtype=self.FloatPrecision)
+		self.n_stages = solver.n_stages
+		self.A = tableau(solver.A)
+		self.B = tableau(solver.B)
+		self.C = tableau(solver.C)
+		self.error_exponent = -1. / (solver.error_estimator_order + 1)
+		if method == 'RK45':
+			self.E = tableau(solver.E)
+			self.P = tableau(solver.P)
+			n_stages_extended = self.n_stages + 1
+		else:
+			self.E3 = tableau(solver.E3)
+			self.E5 = tableau(solver.E5)
+			self.D = tableau(solver.D)
+			self.A_EXTRA = tableau(solver.A_EXTRA)
+			self.C_EXTRA = tableau(solver.C_EXTRA)
+			n_stages_extended = self.n_stages + 1 + len(self.C_EXTRA)
+
+		self.K_extended = np.zeros((n_stages_extended, size), dtype=self.FloatPrecision)
+		self.K = self.K_extended[:self.n_stages + 1]
+		self.y = np.zeros(size, dtype=self.FloatPrecision)
+		self.y_old = np.zeros(size, dtype=self.FloatPrecision)
+		self.y_new = np.zeros(size, dtype=self.FloatPrecision)
+		self.f = np.zeros(size, dtype=self.FloatPrecision)
+		self.dy = np.zeros(size, dtype=self.FloatPrecision)
+		self.err = np.zeros(size, dtype=self.FloatPrecision)
+		self.scale = np.zeros(size, dtype=self.FloatPrecision)
+		self.Q = None
+
+		self.fun = None
+		self.t = 0.
+		self.t_old = 0.
+		self.h_abs = 0.
+		self.h_previous = None
+		self.nfev = 0
+		self.n_accepted = 0
+		self.n_rejected = 0
+
+	def norm(self, v):
+		return np.linalg.norm(v) / np.sqrt(v.size)
+
+	def call(self, t, y, out):
+		self.nfev += 1
+		return self.fun(t, y, out)
+
+	def reset(self, fun, t, y, first_step=None):
+		# start a new integration from y at time t, the step size is chosen as in scipy
+		self.fun = fun
+		self.t = t
+		self.t_old = t
+		self.y[:] = y
+		self.y_old[:] = y
+		self.Q = None
+		self.h_previous = None
+		self.call(t, self.y, self.f)
+		if first_step is not None:
+			self.h_abs = first_step
+			return
+		scale = self.atol + np.abs(self.y) * self.rtol
+		d0 = self.norm(self.y / scale)
+		d1 = self.norm(self.f / scale)
+		h0 = 1e-6 if (d0 < 1e-5) or (d1 < 1e-5) else 0.01 * d0 / d1
+		np.multiply(self.f, h0, out=self.dy)
+		self.dy += self.y
+		self.call(t + h0, self.dy, self.err)
+		d2 = self.norm((self.err - self.f) / scale) / h0
+		if (d1 <= 1e-15) and (d2 <= 1e-15):
+			h1 = max(1e-6, h0 * 1e-3)
+		else:
+			h1 = (0.01 / max(d1, d2)) ** (-self.error_exponent)
+		self.h_abs = min(100 * h0, h1, self.max_step)
+
+	def rk_step(self, t, h):
+		K = self.K
+		K[0] = self.f
+		for s in range(1, self.n_stages):
+			np.dot(self.A[s, :s], K[:s], out=self.dy)
+			self.dy *= h
+			self.dy += self.y
+			self.call(t + self.C[s] * h, self.dy, K[s])
+		np.dot(self.B, K[:-1], out=self.y_new)
+		self.y_new *= h
+		self.y_new += self.y
+		self.call(t + h, self.y_new, K[-1])
+
+	def error_norm(self, h):
+		np.maximum(np.abs(self.y), np.abs(self.y_new), out=self.scale)
+		self.scale *= self.rtol
+		self.scale += self.atol
+		if self.method == 'RK45':
+			np.dot(self.E, self.K, out=self.err)
+			self.err *= h
+			self.err /= self.scale
+			return self.norm(self.err)
+		np.dot(self.E5, self.K, out=self.err)
+		self.err /= self.scale
+		err5_norm_2 = np.dot(self.err, self.err)
+		np.dot(self.E3, self.K, out=self.err)
+		self.err /= self.scale
+		err3_norm_2 = np.dot(self.err, self.err)
+		if (err5_norm_2 == 0) and (err3_norm_2 == 0):
+			return 0.
+		return np.abs(h) * err5_norm_2 / np.sqrt((err5_norm_2 + 0.01 * err3_norm_2) * self.size)
+
+	def step(self):
+		# one accepted step from self.t
+		t = self.t
+		min_step = 10 * np.abs(np.nextafter(t, np.inf) - t)
+		h_abs = min(max(self.h_abs, min_step), self.max_step)
+		step_rejected = False
+		while True:
+			if h_abs < min_step:
+				raise RuntimeError('Adaptive step size became too small at t = ' + str(t))
+			self.rk_step(t, h_abs)
+			error_norm = self.error_norm(h_abs)
+			if error_norm < 1:
+				if error_norm == 0:
+					factor = self.MAX_FACTOR
+				else:
+					factor = min(self.MAX_FACTOR, self.SAFETY * error_norm ** self.error_exponent)
+				if step_rejected:
+					factor = min(1., factor)
+				break
+			h_abs *= max(self.MIN_FACTOR, self.SAFETY * error_norm ** self.error_exponent)
+			step_rejected = True
+			self.n_rejected += 1
+
+		self.n_accepted += 1
+		self.h_previous = h_abs
+		self.t_old = t
+		self.t = t + h_abs
+		self.y_old[:] = self.y
+		self.y[:] = self.y_new
+		self.f[:] = self.K[-1]
+		self.h_abs = h_abs * factor
+		self.Q = None
+
+	def dense_coefficients(self):
+		# interpolant of the last step, computed on the first request
+		h = self.h_previous
+		if self.method == 'RK45':
+			self.Q = np.dot(self.P.T, self.K)
+			return self.Q
+		K = self.K_extended
+		for s, (a, c) in enumerate(zip(self.A_EXTRA, self.C_EXTRA), start=self.n_stages + 1):
+			np.dot(a[:s], K[:s], out=self.dy)
+			self.dy *= h
+			self.dy += self.y_old
+			self.call(self.t_old + c * h, self.dy, K[s])
+		F = np.empty((3 + self.D.shape[0], self.size), dtype=self.FloatPrecision)
+		F[0] = self.y - self.y_old
+		F[1] = h * K[0] - F[0]
+		F[2] = 2 * F[0] - h * (self.f + K[0])
+		F[3:] = h * np.dot(self.D, K)
+		self.Q = F
+		return self.Q
+
+	def dense(self, t, out):
+		if self.Q is None:
+			self.dense_coefficients()
+		x = (t - self.t_old) / self.h_previous
+		if self.method == 'RK45':
+			# y_old + h * sum_j Q[j] x^(j + 1)
+			out[:] = 0.
+			for q in self.Q[::-1]:
+				out += q
+				out *= x
+			out *= self.h_previous
+			out += self.y_old
+			return out
+		out[:] = 0.
+		for i, f in enumerate(self.Q[::-1]):
+			out += f
+			if (i % 2 == 0):
+				out *= x
+			else:
+				out *= 1 - x
+		out += self.y_old
+		return out
+
+	def get_state(self):
+		# everything needed to continue the integration bit for bit (for checkpoints); fun is given again to set_state
+		state = {'t': np.array(self.t), 't_old': np.array(self.t_old), 'h_abs': np.array(self.h_abs),
+				 'h_previous': np.array(np.nan if self.h_previous is None else self.h_previous),
+				 'y': self.y.copy(), 'y_old': self.y_old.copy(), 'f': self.f.copy(), 'K_extended': self.K_extended.copy(),
+				 'counters': np.array([self.nfev, self.n_accepted, self.n_rejected])}
+		if self.Q is not None:
+			state['Q'] = self.Q.copy()
+		return state
+
+	def set_state(self, fun, state):
+		self.fun = fun
+		self.t = state['t'][()]
+		self.t_old = state['t_old'][()]
+		self.h_abs = state['h_abs'][()]
+		self.h_previous = None if np.isnan(state['h_previous']) else state['h_previous'][()]
+		self.y[:] = state['y']
+		self.y_old[:] = state['y_old']
+		self.f[:] = state['f']
+		self.K_extended[:] = state['K_extended']
+		self.Q = state['Q'].copy() if 'Q' in state else None
+		self.nfev, self.n_accepted, self.n_rejected = [int(n) for n in state['counters']]
+
+	def advance_to(self, t, out):
+		# integrate up to (or past) t and write the dense-output state at t into out
+		while self.t < t:
+			self.step()
+		if (t == self.t) or (self.h_previous is None):
+			out[:] = self.y
+			return out
+		return self.dense(t, out)
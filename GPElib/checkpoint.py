@@ -0,0 +1,102 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import os
+import glob
+import tempfile
+from time import time
+import numpy as np
+
+class CheckpointStore(object):
+	# Append-only directory of checkpoints <directory>/checkpoint_<n>.npz of a running trajectory.
+	#
+	# A checkpoint is a flat dict of arrays (see DynamicsGenerator.get_checkpoint_state); it is written into
+	# a temporary file in the same directory, flushed to disk and renamed into place, so a job killed while
+	# writing leaves either the complete new checkpoint or the previous ones. Written checkpoints are never
+	# modified; keep_last only removes the oldest ones after the new one is in place.
+	#
+	# due(i) decides when to write: every every_steps steps and/or every every_seconds of wall-clock time.
+	def __init__(self, directory, every_steps=None, every_seconds=None, keep_last=None):
+		self.directory = directory
+		self.every_steps = every_steps
+		self.every_seconds = every_seconds
+		self.keep_last = keep_last
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		paths = self.list()
+		self.n_written = (self.index(paths[-1]) + 1) if len(paths) > 0 else 0
+		self.last_step = 0
+		self.last_time = time()
+
+	def filename(self, n):
+		return os.path.join(self.directory, 'checkpoint_%08d.npz' % n)
+
+	def index(self, path):
+		return int(os.path.basename(path)[len('checkpoint_'):-len('.npz')])
+
+	def list(self):
+		return sorted(glob.glob(os.path.join(self.directory, 'checkpoint_*.npz')), key=self.index)
+
+	def due(self, i):
+		if (self.every_steps is not None) and (i - self.last_step >= self.every_steps):
+			return True
+		if (self.every_seconds is not None) and (time() - self.last_time >= self.every_seconds):
+			return True
+		return False
+
+	def save(self, i, state):
+		fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix='.checkpoint_', dir=self.directory)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				np.savez(f, **state)
+				f.flush()
+				os.fsync(f.fileno())
+			path = self.filename(self.n_written)
+			os.replace(tmp, path)
+		except BaseException:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+			raise
+		self.n_written += 1
+		self.last_step = i
+		self.last_time = time()
+		if self.keep_last is not None:
+			for old in self.list()[:-self.keep_last]:
+				os.remove(old)
+		return path
+
+	def load(self, path):
+		with np.load(path, allow_pickle=False) as data:
+			return {key: data[key] for key in data.files}
+
+	def load_latest(self):
+		# the last complete checkpoint, or None if there is none yet
+		paths = self.list()
+		if len(paths) == 0:
+			return None
+		state = self.load(paths[-1])
+		self.last_step = int(state['step_index'])
+		return state
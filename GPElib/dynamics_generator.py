@@ -30,21 +30,51 @@ import matplotlib.pyplot as plt
 from scipy.optimize import minimize
 import scipy.integrate as intgr
 from scipy.integrate import odeint, solve_ivp
+from scipy.integrate import RK23, RK45, DOP853, Radau, BDF, LSODA
 from scipy.sparse import dok_matrix
+import scipy.sparse as sparse
+import scipy.sparse.linalg as sparse_linalg
 import multiprocessing as mp
 from time import time
+import warnings
 
 import torch
 import torchdiffeq
 
 from .gpu_dgpe_conservative import DGPE_ODE
 from .gpu_dgpe_relaxation import DGPE_ODE_RELAXATION
+from .gpu_dgpe_batch import DGPE_ODE_BATCH
+from .sparse_jacobian import SparseJacobianXY
+from .fused_xy_kernel import FusedXYKernel
+from .rk4_stepper import RK4Stepper
+from .split_step import SplitStepXY
+from .fft_hopping import FFTHoppingXY
+from .adaptive_stepper import AdaptiveRKStepper
+from .lattice import get_lattice_topology
+from .local_observables import LocalObservablesXY
+from .polar_view import LazyPolarXY
+from .checkpoint import CheckpointStore
+from .trajectory_sinks import TrajectorySink, RingBufferSink, MemmapSink, HDF5Sink
+from .ensemble_xy_kernel import EnsembleXYKernel
+
+# the per-step observables of run_dynamics that the checkpoints store
+CHECKPOINT_OBSERVABLES = ['energy', 'number_of_particles', 'angular_momentum', 'participation_rate',
+						  'effective_nonlinearity']
+
+# the state of a generator that run_energy_sweep restores after running the points on it
+SWEEP_RESTORED_ATTRIBUTES = ['gamma', 'X', 'Y', 'T', 'energy', 'number_of_particles', 'angular_momentum',
+							 'participation_rate', 'effective_nonlinearity']
+
+SCIPY_ODE_SOLVERS = {'RK23': RK23, 'RK45': RK45, 'DOP853': DOP853, 'Radau': Radau, 'BDF': BDF, 'LSODA': LSODA}
 
 class DynamicsGenerator(object):
 	def __init__(self, **kwargs):
 		#Hamiltonian parameters
 
 		self.FloatPrecision = kwargs.get('FloatPrecision', np.float64)
+		# the energy and particle-number reductions are accumulated in at least float64,
+		# so that the conservation diagnostics stay meaningful for FloatPrecision = np.float32
+		self.ReductionPrecision = kwargs.get('ReductionPrecision', np.promote_types(self.FloatPrecision, np.float64).type)
 		self.torch_FloatPrecision = kwargs.get('torch_FloatPrecision', torch.float64)
 		torch.set_default_dtype(self.torch_FloatPrecision)
 		self.torch_gpu_id = kwargs.get('gpu_id', 0)
@@ -61,6 +91,18 @@ class DynamicsGenerator(object):
 
 		self.use_matrix_operations = kwargs.get('use_matrix_operations', True)
 		self.use_matrix_operations_for_energy = kwargs.get('use_matrix_operations_for_energy', True)
+		self.use_sparse_jacobian = kwargs.get('use_sparse_jacobian', True)
+		self.rhs_backend = kwargs.get('rhs_backend', 'gather')
+		# symplectic Strang split-step integrator for the conservative personal runs
+		self.split_step = kwargs.get('split_step', False)
+		self.hopping_substeps = kwargs.get('hopping_substeps', 1)
+		# exact FFT hopping propagator and FFT kinetic energy on the periodic lattice
+		self.fft_hopping = kwargs.get('fft_hopping', False)
+		self.fft_workers = kwargs.get('fft_workers', None)
+		# embedded-pair adaptive step for the personal integrator: None (fixed step RK4), 'RK45' or 'DOP853'
+		self.adaptive_method = kwargs.get('adaptive_method', None)
+		# E, N, L and the participation rate are evaluated every observables_every steps and held in between
+		self.observables_every = kwargs.get('observables_every', 1)
 		self.h_ext_x = kwargs.get('h_ext_x', 0.)
 		self.h_ext_y = kwargs.get('h_ext_y', 0.)
 		self.lam1 = kwargs.get('lam1', 1.)
@@ -74,13 +116,27 @@ class DynamicsGenerator(object):
 
 		self.n_steps = kwargs.get('n_steps', int(self.time / self.step))
 		self.integrator = kwargs.get('integrator', 'personal')
+		if (np.finfo(self.FloatPrecision).eps < np.finfo(np.float64).eps) and ((self.integrator != 'personal') or (self.gpu_integrator == 'torch')):
+			warnings.warn('Extended precision is kept only by the personal integrator, solve_ivp and torch integrate in float64')
 		self.calculation_type = kwargs.get('calculation_type', 'lyap')
 		self.integration_method = kwargs.get('intergration_method', 'RK45')
 		self.smooth_quench = kwargs.get('smooth_quench', False)
 
 		self.rtol = kwargs.get('rtol', 1e-6)
 		self.atol = kwargs.get('atol', 1e-6)
-		if self.calculation_type == 'lyap':
+		# streaming output mode: every save_every-th snapshot is pushed into the sink,
+		# X/Y/RHO/THETA keep only the current and the next step, as for 'lyap'
+		self.trajectory_sink = kwargs.get('trajectory_sink', None)
+		self.save_every = kwargs.get('save_every', 1)
+		# CheckpointStore for run_dynamics(resume=...) with the personal integrator
+		self.checkpoint_store = kwargs.get('checkpoint_store', None)
+		self.streaming = self.trajectory_sink is not None
+		# chunked scipy integration: the solver is stepped in place and only the observables
+		# (and the sink snapshots, if any) are kept at the output times
+		self.chunked_integration = kwargs.get('chunked_integration', False)
+		# number of output steps per torchdiffeq call in run_relaxation
+		self.relaxation_chunk = kwargs.get('relaxation_chunk', 100)
+		if (self.calculation_type == 'lyap') or self.streaming or self.chunked_integration:
 			self.n_steps_savings = 2
 		else:
 			self.n_steps_savings = self.n_steps
@@ -110,12 +166,36 @@ class DynamicsGenerator(object):
 
 		self.wells_enumeration = np.arange(self.N_wells).reshape(self.N_tuple)
 
-		self.nn_idx_1 = np.roll(self.wells_enumeration, -1, axis=0).flatten()
-		self.nn_idx_2 = np.roll(self.wells_enumeration, 1, axis=0).flatten()
-		self.nn_idy_1 = np.roll(self.wells_enumeration, -1, axis=1).flatten()
-		self.nn_idy_2 = np.roll(self.wells_enumeration, 1, axis=1).flatten()
-		self.nn_idz_1 = np.roll(self.wells_enumeration, -1, axis=2).flatten()
-		self.nn_idz_2 = np.roll(self.wells_enumeration, 1, axis=2).flatten()
+		# the neighbour table is shared by all generators with the same geometry
+		self.lattice = get_lattice_topology(self.N_tuple, self.dimensionality)
+		self.nn_idx_1 = self.lattice.nn_idx_1
+		self.nn_idx_2 = self.lattice.nn_idx_2
+		self.nn_idy_1 = self.lattice.nn_idy_1
+		self.nn_idy_2 = self.lattice.nn_idy_2
+		self.nn_idz_1 = self.lattice.nn_idz_1
+		self.nn_idz_2 = self.lattice.nn_idz_2
+		# neighbours[N_wells, z] in the order of nearest_neighbours(), only along the axes of the lattice dimensionality;
+		# bonds with idx > 3 are along z and get the anisotropy factor
+		self.neighbours = self.lattice.neighbours
+		self.neighbour_lists = self.lattice.neighbour_lists
+		self.nn_ids_dim = self.neighbours.T
+		self.nn_is_z_dim = self.lattice.is_z_bond
+
+		# with the matrix operations the vectorized kernels couple along all three axes, as the nn_id* branch of
+		# HamiltonianXY_fast (an axis of size 1 then gives an on-site bond); without them only along the axes
+		# of the lattice dimensionality, as the loop versions
+		self.kernel_dimensionality = 3 if self.use_matrix_operations else self.dimensionality
+
+		self.sparse_jacobian = SparseJacobianXY(self.N_wells, self.nn_idx_1, self.nn_idx_2, self.nn_idy_1,
+												self.nn_idy_2, self.nn_idz_1, self.nn_idz_2,
+												FloatPrecision=self.FloatPrecision,
+												dimensionality=self.kernel_dimensionality)
+		self.fused_kernel = FusedXYKernel(self.N_tuple, self.nn_idx_1, self.nn_idx_2, self.nn_idy_1,
+										  self.nn_idy_2, self.nn_idz_1, self.nn_idz_2,
+										  backend=self.rhs_backend, FloatPrecision=self.FloatPrecision,
+										  dimensionality=self.kernel_dimensionality)
+		self.local_observables = LocalObservablesXY(self.lattice, FloatPrecision=self.FloatPrecision,
+													ReductionPrecision=self.ReductionPrecision)
 
 		self.wells_index_tuple_to_num = dict()
 		for i in range(self.Nx):
@@ -138,28 +218,56 @@ class DynamicsGenerator(object):
 		else:
 			self.threshold_XY_to_polar = kwargs.get('threshold_XY_to_polar', 0.5)
 
-		self.energy = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.participation_rate = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.effective_nonlinearity = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.angular_momentum = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.number_of_particles = np.zeros(self.n_steps, dtype=self.FloatPrecision)
+		# length of T and of the observable arrays as allocated here; with use_matrix_operations_for_energy
+		# run_relaxation and run_dynamics replace the observables by arrays as long as the run
+		self.n_steps_allocated = self.n_steps
+		self.energy = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.participation_rate = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.effective_nonlinearity = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.angular_momentum = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.number_of_particles = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
 		self.distance = np.zeros(self.n_steps, dtype=self.FloatPrecision)
 		self.histograms = {}
 		self.rho_histograms = {}
 
 		self.T = np.linspace(0, self.time, self.n_steps)
-		self.RHO = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
-		self.THETA = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
 		self.X = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
 		self.Y = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
+		# RHO, THETA are cached views of X, Y, see the properties below
+		self.polar_view = LazyPolarXY()
+
+		if self.streaming:
+			self.trajectory_sink.open(self.N_tuple, self.FloatPrecision)
 
 		self.psi = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
 
 		self.psiNext = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
 		self.psiNextXY = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
+		self.psi_snapshot = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
 		self.psiJac = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
 
 		self.dpsi = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
+		self.rk4 = RK4Stepper(2 * self.N_wells, FloatPrecision=self.FloatPrecision)
+		if self.fft_hopping:
+			# the FFT propagator is exact only for the clean periodic lattice with the isotropic hopping J along all
+			# three axes (an axis of size 1 as an on-site bond, as the nn_id* matrix kernels); the loop kernels
+			# of use_matrix_operations=False do not wrap the unused axes, like open boundaries
+			if (np.ndim(self.J) != 0) or (np.ndim(self.anisotropy) != 0):
+				raise ValueError('fft_hopping needs a uniform hopping J, no hopping disorder')
+			if self.anisotropy != 1.:
+				raise ValueError('fft_hopping needs anisotropy = 1, got ' + str(self.anisotropy))
+			if self.kernel_dimensionality != 3:
+				raise ValueError('fft_hopping needs periodic boundaries along all three axes, use use_matrix_operations=True')
+		self.fft_hopper = FFTHoppingXY(self.N_tuple, workers=self.fft_workers, FloatPrecision=self.FloatPrecision)
+		self.split_stepper = SplitStepXY(self.N_wells,
+										 lambda v, out: self.fused_kernel.nn_sum(v, out, self.J, self.anisotropy),
+										 n_substeps=self.hopping_substeps, FloatPrecision=self.FloatPrecision,
+										 exact_hopping=self.fft_hopping_XY if self.fft_hopping else None)
+		if self.adaptive_method is not None:
+			self.adaptive_stepper = AdaptiveRKStepper(2 * self.N_wells, method=self.adaptive_method, rtol=self.rtol,
+													  atol=self.atol, FloatPrecision=self.FloatPrecision)
+		self.adaptive_rhs = None
+		self.adaptive_t = None
 
 		# self.dFdXY = np.zeros((2 * self.N_wells, 2 * self.N_wells), dtype=self.FloatPrecision)
 		self.dFdXY = dok_matrix((2 * self.N_wells, 2 * self.N_wells), dtype=self.FloatPrecision)
@@ -187,8 +295,8 @@ class DynamicsGenerator(object):
 		if 'local_disorder_amplitude' in kwargs:
 			self.local_disorder = True
 			np.random.seed(self.local_disorder_seed)
-			self.h_dis_x_flat = self.local_disorder_amplitude * np.random.randn(self.N_wells)
-			self.h_dis_y_flat = self.local_disorder_amplitude * np.random.randn(self.N_wells)
+			self.h_dis_x_flat = (self.local_disorder_amplitude * np.random.randn(self.N_wells)).astype(self.FloatPrecision)
+			self.h_dis_y_flat = (self.local_disorder_amplitude * np.random.randn(self.N_wells)).astype(self.FloatPrecision)
 			self.h_dis_x_volume = self.h_dis_x_flat.reshape(self.N_tuple)
 			self.h_dis_y_volume = self.h_dis_y_flat.reshape(self.N_tuple)
 		else:
@@ -222,7 +330,7 @@ class DynamicsGenerator(object):
 		np.random.seed()
 
 		self.beta_volume = self.beta_disorder_array + self.beta_amplitude
-		self.beta_flat = self.beta_volume.flatten()
+		self.beta_flat = self.beta_volume.flatten().astype(self.FloatPrecision)
 		self.beta = self.beta_flat.copy()
 
 
@@ -262,14 +370,74 @@ class DynamicsGenerator(object):
 
 	def generate_disorder(self):
 		np.random.seed(self.disorder_seed)
-		self.e_disorder = -self.W  + 2. * self.W * np.random.rand(self.N_tuple[0], self.N_tuple[1], self.N_tuple[2])
+		self.e_disorder = (-self.W  + 2. * self.W * np.random.rand(self.N_tuple[0], self.N_tuple[1], self.N_tuple[2])).astype(self.FloatPrecision)
 		self.e_disorder_flat = self.e_disorder.flatten()
 		np.random.seed()
 
+	@property
+	def polar(self):
+		# the polar cache bound to the current X, Y arrays
+		return self.polar_view.attach(self.X, self.Y)
+
+	def invalidate(self, slot=None):
+		# marks RHO, THETA of a time slot (all slots for None) as stale; every write into X, Y outside the
+		# generator methods (e.g. lyap.X *= 0 in the scripts) has to be followed by invalidate
+		self.polar.invalidate(slot)
+
+	@property
+	def RHO(self):
+		return self.polar.rho()
+
+	@RHO.setter
+	def RHO(self, value):
+		self.polar.set_rho(value)
+
+	@property
+	def THETA(self):
+		return self.polar.theta()
+
+	@THETA.setter
+	def THETA(self, value):
+		self.polar.set_theta(value)
+
+	def load_XY(self, slot, out):
+		# psi = (x, y) of a stored slot, written into the integrator buffer out
+		np.copyto(out[:self.N_wells].reshape(self.N_tuple), self.X[:,:,:,slot])
+		np.copyto(out[self.N_wells:].reshape(self.N_tuple), self.Y[:,:,:,slot])
+		return out
+
+	def load_polar(self, slot, out):
+		rho, theta = self.polar.slot(slot)
+		np.copyto(out[:self.N_wells].reshape(self.N_tuple), rho)
+		np.copyto(out[self.N_wells:].reshape(self.N_tuple), theta)
+		return out
+
 	def set_init_XY(self, x, y):
 		self.X[:,:,:,0] = x.reshape(self.N_tuple)
 		self.Y[:,:,:,0] = y.reshape(self.N_tuple)
-		self.RHO[:,:,:,0], self.THETA[:,:,:,0] = self.from_XY_to_polar(self.X[:,:,:,0], self.Y[:,:,:,0])
+		self.polar.invalidate(0)
+
+	def reset_init_XY(self, x, y):
+		# clears the stored trajectory and restarts it from (x, y), as the scripts do between two runs
+		self.X[:] = 0
+		self.Y[:] = 0
+		self.polar.invalidate()
+		self.icurr = 0
+		self.inext = 1
+		self.set_init_XY(x, y)
+
+	def two_slot_storage(self):
+		# X, Y hold only the current and the next step (calculation_type='lyap' or a trajectory_sink)
+		return (self.calculation_type == 'lyap') or self.streaming
+
+	def last_XY(self):
+		# the last state of the latest run_dynamics / run_relaxation: the slot icurr for the two-slot
+		# storage, step n_steps - 1 for the full one
+		if self.two_slot_storage():
+			islot = self.icurr
+		else:
+			islot = self.n_steps - 1
+		return self.X[:, :, :, islot].copy(), self.Y[:, :, :, islot].copy()
 
 	def from_polar_to_XY(self, rho, theta):
 		rho = np.abs(rho)
@@ -315,12 +483,13 @@ class DynamicsGenerator(object):
 		elif kind =='FM':
 			theta += 0.1 * np.pi * np.random.randn(self.N_tuple[0], self.N_tuple[1], self.N_tuple[2])
 
-		self.RHO[:,:,:,0] = rho.reshape(self.N_tuple)
-		self.THETA[:,:,:,0] = theta.reshape(self.N_tuple)
-		self.X[:,:,:,0], self.Y[:,:,:,0] = self.from_polar_to_XY(self.RHO[:,:,:,0], self.THETA[:,:,:,0])
+		self.polar.store(0, rho, theta)
+		self.X[:,:,:,0], self.Y[:,:,:,0] = self.from_polar_to_XY(*self.polar.slot(0))
 		self.E_calibr = 1.0 * energy_per_site * self.N_wells
 
-	def rk4_step_exp(self, y0, *args):
+	def rk4_step_exp(self, y0, *args, t=0., out=None):
+		if self.use_matrix_operations:
+			return self.rk4.step(self.conservative_polar_out, t, y0, self.step, out=out)
 		h = self.step
 		self.psi = y0
 		k1 = h * self.Hamiltonian_fast()
@@ -340,7 +509,9 @@ class DynamicsGenerator(object):
 		yi = y0 + (k1 + 2.*k2 + 2.*k3 + k4)/6.
 		return yi
 
-	def rk4_step_exp_XY(self, y0, *args):
+	def rk4_step_exp_XY(self, y0, *args, t=0., out=None):
+		if self.use_matrix_operations:
+			return self.rk4.step(self.conservative_XY_out, t, y0, self.step, out=out)
 		h = self.step
 		self.psi = y0
 		k1 = h * self.HamiltonianXY_fast()
@@ -360,7 +531,32 @@ class DynamicsGenerator(object):
 		yi = y0 + (k1 + 2.*k2 + 2.*k3 + k4)/6.
 		return yi
 
-	def rk4_relax_step_exp(self, y0, *args):
+	def adaptive_step_exp(self, y0, rhs, t=0., out=None):
+		# advance by self.step on the output grid with the adaptive stepper; the internal steps are
+		# continued across calls and restarted when the right-hand side (XY/polar switch) or the time changes
+		if (rhs != self.adaptive_rhs) or (self.adaptive_t is None) or (np.abs(t - self.adaptive_t) > 1e-6 * self.step):
+			self.adaptive_stepper.reset(rhs, t, y0)
+			self.adaptive_rhs = rhs
+		if out is None:
+			out = np.empty_like(y0)
+		self.adaptive_stepper.advance_to(t + self.step, out)
+		self.adaptive_t = t + self.step
+		return out
+
+	def fft_hopping_XY(self, psi, dt, h_dis_x_flat, h_dis_y_flat):
+		return self.fft_hopper.propagate(psi, dt, self.J, self.anisotropy, h_dis_x_flat, h_dis_y_flat)
+
+	def split_step_XY(self, y0, *args, t=0., out=None):
+		# symplectic Strang step of the conservative equations; the external field term
+		# is not part of the splitting, fall back to RK4 then
+		if (self.h_ext_x != 0.) or (self.h_ext_y != 0.):
+			return self.rk4_step_exp_XY(y0, t=t, out=out)
+		return self.split_stepper.step(y0, self.step, self.beta_flat, self.e_disorder_flat,
+									   self.h_dis_x_flat, self.h_dis_y_flat, out=out)
+
+	def rk4_relax_step_exp(self, y0, *args, t=0., out=None):
+		if self.use_matrix_operations:
+			return self.rk4.step(self.relaxation_polar_out, t, y0, self.step, out=out)
 		h = self.step
 		self.psi = y0
 		k1 = h * self.Relaxation_fast()
@@ -396,7 +592,9 @@ class DynamicsGenerator(object):
 		yi = y0 + (k1 + 2.*k2 + 2.*k3 + k4)/6.
 		return yi
 
-	def rk4_slow_relax_step_exp(self, y0, *args):
+	def rk4_slow_relax_step_exp(self, y0, *args, t=0., out=None):
+		if self.use_matrix_operations:
+			return self.rk4.step(self.full_polar_out, t, y0, self.step, out=out)
 		h = self.step
 		self.psi = y0
 		k1 = h * (self.Relaxation_fast() + self.Hamiltonian_fast())
@@ -416,8 +614,9 @@ class DynamicsGenerator(object):
 		yi = y0 + (k1 + 2.*k2 + 2.*k3 + k4)/6.
 		return yi
 
-	def rk4_relax_step_exp_XY(self, y0, *args):
-
+	def rk4_relax_step_exp_XY(self, y0, *args, t=0., out=None):
+		if self.use_matrix_operations:
+			return self.rk4.step(self.relaxation_XY_out, t, y0, self.step, out=out)
 		h = self.step
 		self.psi = y0
 		k1 = h * self.RelaxationXY_fast()
@@ -437,8 +636,9 @@ class DynamicsGenerator(object):
 		yi = y0 + (k1 + 2.*k2 + 2.*k3 + k4)/6.
 		return yi
 
-	def rk4_slow_relax_step_exp_XY(self, y0, *args):
-
+	def rk4_slow_relax_step_exp_XY(self, y0, *args, t=0., out=None):
+		if self.use_matrix_operations:
+			return self.rk4.step(self.full_XY_out, t, y0, self.step, out=out)
 		h = self.step
 		self.psi = y0
 		k1 = h * (self.RelaxationXY_fast() + self.HamiltonianXY_fast())
@@ -464,7 +664,7 @@ class DynamicsGenerator(object):
 				psi = self.rk4_step_exp_XY(np.hstack((self.X[:,:,:,i-1].flatten(), self.Y[:,:,:,i-1].flatten())))
 				self.X[:,:,:,i] = psi[:self.N_wells].reshape(self.N_tuple)
 				self.Y[:,:,:,i] = psi[self.N_wells:].reshape(self.N_tuple)
-				self.RHO[:,:,:,i], self.THETA[:,:,:,i] = self.from_XY_to_polar(self.X[:,:,:,i], self.Y[:,:,:,i])
+				self.polar.invalidate(i)
 			else:
 				psi = self.rk4_step_exp(np.hstack((self.RHO[:,:,:,i-1].flatten(), self.THETA[:,:,:,i-1].flatten())))
 				self.RHO[:,:,:,i] = psi[:self.N_wells].reshape(self.N_tuple)
@@ -473,19 +673,27 @@ class DynamicsGenerator(object):
 		self.energy, self.number_of_particles, self.angular_momentum = self.calc_constants_of_motion(self.RHO, self.THETA, self.X, self.Y)
 
 	def full_eq_of_motion(self, ts, y0):#y0, ts):
+		if self.use_matrix_operations:
+			return self.HamiltonianWithRelaxationXY_fused(y0, np.empty_like(y0), time=ts)
 		self.psi = y0
 		return self.RelaxationXY_fast(time=ts) + self.HamiltonianXY_fast(time=ts)
 
 	def J_func_full_eq_of_motion(self, ts, y0):#y0, ts):
+		if self.use_sparse_jacobian:
+			return self.SparseJacobianWithRelaxXY(y0, time=ts)
 		self.psiJac = y0
 		self.FullJacobianWithRelaxXY_fast()
 		return self.dFdXY
 
 	def full_eq_of_motion_conservative(self, ts, y0):#y0, ts):
+		if self.use_matrix_operations:
+			return self.HamiltonianWithRelaxationXY_fused(y0, np.empty_like(y0), conservative=True)
 		self.psi = y0
 		return self.HamiltonianXY_fast()
 
 	def J_func_full_eq_of_motion_conservative(self, ts, y0):#y0, ts):
+		if self.use_sparse_jacobian:
+			return self.SparseJacobianWithRelaxXY(y0, time=ts, conservative=True)
 		self.psiJac = y0
 		gamma_tmp = self.gamma
 		self.gamma = 0
@@ -493,7 +701,25 @@ class DynamicsGenerator(object):
 		self.gamma = gamma_tmp
 		return self.dFdXY
 
-	def run_dynamics(self, no_pert=False):
+	def run_dynamics(self, no_pert=False, resume=False):
+		# resume=True continues from the last checkpoint of checkpoint_store (if there is one)
+		state = None
+		if resume:
+			if (self.checkpoint_store is None) or (self.integrator != 'personal') or (self.gpu_integrator == 'torch'):
+				raise ValueError('Resuming from a checkpoint needs checkpoint_store and integrator=personal')
+			state = self.checkpoint_store.load_latest()
+			history = [self.checkpoint_store.load(path) for path in self.checkpoint_store.list()]
+
+		if (self.gpu_integrator != 'torch') and (self.integrator == 'scipy') and self.chunked_integration:
+			print('Running scipy chunked')
+			self.set_constants_of_motion_local(0, 0)
+			self.icurr = 0
+			self.inext = 1
+			self.push_snapshot(0, 0)
+			self.run_scipy_chunked(self.full_eq_of_motion_conservative, self.J_func_full_eq_of_motion_conservative,
+								   self.n_steps, self.store_chunked_state)
+			return
+
 		if self.gpu_integrator == 'torch':
 			print('Running torch')
 
@@ -504,7 +730,7 @@ class DynamicsGenerator(object):
 			conservative_ODE = DGPE_ODE(self.torch_device, self.N_wells, self.J, self.anisotropy, self.gamma,
 				 self.nn_idx_1, self.nn_idx_2, self.nn_idy_1, self.nn_idy_2, self.nn_idz_1, self.nn_idz_2,
 				 self.h_dis_x_flat, self.h_dis_y_flat,
-				 self.beta_disorder_array_flattened, self.beta_flat, self.e_disorder_flat)
+				 self.beta_disorder_array_flattened, self.beta_flat, self.e_disorder_flat).to(self.torch_FloatPrecision)
 
 			ODE_result_object = torchdiffeq.odeint(
 										  # self.torch_HamiltonianXY_fast,
@@ -550,50 +776,71 @@ class DynamicsGenerator(object):
 		# ODE_result = odeint(self.full_eq_of_motion, psi0, ts, Dfun=self.J_func_full_eq_of_motion,
 		#                     h0=1e-4, hmin=1e-5, hmax=1e-3)
 
-		self.set_constants_of_motion_local(0, 0)
+		if state is None:
+			self.set_constants_of_motion_local(0, 0)
 
 
 		if self.use_matrix_operations_for_energy:
-			self.X = np.moveaxis(ODE_result[:,:self.N_wells], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
-			self.Y = np.moveaxis(ODE_result[:,self.N_wells:], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
-			self.icurr = self.n_steps - 1
-			self.inext = self.n_steps
+			if self.streaming:
+				self.push_trajectory_block(ODE_result, ODE_result.shape[0])
+			else:
+				self.X = np.moveaxis(ODE_result[:,:self.N_wells], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
+				self.Y = np.moveaxis(ODE_result[:,self.N_wells:], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
+				self.icurr = self.n_steps - 1
+				self.inext = self.n_steps
 			self.energy = self.calc_energy_XY_global(ODE_result)
 			self.number_of_particles = self.calc_nop_XY_global(ODE_result)
 		else:
-			icurr = 0
-			inext = 1
-			self.icurr = 0
-			self.inext = 1
-			for i in range(1, self.n_steps):
+			# the integrator state is carried in psiNextXY or psiNext and reloaded from X, Y (RHO, THETA) only on a switch
+			if state is None:
+				icurr = 0
+				inext = 1
+				self.icurr = 0
+				self.inext = 1
+				self.push_snapshot(0, 0)
+				psi_form = None
+				i_start = 1
+				self.checkpoint_first_step = 0
+			else:
+				i_start, icurr, inext, psi_form = self.set_checkpoint_state(state, history)
+				self.checkpoint_first_step = i_start
+			for i in range(i_start, self.n_steps):
 				if self.integrator == 'scipy':
 					psi = ODE_result[i,:]
 					self.X[:,:,:,inext] = psi[:self.N_wells].reshape(self.N_tuple)
 					self.Y[:,:,:,inext] = psi[self.N_wells:].reshape(self.N_tuple)
-					self.RHO[:,:,:,inext], self.THETA[:,:,:,inext] = self.from_XY_to_polar(self.X[:,:,:,inext], self.Y[:,:,:,inext])
+					self.polar.invalidate(inext)
 				elif self.integrator == 'personal':
-					if (np.any(self.RHO[:,:,:,icurr] ** 2 < self.threshold_XY_to_polar)):
-						if (i == 1):
-							self.psiNextXY = np.hstack((self.X[:, :, :, 0].flatten(), self.Y[:, :, :, 0].flatten()))
-						psi = self.rk4_step_exp_XY(self.psiNextXY)
+					if self.split_step or self.polar.below_threshold(icurr, self.threshold_XY_to_polar):
+						if psi_form != 'XY':
+							self.load_XY(icurr, self.psiNextXY)
+							psi_form = 'XY'
+						if self.split_step:
+							psi = self.split_step_XY(self.psiNextXY, t=(i - 1) * self.step, out=self.psiNextXY)
+						elif self.adaptive_method is not None:
+							psi = self.adaptive_step_exp(self.psiNextXY, self.conservative_XY_out, t=(i - 1) * self.step, out=self.psiNextXY)
+						else:
+							psi = self.rk4_step_exp_XY(self.psiNextXY, t=(i - 1) * self.step, out=self.psiNextXY)
 						self.psiNextXY = psi
 						self.X[:,:,:,inext] = psi[:self.N_wells].reshape(self.N_tuple)
 						self.Y[:,:,:,inext] = psi[self.N_wells:].reshape(self.N_tuple)
-						self.RHO[:,:,:,inext], self.THETA[:,:,:,inext] = self.from_XY_to_polar(self.X[:,:,:,inext], self.Y[:,:,:,inext])
-						self.psiNext = np.hstack((self.RHO[:,:,:,inext].flatten(), self.THETA[:,:,:,inext].flatten()))
+						self.polar.invalidate(inext)
 					else:
-						if (i == 1):
-							self.psiNext = np.hstack((self.RHO[:,:,:,0].flatten(), self.THETA[:,:,:,0].flatten()))
-						psi = self.rk4_step_exp(self.psiNext)
+						if psi_form != 'polar':
+							self.load_polar(icurr, self.psiNext)
+							psi_form = 'polar'
+						if self.adaptive_method is not None:
+							psi = self.adaptive_step_exp(self.psiNext, self.conservative_polar_out, t=(i - 1) * self.step, out=self.psiNext)
+						else:
+							psi = self.rk4_step_exp(self.psiNext, t=(i - 1) * self.step, out=self.psiNext)
 						self.psiNext = psi
-						self.RHO[:,:,:,inext] = psi[:self.N_wells].reshape(self.N_tuple)
-						self.THETA[:,:,:,inext] = psi[self.N_wells:].reshape(self.N_tuple)
-						self.X[:,:,:,inext], self.Y[:,:,:,inext] = self.from_polar_to_XY(self.RHO[:,:,:,inext], self.THETA[:,:,:,inext])
-						self.psiNextXY = np.hstack((self.X[:,:,:,inext].flatten(), self.Y[:,:,:,inext].flatten()))
+						self.polar.store(inext, psi[:self.N_wells], psi[self.N_wells:])
+						self.X[:,:,:,inext], self.Y[:,:,:,inext] = self.from_polar_to_XY(*self.polar.slot(inext))
 
 				self.set_constants_of_motion_local(i, inext)
+				self.push_snapshot(i, inext)
 
-				if self.calculation_type == 'lyap':
+				if (self.calculation_type == 'lyap') or self.streaming:
 					icurr = 1 - icurr
 					inext = 1 - inext
 					self.icurr = 1 - self.icurr
@@ -605,6 +852,94 @@ class DynamicsGenerator(object):
 					self.icurr = icurr + 1
 					self.inext = inext + 1
 
+				if (self.checkpoint_store is not None) and (self.integrator == 'personal') and self.checkpoint_store.due(i):
+					self.checkpoint_store.save(i, self.get_checkpoint_state(i + 1, icurr, inext, psi_form))
+					self.checkpoint_first_step = i + 1
+
+	def get_checkpoint_state(self, i, icurr, inext, psi_form):
+		# state of run_dynamics before step i as a flat dict of arrays for CheckpointStore: the carried
+		# integrator state, the disorder, the global RNG, the adaptive stepper, the number of snapshots in the
+		# trajectory_sink and the steps checkpoint_first_step, ..., i - 1 of the observables and of the
+		# full-history X, Y written since the previous checkpoint (the two-slot X, Y are saved whole).
+		# RHO, THETA are rebuilt from X, Y by the polar view.
+		i_first = self.checkpoint_first_step
+		rng = np.random.get_state()
+		state = {'step_index': np.array(i), 'first_step': np.array(i_first),
+				 'slots': np.array([icurr, inext, self.icurr, self.inext]),
+				 'psi_form': np.array('' if psi_form is None else psi_form),
+				 'step': np.array(self.step), 'J': np.array(self.J), 'anisotropy': np.array(self.anisotropy),
+				 'gamma': np.array(self.gamma),
+				 'psiNextXY': self.psiNextXY, 'psiNext': self.psiNext,
+				 'e_disorder': self.e_disorder, 'beta_flat': self.beta_flat, 'beta': self.beta,
+				 'beta_disorder_array_flattened': self.beta_disorder_array_flattened,
+				 'h_dis_x_flat': self.h_dis_x_flat, 'h_dis_y_flat': self.h_dis_y_flat,
+				 'rng_keys': rng[1], 'rng_pos': np.array(rng[2]), 'rng_has_gauss': np.array(rng[3]),
+				 'rng_cached_gaussian': np.array(rng[4])}
+		if self.two_slot_storage():
+			state['X'] = self.X
+			state['Y'] = self.Y
+		else:
+			state['X_block'] = self.X[..., i_first:i]
+			state['Y_block'] = self.Y[..., i_first:i]
+		for name in CHECKPOINT_OBSERVABLES:
+			state[name + '_block'] = getattr(self, name)[i_first:i]
+		if self.streaming:
+			state['sink_n_pushed'] = np.array(self.trajectory_sink.n_pushed)
+		if (self.adaptive_method is not None) and (self.adaptive_rhs is not None):
+			for key, value in self.adaptive_stepper.get_state().items():
+				state['adaptive_' + key] = value
+			state['adaptive_rhs_name'] = np.array(self.adaptive_rhs.__name__)
+			state['adaptive_output_t'] = np.array(self.adaptive_t)
+		return state
+
+	def set_checkpoint_state(self, state, history):
+		# restores the state of get_checkpoint_state, with the steps before it from the blocks of the
+		# checkpoints in history (all of them in order, up to and including state);
+		# returns i, icurr, inext, psi_form to continue run_dynamics
+		i_next = 0
+		for checkpoint in history:
+			i_first = int(checkpoint['first_step'])
+			i = int(checkpoint['step_index'])
+			if i_first != i_next:
+				raise ValueError('The checkpoints of steps ' + str(i_next) + '..' + str(i_first - 1) +
+								 ' were removed (keep_last), run_dynamics cannot be resumed')
+			if not self.two_slot_storage():
+				self.X[..., i_first:i] = checkpoint['X_block']
+				self.Y[..., i_first:i] = checkpoint['Y_block']
+			for name in CHECKPOINT_OBSERVABLES:
+				getattr(self, name)[i_first:i] = checkpoint[name + '_block']
+			i_next = i
+		if i_next != int(state['step_index']):
+			raise ValueError('The checkpoint history does not end with the latest checkpoint')
+
+		self.step = state['step'][()]
+		self.J = state['J'][()]
+		self.anisotropy = state['anisotropy'][()]
+		self.gamma = state['gamma'][()]
+		if self.two_slot_storage():
+			self.X[:] = state['X']
+			self.Y[:] = state['Y']
+		self.polar.invalidate()
+		self.psiNextXY = state['psiNextXY'].copy()
+		self.psiNext = state['psiNext'].copy()
+		for name in ['e_disorder', 'beta_flat', 'beta', 'beta_disorder_array_flattened', 'h_dis_x_flat', 'h_dis_y_flat']:
+			setattr(self, name, state[name].copy())
+		self.e_disorder_flat = self.e_disorder.flatten()
+		np.random.set_state(('MT19937', state['rng_keys'], int(state['rng_pos']), int(state['rng_has_gauss']),
+							 float(state['rng_cached_gaussian'])))
+		if self.streaming and ('sink_n_pushed' in state):
+			# the snapshots pushed after the checkpoint are dropped, run_dynamics pushes them again
+			self.trajectory_sink.seek(int(state['sink_n_pushed']))
+		if 'adaptive_rhs_name' in state:
+			rhs = getattr(self, str(state['adaptive_rhs_name']))
+			self.adaptive_stepper.set_state(rhs, {key[len('adaptive_'):]: value for key, value in state.items()
+												   if key.startswith('adaptive_')})
+			self.adaptive_rhs = rhs
+			self.adaptive_t = state['adaptive_output_t'][()]
+		icurr, inext, self.icurr, self.inext = [int(n) for n in state['slots']]
+		psi_form = str(state['psi_form'])
+		return int(state['step_index']), icurr, inext, (psi_form if psi_form != '' else None)
+
 
 	def run_quench(self, no_pert=False, E_desired=0,temperature_dependent_rate=False, N_max=1e+7):
 		self.set_constants_of_motion_local(0, 0)
@@ -622,39 +957,45 @@ class DynamicsGenerator(object):
 		inext = 1
 		self.icurr = 0
 		self.inext = 1
+		self.push_snapshot(0, 0)
 
+		psi_form = None
 		i = 1
 		while ((Ecurr - E_desired) * (Enext - E_desired) > 0) and (i < N_max):
 
-			self.set_constants_of_motion_local(i - 1, icurr)
+			# energy[i - 1] was set on the previous step (or before the loop), the state icurr is unchanged since
 			Ecurr = self.energy[i-1]
 
-			if (np.any(self.RHO[:, :, :, icurr] ** 2 < self.threshold_XY_to_polar)):
-				if (i == 1):
-					self.psiNextXY = np.hstack((self.X[:, :, :, 0].flatten(), self.Y[:, :, :, 0].flatten()))
-				psi = self.rk4_relax_step_exp_XY(self.psiNextXY)
+			if self.polar.below_threshold(icurr, self.threshold_XY_to_polar):
+				if psi_form != 'XY':
+					self.load_XY(icurr, self.psiNextXY)
+					psi_form = 'XY'
+				if self.adaptive_method is not None:
+					psi = self.adaptive_step_exp(self.psiNextXY, self.relaxation_XY_out, t=(i - 1) * self.step, out=self.psiNextXY)
+				else:
+					psi = self.rk4_relax_step_exp_XY(self.psiNextXY, t=(i - 1) * self.step, out=self.psiNextXY)
 				self.psiNextXY = psi
 				self.X[:, :, :, inext] = psi[:self.N_wells].reshape(self.N_tuple)
 				self.Y[:, :, :, inext] = psi[self.N_wells:].reshape(self.N_tuple)
-				self.RHO[:, :, :, inext], self.THETA[:, :, :, inext] = self.from_XY_to_polar(self.X[:, :, :, inext],
-																							 self.Y[:, :, :, inext])
-				self.psiNext = np.hstack((self.RHO[:, :, :, inext].flatten(), self.THETA[:, :, :, inext].flatten()))
+				self.polar.invalidate(inext)
 			else:
-				if (i == 1):
-					self.psiNext = np.hstack((self.RHO[:, :, :, 0].flatten(), self.THETA[:, :, :, 0].flatten()))
-				psi = self.rk4_relax_step_exp(self.psiNext)
+				if psi_form != 'polar':
+					self.load_polar(icurr, self.psiNext)
+					psi_form = 'polar'
+				if self.adaptive_method is not None:
+					psi = self.adaptive_step_exp(self.psiNext, self.relaxation_polar_out, t=(i - 1) * self.step, out=self.psiNext)
+				else:
+					psi = self.rk4_relax_step_exp(self.psiNext, t=(i - 1) * self.step, out=self.psiNext)
 				self.psiNext = psi
-				self.RHO[:, :, :, inext] = psi[:self.N_wells].reshape(self.N_tuple)
-				self.THETA[:, :, :, inext] = psi[self.N_wells:].reshape(self.N_tuple)
-				self.X[:, :, :, inext], self.Y[:, :, :, inext] = self.from_polar_to_XY(self.RHO[:, :, :, inext],
-																					   self.THETA[:, :, :, inext])
-				self.psiNextXY = np.hstack((self.X[:, :, :, inext].flatten(), self.Y[:, :, :, inext].flatten()))
+				self.polar.store(inext, psi[:self.N_wells], psi[self.N_wells:])
+				self.X[:, :, :, inext], self.Y[:, :, :, inext] = self.from_polar_to_XY(*self.polar.slot(inext))
 
 
 			self.set_constants_of_motion_local(i, inext)
+			self.push_snapshot(i, inext)
 			Enext = self.energy[i]
 
-			if self.calculation_type == 'lyap':
+			if (self.calculation_type == 'lyap') or self.streaming:
 				icurr = 1 - icurr
 				inext = 1 - inext
 				self.icurr = 1 - self.icurr
@@ -692,6 +1033,9 @@ class DynamicsGenerator(object):
 		self.E_desired = E_desired
 		self.temperature_dependent_rate = temperature_dependent_rate
 		self.gamma_reduction = 1./(Ecurr - self.E_desired)
+		# time and state of the E_desired crossing, if the integration was stopped by it
+		self.t_crossing = None
+		self.psi_crossing = None
 
 		if (E_desired - Ecurr) * self.gamma > 0:
 			self.gamma = -self.gamma
@@ -703,6 +1047,16 @@ class DynamicsGenerator(object):
 		# 	if self.gamma < 0:
 		# 		self.gamma = - self.gamma
 
+		if (self.gpu_integrator != 'torch') and (self.integrator == 'scipy') and self.chunked_integration:
+			print('Running scipy chunked')
+			self.icurr = 0
+			self.inext = 1
+			self.push_snapshot(0, 0)
+			self.n_steps = self.run_scipy_chunked(self.full_eq_of_motion, self.J_func_full_eq_of_motion,
+												  min(int(N_max), self.n_steps), self.store_chunked_state_relaxation)
+			self.temperature_dependent_rate = False
+			return
+
 		if self.gpu_integrator == 'torch':
 			print('Running torch')
 			psi0 = np.hstack((self.X[:, :, :, 0].flatten(), self.Y[:, :, :, 0].flatten()))
@@ -714,17 +1068,43 @@ class DynamicsGenerator(object):
 										self.nn_idz_2,
 										self.h_dis_x_flat, self.h_dis_y_flat,
 										self.beta_disorder_array_flattened, self.beta_flat, self.e_disorder_flat,
-										self.E_desired, self.gamma_reduction, self.lam1, self.lam2, self.smooth_quench, self.temperature_dependent_rate)
-
-			ODE_result_object = torchdiffeq.odeint(relaxational_ODE,
-											# self.torch_Hamiltonian_with_Relaxation_XY_fast,
-												   torch.from_numpy(psi0).type(self.torch_FloatPrecision).to(self.torch_device),#, dtype=self.torch_FloatPrecision),
-												   torch.from_numpy(ts).type(self.torch_FloatPrecision).to(self.torch_device),# dtype=self.torch_FloatPrecision),
-												   rtol=self.rtol,
-												   atol=self.atol
-												   )
-
-			ODE_result = ODE_result_object.detach().cpu().numpy()
+										self.E_desired, self.gamma_reduction, self.lam1, self.lam2, self.smooth_quench, self.temperature_dependent_rate).to(self.torch_FloatPrecision)
+
+			# the window is integrated in chunks of relaxation_chunk steps, so that the integration
+			# stops at the first chunk where the energy crosses E_desired
+			ts_torch = torch.from_numpy(ts).type(self.torch_FloatPrecision).to(self.torch_device)
+			psi = torch.from_numpy(psi0).type(self.torch_FloatPrecision).to(self.torch_device)
+			ODE_result_chunks = [psi0.reshape(1, -1)]
+			n = 1
+			while n < N_max:
+				n_next = min(n + self.relaxation_chunk, int(N_max))
+				with torch.no_grad():
+					ODE_result_object = torchdiffeq.odeint(relaxational_ODE, psi, ts_torch[n - 1:n_next],
+														   rtol=self.rtol,
+														   atol=self.atol
+														   )
+				ODE_result_chunk = ODE_result_object.detach().cpu().numpy()
+				Echunk = self.calc_energy_XY_global(ODE_result_chunk)
+				idx_desired = np.nonzero((Echunk[:-1] - self.E_desired) * (Echunk[1:] - self.E_desired) < 0)[0]
+				if self.use_matrix_operations_for_energy and (len(idx_desired) > 0):
+					k = idx_desired[0]
+					ODE_result_chunks.append(ODE_result_chunk[1:k + 1])
+					with torch.no_grad():
+						t_crossing, ODE_result_object = torchdiffeq.odeint_event(relaxational_ODE, ODE_result_object[k],
+																				 ts_torch[n - 1 + k],
+																				 event_fn=relaxational_ODE.energy_event,
+																				 rtol=self.rtol,
+																				 atol=self.atol
+																				 )
+					self.t_crossing = t_crossing.item()
+					self.psi_crossing = ODE_result_object[-1].detach().cpu().numpy()
+					ODE_result_chunks.append(self.psi_crossing.reshape(1, -1))
+					break
+				ODE_result_chunks.append(ODE_result_chunk[1:])
+				psi = ODE_result_object[-1]
+				n = n_next
+
+			ODE_result = np.vstack(ODE_result_chunks)
 
 		elif self.integrator == 'scipy':
 			print('Running scipy')
@@ -733,7 +1113,8 @@ class DynamicsGenerator(object):
 			self.T[:N_max] = ts
 			# ODE_result = odeint(self.full_eq_of_motion, psi0, ts, Dfun=self.J_func_full_eq_of_motion,
 			#                     h0=0.001, hmin=1e-5, hmax=5e-2)
-			ODE_result_object = solve_ivp(self.full_eq_of_motion, (np.min(ts), np.max(ts)+0.01), psi0,
+			# the span ends at ts[-1], so that a crossing found by the terminal event lies within T[:N_max]
+			ODE_result_object = solve_ivp(self.full_eq_of_motion, (np.min(ts), np.max(ts)), psi0,
 										  method=self.integration_method,
 										  rtol=self.rtol,
 										  atol=self.atol,
@@ -744,42 +1125,58 @@ class DynamicsGenerator(object):
 										  # method='LSODA',
 										  # rtol=1e-6, atol=1e-6,
 										  # rtol=1e-6, atol=1e-6,
-										  t_eval=ts, jac=self.J_func_full_eq_of_motion)
+										  t_eval=ts, jac=self.J_func_full_eq_of_motion,
+										  events=self.energy_crossing_event if self.use_matrix_operations_for_energy else None)
 			ODE_result = ODE_result_object.y.T
+			if ODE_result_object.status == 1:
+				# stopped by the terminal event: the exact crossing state is appended as the last row
+				self.t_crossing = ODE_result_object.t_events[0][0]
+				self.psi_crossing = ODE_result_object.y_events[0][0]
+				ODE_result = np.vstack((ODE_result, self.psi_crossing.reshape(1, -1)))
 
 		if self.use_matrix_operations_for_energy:
-			self.X = np.moveaxis(ODE_result[:,:self.N_wells], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
-			self.Y = np.moveaxis(ODE_result[:,self.N_wells:], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
+			if self.t_crossing is not None:
+				self.T[ODE_result.shape[0] - 1] = self.t_crossing
+			if not self.streaming:
+				self.X = np.moveaxis(ODE_result[:,:self.N_wells], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
+				self.Y = np.moveaxis(ODE_result[:,self.N_wells:], 0, -1).reshape(self.N_tuple + (ODE_result.shape[0],))
 			self.energy = self.calc_energy_XY_global(ODE_result)
 			self.number_of_particles = self.calc_nop_XY_global(ODE_result)
-			idx_desired = np.nonzero((self.energy[:-1] - self.E_desired) * (self.energy[1:] - self.E_desired) < 0)[0]
-			try:
-				self.n_steps = idx_desired[0]
-			except:
-				self.n_steps = 1
-			self.icurr = self.n_steps - 1
-			self.inext = self.n_steps
+			if self.t_crossing is not None:
+				self.n_steps = ODE_result.shape[0]
+			else:
+				idx_desired = np.nonzero((self.energy[:-1] - self.E_desired) * (self.energy[1:] - self.E_desired) < 0)[0]
+				try:
+					self.n_steps = idx_desired[0]
+				except:
+					self.n_steps = 1
+			if self.streaming:
+				self.push_trajectory_block(ODE_result, self.n_steps)
+			else:
+				self.icurr = self.n_steps - 1
+				self.inext = self.n_steps
 		else:
 			icurr = 0
 			inext = 1
 			self.icurr = 0
 			self.inext = 1
+			self.push_snapshot(0, 0)
 
 			if self.integrator == 'scipy':
 				i = 1
 				while ((Ecurr - E_desired) * (Enext - E_desired) > 0) and (i < N_max):
-					self.set_constants_of_motion_local(i - 1, icurr)
+					# energy[i - 1] was set on the previous step (or before the loop), the state icurr is unchanged since
 					Ecurr = self.energy[i - 1]
 					psi = ODE_result[i, :]
 					self.X[:, :, :, inext] = psi[:self.N_wells].reshape(self.N_tuple)
 					self.Y[:, :, :, inext] = psi[self.N_wells:].reshape(self.N_tuple)
-					self.RHO[:, :, :, inext], self.THETA[:, :, :, inext] = self.from_XY_to_polar(self.X[:, :, :, inext],
-																								 self.Y[:, :, :, inext])
+					self.polar.invalidate(inext)
 
 					self.set_constants_of_motion_local(i, inext)
+					self.push_snapshot(i, inext)
 					Enext = self.energy[i]
 
-					if self.calculation_type == 'lyap':
+					if (self.calculation_type == 'lyap') or self.streaming:
 						icurr = 1 - icurr
 						inext = 1 - inext
 						self.icurr = 1 - self.icurr
@@ -794,36 +1191,41 @@ class DynamicsGenerator(object):
 				self.n_steps = i
 
 			elif self.integrator == 'personal':
+				psi_form = None
 				i = 1
 				while ((Ecurr - E_desired) * (Enext - E_desired) > 0) and (i < N_max):
-					self.set_constants_of_motion_local(i - 1, icurr)
+					# energy[i - 1] was set on the previous step (or before the loop), the state icurr is unchanged since
 					Ecurr = self.energy[i-1]
 
-					if (np.any(self.RHO[:, :, :, icurr] ** 2 < self.threshold_XY_to_polar)):
-						if (i == 1):
-							self.psiNextXY = np.hstack((self.X[:, :, :, 0].flatten(), self.Y[:, :, :, 0].flatten()))
-						psi = self.rk4_slow_relax_step_exp_XY(self.psiNextXY)
+					if self.polar.below_threshold(icurr, self.threshold_XY_to_polar):
+						if psi_form != 'XY':
+							self.load_XY(icurr, self.psiNextXY)
+							psi_form = 'XY'
+						if self.adaptive_method is not None:
+							psi = self.adaptive_step_exp(self.psiNextXY, self.full_XY_out, t=(i - 1) * self.step, out=self.psiNextXY)
+						else:
+							psi = self.rk4_slow_relax_step_exp_XY(self.psiNextXY, t=(i - 1) * self.step, out=self.psiNextXY)
 						self.psiNextXY = psi
 						self.X[:, :, :, inext] = psi[:self.N_wells].reshape(self.N_tuple)
 						self.Y[:, :, :, inext] = psi[self.N_wells:].reshape(self.N_tuple)
-						self.RHO[:, :, :, inext], self.THETA[:, :, :, inext] = self.from_XY_to_polar(self.X[:, :, :, inext],
-																									 self.Y[:, :, :, inext])
-						self.psiNext = np.hstack((self.RHO[:, :, :, inext].flatten(), self.THETA[:, :, :, inext].flatten()))
+						self.polar.invalidate(inext)
 					else:
-						if (i == 1):
-							self.psiNext = np.hstack((self.RHO[:, :, :, 0].flatten(), self.THETA[:, :, :, 0].flatten()))
-						psi = self.rk4_slow_relax_step_exp(self.psiNext)
+						if psi_form != 'polar':
+							self.load_polar(icurr, self.psiNext)
+							psi_form = 'polar'
+						if self.adaptive_method is not None:
+							psi = self.adaptive_step_exp(self.psiNext, self.full_polar_out, t=(i - 1) * self.step, out=self.psiNext)
+						else:
+							psi = self.rk4_slow_relax_step_exp(self.psiNext, t=(i - 1) * self.step, out=self.psiNext)
 						self.psiNext = psi
-						self.RHO[:, :, :, inext] = psi[:self.N_wells].reshape(self.N_tuple)
-						self.THETA[:, :, :, inext] = psi[self.N_wells:].reshape(self.N_tuple)
-						self.X[:, :, :, inext], self.Y[:, :, :, inext] = self.from_polar_to_XY(self.RHO[:, :, :, inext],
-																							   self.THETA[:, :, :, inext])
-						self.psiNextXY = np.hstack((self.X[:, :, :, inext].flatten(), self.Y[:, :, :, inext].flatten()))
+						self.polar.store(inext, psi[:self.N_wells], psi[self.N_wells:])
+						self.X[:, :, :, inext], self.Y[:, :, :, inext] = self.from_polar_to_XY(*self.polar.slot(inext))
 
 					self.set_constants_of_motion_local(i, inext)
+					self.push_snapshot(i, inext)
 					Enext = self.energy[i]
 
-					if self.calculation_type == 'lyap':
+					if (self.calculation_type == 'lyap') or self.streaming:
 						icurr = 1 - icurr
 						inext = 1 - inext
 						self.icurr = 1 - self.icurr
@@ -841,20 +1243,276 @@ class DynamicsGenerator(object):
 
 		self.temperature_dependent_rate = False
 
+	def run_ensemble(self, PSI0, n_steps=None, relaxation=False, method='RK4', backend='numpy', e_disorder=None,
+					 save_every=1, chunk=100):
+		# Integrates a batch of XY initial conditions PSI0[batch, 2*N_wells] together on the lattice of this
+		# generator: method='RK4' (fixed step self.step) or a scipy method name ('DOP853', 'RK45', ...) for
+		# backend='numpy', 'RK4' / 'RK45' / 'DOP853' (rk4, dopri5, dopri8) for backend='torch'.
+		# e_disorder may be given per member as [batch, N_wells]; relaxation=True adds the relaxational
+		# term with self.gamma (gamma_tempered per well for tempered cooling), the external field
+		# h_ext_x, h_ext_y is included as in full_XY_out. The time- or energy-dependent quenching factor
+		# of run_quench / run_relaxation is not applied.
+		# The per-member observables at every save_every-th step are stored in ensemble_energy,
+		# ensemble_number_of_particles and ensemble_participation_rate [n_saved, batch], the final states
+		# are returned as [batch, 2*N_wells].
+		if n_steps is None:
+			n_steps = self.n_steps
+		batch = PSI0.shape[0]
+		if e_disorder is None:
+			e_disorder_flat = self.e_disorder_flat
+		else:
+			e_disorder_flat = e_disorder.reshape(batch, self.N_wells)
+		if not relaxation:
+			gamma = 0.
+		elif self.tempered_glass_cooling == True:
+			gamma = self.gamma_tempered
+		else:
+			gamma = self.gamma
+
+		kernel = EnsembleXYKernel(batch, self.N_wells, self.nn_idx_1, self.nn_idx_2, self.nn_idy_1, self.nn_idy_2,
+								  self.nn_idz_1, self.nn_idz_2, FloatPrecision=self.FloatPrecision,
+								  dimensionality=self.kernel_dimensionality, ReductionPrecision=self.ReductionPrecision)
+		n_saved = (n_steps - 1) // save_every + 1
+		self.ensemble_T = np.arange(n_saved) * save_every * self.step
+		self.ensemble_energy = np.zeros((n_saved, batch), dtype=self.ReductionPrecision)
+		self.ensemble_number_of_particles = np.zeros((n_saved, batch), dtype=self.ReductionPrecision)
+		self.ensemble_participation_rate = np.zeros((n_saved, batch), dtype=self.ReductionPrecision)
+
+		def store(k, PSI):
+			self.ensemble_energy[k] = kernel.calc_energy(PSI, self.J, self.anisotropy, self.beta_flat, e_disorder_flat,
+														 self.h_dis_x_flat, self.h_dis_y_flat)
+			self.ensemble_number_of_particles[k] = kernel.calc_nop(PSI)
+			self.ensemble_participation_rate[k] = kernel.calc_participation_rate(PSI)
+
+		def rhs(t, y, out):
+			return kernel(y, out, self.J, self.anisotropy, self.beta_flat, e_disorder_flat,
+						  self.h_dis_x_flat, self.h_dis_y_flat, gamma, h_ext_x=self.h_ext_x, h_ext_y=self.h_ext_y)
+
+		PSI = np.array(PSI0, dtype=self.FloatPrecision).reshape(batch, 2 * self.N_wells)
+		store(0, PSI)
+
+		if backend == 'torch':
+			ensemble_ODE = DGPE_ODE_BATCH(self.torch_device, self.N_wells, self.J, self.anisotropy, gamma,
+										  self.nn_idx_1, self.nn_idx_2, self.nn_idy_1, self.nn_idy_2, self.nn_idz_1,
+										  self.nn_idz_2,
+										  self.h_dis_x_flat, self.h_dis_y_flat,
+										  self.beta_flat, e_disorder_flat,
+										  h_ext_x=self.h_ext_x, h_ext_y=self.h_ext_y,
+										  dimensionality=self.kernel_dimensionality).to(self.torch_FloatPrecision)
+			torch_method = {'RK4': 'rk4', 'RK45': 'dopri5', 'DOP853': 'dopri8'}[method]
+			options = {'step_size': self.step} if method == 'RK4' else None
+			# the last step is appended to the output times if it is not a saved one
+			ts = np.arange(n_saved) * save_every
+			if ts[-1] != n_steps - 1:
+				ts = np.append(ts, n_steps - 1)
+			ts = torch.from_numpy(ts * self.step).type(self.torch_FloatPrecision).to(self.torch_device)
+			psi = torch.from_numpy(PSI).type(self.torch_FloatPrecision).to(self.torch_device)
+			k = 0
+			while k < ts.shape[0] - 1:
+				k_next = min(k + chunk, ts.shape[0] - 1)
+				with torch.no_grad():
+					ODE_result_object = torchdiffeq.odeint(ensemble_ODE, psi, ts[k:k_next + 1],
+														   rtol=self.rtol,
+														   atol=self.atol,
+														   method=torch_method,
+														   options=options
+														   )
+				ODE_result = ODE_result_object.detach().cpu().numpy()
+				for j in range(1, ODE_result.shape[0]):
+					if k + j < n_saved:
+						store(k + j, ODE_result[j])
+				psi = ODE_result_object[-1]
+				k = k_next
+			PSI = psi.detach().cpu().numpy()
+
+		elif method == 'RK4':
+			stepper = RK4Stepper((batch, 2 * self.N_wells), FloatPrecision=self.FloatPrecision)
+			for i in range(1, n_steps):
+				stepper.step(rhs, (i - 1) * self.step, PSI, self.step, out=PSI)
+				if i % save_every == 0:
+					store(i // save_every, PSI)
+
+		else:
+			dPSI = np.zeros((batch, 2 * self.N_wells), dtype=self.FloatPrecision)
+
+			def store_chunked(i, t, psi):
+				PSI[:] = psi.reshape(batch, 2 * self.N_wells)
+				if i % save_every == 0:
+					store(i // save_every, PSI)
+				return False
+
+			self.run_scipy_chunked(lambda t, y: rhs(t, y.reshape(batch, -1), dPSI).ravel().copy(), None, n_steps,
+								   store_chunked, psi0=PSI.ravel().copy(), method=method)
+		return PSI
+
+	def run_energy_shell(self, x0, y0, E_desired, relaxation_N_max=200, n_steps=None, N_samples=1000, seed=None):
+		# One point of an energy scan: run_relaxation from (x0, y0) to the shell E_desired, run_dynamics for
+		# n_steps to equilibrate on it, then the temperatures and the order parameter |sum psi| of the final state.
+		# Returns a dict of the measured scalars and the final state x, y; 'reached' is False (with a warning)
+		# if the relaxation did not cross E_desired within relaxation_N_max steps.
+		if n_steps is None:
+			n_steps = self.n_steps
+		# run_relaxation and run_dynamics store T and their observables for every step
+		if max(relaxation_N_max, n_steps) > self.n_steps_allocated:
+			raise ValueError('relaxation_N_max = ' + str(relaxation_N_max) + ' and n_steps = ' + str(n_steps) +
+							 ' must not exceed the ' + str(self.n_steps_allocated) + ' steps the generator was built for')
+
+		self.reset_init_XY(x0, y0)
+		self.n_steps = n_steps
+		self.run_relaxation(E_desired=E_desired, N_max=relaxation_N_max)
+		relaxation_steps = self.n_steps
+		x, y = self.last_XY()
+		E_relaxed = self.energy[relaxation_steps - 1]
+		# the state of a terminal-event stop lies on the shell up to the roundoff of the event root
+		reached = (self.t_crossing is not None) or ((self.energy[0] - E_desired) * (E_relaxed - E_desired) <= 0)
+		if not reached:
+			warnings.warn('run_energy_shell: E_desired = ' + str(E_desired) + ' not reached in ' +
+						  str(relaxation_N_max) + ' relaxation steps, E = ' + str(E_relaxed))
+
+		self.reset_init_XY(x, y)
+		self.n_steps = n_steps
+		self.run_dynamics(no_pert=False)
+		x, y = self.last_XY()
+
+		T, T_Amp, T_Ph = self.calc_numerical_temperature(x, y, N_samples=N_samples, seed=seed)
+		return {'E_desired': E_desired,
+				'E_relaxed': E_relaxed,
+				'reached': reached,
+				'relaxation_steps': relaxation_steps,
+				'energy': self.energy[n_steps - 1],
+				'number_of_particles': self.number_of_particles[n_steps - 1],
+				'temperature': T,
+				'temperature_Amp': T_Amp,
+				'temperature_Ph': T_Ph,
+				'order_parameter': np.sqrt(np.sum(x) ** 2 + np.sum(y) ** 2),
+				'x': x,
+				'y': y}
+
+	def run_energy_sweep(self, energies, x0, y0, relaxation_N_max=200, n_steps=None, N_samples=1000, seed=None,
+						 n_proc=None, warm_start=False):
+		# Energy scan of GPE_phase.py / GPE_erg_time_and_phase_trans.py: run_energy_shell for every target energy.
+		# The points all start from (x0, y0) and run on a pool of n_proc forked workers (default mp.cpu_count()),
+		# which share the disorder and the neighbour table of this generator copy-on-write. warm_start=True
+		# runs them in order in this process instead, each one starting from the final state of the previous one.
+		# seed + j seeds the temperature estimate of the point j. Returns a table {column: [len(energies)]},
+		# with the final states in 'x', 'y' [len(energies), N_wells].
+		if self.streaming:
+			# the workers would all push their snapshots into the same rows of one sink
+			raise ValueError('run_energy_sweep does not support a trajectory_sink')
+		energies = np.asarray(energies, dtype=np.float64)
+		n_steps0 = self.n_steps
+		if n_steps is None:
+			n_steps = n_steps0
+		# the workers must not write their checkpoints into one directory
+		checkpoint_store = self.checkpoint_store
+		self.checkpoint_store = None
+		# the points run in this process (warm_start, n_proc=1) flip the sign of gamma and overwrite the
+		# stored trajectory and the observables of this generator, they are restored afterwards
+		saved = {}
+		for name in SWEEP_RESTORED_ATTRIBUTES:
+			value = getattr(self, name)
+			saved[name] = value.copy() if isinstance(value, np.ndarray) else value
+		tasks = [(x0, y0, E, relaxation_N_max, n_steps, N_samples, None if seed is None else seed + j)
+				 for j, E in enumerate(energies)]
+		try:
+			if warm_start or (n_proc == 1):
+				points = []
+				for task in tasks:
+					if warm_start and points:
+						task = (points[-1]['x'], points[-1]['y']) + task[2:]
+					points.append(self.run_energy_shell(*task))
+			else:
+				global _sweep_generator
+				_sweep_generator = self
+				pool = mp.get_context('fork').Pool(processes=n_proc)
+				try:
+					points = pool.map(one_energy_shell, tasks, chunksize=1)
+				finally:
+					pool.close()
+					pool.join()
+					_sweep_generator = None
+		finally:
+			self.checkpoint_store = checkpoint_store
+			self.n_steps = n_steps0
+			for name, value in saved.items():
+				setattr(self, name, value)
+			self.polar.invalidate()
+
+		table = {}
+		for key in points[0]:
+			table[key] = np.array([point[key] for point in points])
+		table['x'] = table['x'].reshape(len(points), self.N_wells)
+		table['y'] = table['y'].reshape(len(points), self.N_wells)
+		return table
+
+	def energy_crossing_event(self, ts, y0):
+		return self.calc_energy_XY_global(y0.reshape(1, -1))[0] - self.E_desired
+
+	energy_crossing_event.terminal = True
+
+	def run_scipy_chunked(self, fun, jac, N_max, callback, psi0=None, method=None):
+		# Steps the scipy solver object from psi0 (by default the state X/Y[..., 0]) and evaluates its
+		# dense output at the times i * self.step, i = 1..N_max-1; callback(i, t, psi) returns True to stop.
+		# Returns the number of output steps done, including the initial one.
+		if psi0 is None:
+			psi0 = np.hstack((self.X[:, :, :, 0].flatten(), self.Y[:, :, :, 0].flatten()))
+		if method is None:
+			method = self.integration_method
+		if method in ['Radau', 'BDF', 'LSODA']:
+			options = {'jac': jac}
+		else:
+			options = {}
+		solver = SCIPY_ODE_SOLVERS[method](fun, 0., psi0, (N_max - 1) * self.step,
+										   rtol=self.rtol, atol=self.atol, **options)
+		dense = None
+		i = 1
+		while i < N_max:
+			t = i * self.step
+			while solver.t < t:
+				message = solver.step()
+				dense = None
+				if solver.status == 'failed':
+					raise RuntimeError(message)
+			if dense is None:
+				dense = solver.dense_output()
+			if callback(i, t, dense(t)):
+				return i + 1
+			i += 1
+		return i
+
+	def store_chunked_state(self, i, t, psi):
+		self.T[i] = t
+		self.X[:, :, :, self.inext] = psi[:self.N_wells].reshape(self.N_tuple)
+		self.Y[:, :, :, self.inext] = psi[self.N_wells:].reshape(self.N_tuple)
+		self.polar.invalidate(self.inext)
+		self.set_constants_of_motion_local(i, self.inext)
+		self.push_snapshot(i, self.inext)
+		self.icurr = 1 - self.icurr
+		self.inext = 1 - self.inext
+		return False
+
+	def store_chunked_state_relaxation(self, i, t, psi):
+		self.store_chunked_state(i, t, psi)
+		return (self.energy[i - 1] - self.E_desired) * (self.energy[i] - self.E_desired) <= 0
+
 	def reverse_hamiltonian(self, error_J, error_beta, error_disorder):
 		self.J = -1. * self.J * (1.0 + error_J * np.random.randn())
 		self.beta = -1. * self.beta * (1.0 + error_beta * np.random.randn())
 		self.e_disorder = -1. * self.e_disorder * (1.0 + error_disorder * np.random.randn())
 		self.e_disorder_flat = self.e_disorder.flatten()
 
+	def get_nn_weights_dim(self):
+		return self.lattice.bond_weights(self.J, self.anisotropy)
+
 	def Hamiltonian_fast(self):
+		if self.use_matrix_operations:
+			return self.HamiltonianWithRelaxationPolar(self.psi, self.dpsi).copy()
+
 		self.dpsi *= 0
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
-			self.dpsi[i + self.N_wells] += - self.beta_flat[i] * (self.psi[i]**2) - self.e_disorder[itup]
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
-				j = self.wells_index_tuple_to_num[jtup]
+		for i in range(self.N_wells):
+			self.dpsi[i + self.N_wells] += - self.beta_flat[i] * (self.psi[i]**2) - self.e_disorder_flat[i]
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					self.dpsi[i] -= self.anisotropy * self.J * (self.psi[j] * np.sin(self.psi[j + self.N_wells] - self.psi[i + self.N_wells]))
@@ -865,17 +1523,21 @@ class DynamicsGenerator(object):
 		return self.dpsi.copy()
 
 	def Relaxation_fast(self):
+		if self.use_matrix_operations:
+			if self.tempered_glass_cooling == True:
+				gamma = self.gamma_tempered
+			else:
+				gamma = self.gamma
+			return self.HamiltonianWithRelaxationPolar(self.psi, self.dpsi, gamma=gamma, hamiltonian=False).copy()
 
 		self.dpsi *= 0
 
 		self.xL *= 0
 		self.yL *= 0
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 			# calculating the local field (xL, yL)
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
-				j = self.wells_index_tuple_to_num[jtup]
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					self.xL[i] += self.anisotropy * self.J * self.psi[j] * np.cos(self.psi[j + self.N_wells])
@@ -891,6 +1553,46 @@ class DynamicsGenerator(object):
 			self.dpsi[self.N_wells:] = - self.gamma * self.psi[:self.N_wells] * (self.xL * np.sin(self.psi[self.N_wells:]) - self.yL * np.cos(self.psi[self.N_wells:]))
 		return self.dpsi.copy()
 
+	def HamiltonianWithRelaxationPolar(self, psi, out, gamma=0., hamiltonian=True):
+		# vectorized (rho, theta) right-hand side, the same as Hamiltonian_fast + Relaxation_fast;
+		# the relaxational term -gamma * rho_i * (xL sin(theta_i) - yL cos(theta_i)) equals
+		# gamma * rho_i * sum_j J_ij rho_j sin(theta_j - theta_i)
+		rho = psi[:self.N_wells]
+		theta = psi[self.N_wells:]
+		weights = self.get_nn_weights_dim()
+		rho_nn = rho[self.nn_ids_dim]
+		dtheta_nn = theta[self.nn_ids_dim] - theta
+		sin_sum = np.dot(weights, rho_nn * np.sin(dtheta_nn))
+
+		if hamiltonian:
+			out[:self.N_wells] = - sin_sum
+			out[self.N_wells:] = (- self.beta_flat * (rho ** 2) - self.e_disorder_flat +
+								  np.dot(weights, rho_nn * np.cos(dtheta_nn)) / rho)
+		else:
+			out[:] = 0
+		if np.any(gamma != 0.):
+			out[self.N_wells:] += gamma * rho * sin_sum
+		return out
+
+	def conservative_polar_out(self, ts, y0, out):
+		return self.HamiltonianWithRelaxationPolar(y0, out)
+
+	def relaxation_polar_out(self, ts, y0, out):
+		return self.HamiltonianWithRelaxationPolar(y0, out, gamma=self.get_relaxation_gamma(y0, time=ts, polar=True),
+												   hamiltonian=False)
+
+	def full_polar_out(self, ts, y0, out):
+		return self.HamiltonianWithRelaxationPolar(y0, out, gamma=self.get_relaxation_gamma(y0, time=ts, polar=True))
+
+	def conservative_XY_out(self, ts, y0, out):
+		return self.HamiltonianWithRelaxationXY_fused(y0, out, conservative=True)
+
+	def relaxation_XY_out(self, ts, y0, out):
+		return self.HamiltonianWithRelaxationXY_fused(y0, out, time=ts, hamiltonian=False)
+
+	def full_XY_out(self, ts, y0, out):
+		return self.HamiltonianWithRelaxationXY_fused(y0, out, time=ts)
+
 	def effective_frequency(self, X0, Y0):
 		return self.E_calibr
 
@@ -906,6 +1608,7 @@ class DynamicsGenerator(object):
 		return tuple(j)
 
 	def nearest_neighbours(self, i):
+		# tuple form of self.neighbour_lists, kept for external scripts; the library uses the lattice tables
 		if self.dimensionality == 1:
 			return [self.NN( (i[0] + 1, i[1], i[2]) ), self.NN( (i[0] - 1, i[1], i[2]) )]
 		elif self.dimensionality == 2:
@@ -945,14 +1648,12 @@ class DynamicsGenerator(object):
 										   )
 												)
 		else:
-			for itup in self.wells_indices:
-				i = self.wells_index_tuple_to_num[itup]
+			for i in range(self.N_wells):
 
-				self.dpsi[i] += self.e_disorder[itup] * self.psi[i + self.N_wells]
-				self.dpsi[i + self.N_wells] += - self.e_disorder[itup] * self.psi[i]
-				for idx, jtup in enumerate(self.nearest_neighbours(itup)):
+				self.dpsi[i] += self.e_disorder_flat[i] * self.psi[i + self.N_wells]
+				self.dpsi[i + self.N_wells] += - self.e_disorder_flat[i] * self.psi[i]
+				for idx, j in enumerate(self.neighbour_lists[i]):
 					# Introduce anisotropy of J for the 3rd axis
-					j = self.wells_index_tuple_to_num[jtup]
 					if idx > 3:
 						self.dpsi[i] += - self.anisotropy * self.J * self.psi[j + self.N_wells]
 						self.dpsi[i + self.N_wells] += self.anisotropy * self.J * self.psi[j]
@@ -1005,11 +1706,9 @@ class DynamicsGenerator(object):
 												)
 
 		else:
-			for itup in self.wells_indices:
-				i = self.wells_index_tuple_to_num[itup]
+			for i in range(self.N_wells):
 				# calculating the local field (xL, yL)
-				for idx, jtup in enumerate(self.nearest_neighbours(itup)):
-					j = self.wells_index_tuple_to_num[jtup]
+				for idx, j in enumerate(self.neighbour_lists[i]):
 					# Introduce anisotropy of J for the 3rd axis
 					if idx > 3:
 						self.xL[i] += self.anisotropy * self.J * self.psi[j]
@@ -1037,18 +1736,42 @@ class DynamicsGenerator(object):
 
 		return self.dpsi.copy()
 
+	def get_relaxation_gamma(self, psi, time=0., polar=False):
+		# relaxation rate (scalar or per well) including the time- or energy-dependent quenching factor
+		if self.tempered_glass_cooling == True:
+			gamma = self.gamma_tempered
+		else:
+			gamma = self.gamma
+		if self.temperature_dependent_rate:
+			if self.smooth_quench:
+				gamma = self.quenching_profile(time=time) * gamma
+			else:
+				if polar:
+					x, y = self.from_polar_to_XY(psi[:self.N_wells], psi[self.N_wells:])
+					psi = np.hstack((x, y))
+				gamma = self.get_gamma_reduction(psi, time=time) * gamma
+		return gamma
+
+	def HamiltonianWithRelaxationXY_fused(self, psi, out, time=0., conservative=False, hamiltonian=True):
+		# HamiltonianXY_fast + RelaxationXY_fast in one pass, written into out
+		if conservative:
+			gamma = 0.
+		else:
+			gamma = self.get_relaxation_gamma(psi, time=time)
+		return self.fused_kernel(psi, out, self.J, self.anisotropy, self.beta_flat, self.e_disorder_flat,
+								 self.h_dis_x_flat, self.h_dis_y_flat, h_ext_x=self.h_ext_x, h_ext_y=self.h_ext_y,
+								 gamma=gamma, hamiltonian=hamiltonian)
+
 	def HamiltonianXY_fast_old(self):
 
 		self.dpsi *= 0
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 
-			self.dpsi[i] += self.e_disorder[itup] * self.psi[i+self.N_wells]
-			self.dpsi[i + self.N_wells] += - self.e_disorder[itup] * self.psi[i]
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
+			self.dpsi[i] += self.e_disorder_flat[i] * self.psi[i+self.N_wells]
+			self.dpsi[i + self.N_wells] += - self.e_disorder_flat[i] * self.psi[i]
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
-				j = self.wells_index_tuple_to_num[jtup]
 				if idx > 3:
 					self.dpsi[i] += - self.anisotropy * self.J * self.psi[j+self.N_wells]
 					self.dpsi[i + self.N_wells] += self.anisotropy * self.J * self.psi[j]
@@ -1073,11 +1796,9 @@ class DynamicsGenerator(object):
 		self.xL *= 0
 		self.yL *= 0
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 			# calculating the local field (xL, yL)
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
-				j = self.wells_index_tuple_to_num[jtup]
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					self.xL[i] += self.anisotropy * self.J * self.psi[j]
@@ -1104,11 +1825,9 @@ class DynamicsGenerator(object):
 		self.xL *= 0
 		self.yL *= 0
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 			# calculating the local field (xL, yL)
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
-				j = self.wells_index_tuple_to_num[jtup]
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					self.xL[i] += self.anisotropy * self.J * self.psiJac[j]
@@ -1117,8 +1836,7 @@ class DynamicsGenerator(object):
 					self.xL[i] += self.J * self.psiJac[j]
 					self.yL[i] += self.J * self.psiJac[j + self.N_wells]
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 			# dXi / dXj
 			self.dFdXY[i, i] += 2. * self.beta_flat[i] * self.psiJac[i] * self.psiJac[i + self.N_wells] + self.gamma * self.psiJac[i + self.N_wells] * self.yL[i]
 			# dXi / dYj
@@ -1129,38 +1847,189 @@ class DynamicsGenerator(object):
 			# dYi / dXj
 			self.dFdXY[i+ self.N_wells,i] += - self.beta_flat[i] * (3. * self.psiJac[i] ** 2 + self.psiJac[i + self.N_wells] **2)  - self.gamma * (2. * self.yL[i] * self.psiJac[i] - self.xL[i] * self.psiJac[i + self.N_wells])
 
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
-					j = self.wells_index_tuple_to_num[jtup]
 					self.dFdXY[i, j + self.N_wells] += - self.anisotropy * self.J + self.anisotropy * self.gamma * self.psiJac[i] * self.psiJac[i + self.N_wells]
 					self.dFdXY[i+ self.N_wells, j] += self.anisotropy * self.J + self.anisotropy * self.gamma * self.psiJac[i] * self.psiJac[i + self.N_wells]
 
 					self.dFdXY[i, j] += - self.anisotropy * self.gamma * (self.psiJac[i + self.N_wells] ** 2)
 					self.dFdXY[i + self.N_wells, j + self.N_wells] += self.anisotropy * self.gamma * (self.psiJac[i] ** 2)
 				else:
-					j = self.wells_index_tuple_to_num[jtup]
 					self.dFdXY[i, j + self.N_wells] += -self.J + self.gamma * self.psiJac[i] * self.psiJac[i + self.N_wells]
 					self.dFdXY[i+ self.N_wells, j] += self.J + self.gamma * self.psiJac[i] * self.psiJac[i + self.N_wells]
 
 					self.dFdXY[i, j] += - self.gamma * (self.psiJac[i + self.N_wells] ** 2)
 					self.dFdXY[i + self.N_wells, j + self.N_wells] += self.gamma * (self.psiJac[i] ** 2)
 
+	def SparseJacobianWithRelaxXY(self, psi, time=0., conservative=False):
+		# the dependence of the rate on the state is not differentiated, as in FullJacobianWithRelaxXY_fast
+		if conservative:
+			gamma = 0.
+		else:
+			gamma = self.get_relaxation_gamma(psi, time=time)
+
+		return self.sparse_jacobian(psi, self.J, self.anisotropy, self.beta_flat, self.e_disorder_flat,
+									h_ext_x=self.h_ext_x, h_ext_y=self.h_ext_y, gamma=gamma)
+
+	def get_tangent_stencil(self, backend='numpy'):
+		# beta_flat, e_disorder_flat and the nn_id* neighbour indices [2*kernel_dimensionality, N_wells] of the
+		# right-hand side, used by nn_sum_XY / jvp / vjp; backend='torch' gives tensors in torch_FloatPrecision
+		# on torch_device
+		nn_ids = np.vstack((self.nn_idx_1, self.nn_idx_2, self.nn_idy_1, self.nn_idy_2,
+							self.nn_idz_1, self.nn_idz_2)).astype(np.int64)[:2 * self.kernel_dimensionality]
+		if backend == 'torch':
+			return (torch.from_numpy(np.array(self.beta_flat, dtype=np.float64)).type(self.torch_FloatPrecision).to(self.torch_device),
+					torch.from_numpy(np.array(self.e_disorder_flat, dtype=np.float64)).type(self.torch_FloatPrecision).to(self.torch_device),
+					torch.from_numpy(nn_ids).to(self.torch_device))
+		return self.beta_flat, self.e_disorder_flat, nn_ids
+
+	def nn_sum_XY(self, v, nn_ids=None):
+		# J * sum over the nn_id* neighbours (anisotropy on the z axis) along the last axis of v, over the same
+		# kernel_dimensionality axes as the right-hand side. v is a numpy array or, with nn_ids from
+		# get_tangent_stencil('torch'), a tensor.
+		# On the periodic lattice nn_id*_2 is the inverse permutation of nn_id*_1, so this operator is symmetric
+		if nn_ids is None:
+			nn_ids = self.get_tangent_stencil()[2]
+		L = v[..., nn_ids[0]] + v[..., nn_ids[1]]
+		if len(nn_ids) > 2:
+			L = L + v[..., nn_ids[2]] + v[..., nn_ids[3]]
+		if len(nn_ids) > 4:
+			L = L + self.anisotropy * (v[..., nn_ids[4]] + v[..., nn_ids[5]])
+		return self.J * L
+
+	def jvp(self, psi, v, time=0., conservative=False, stencil=None):
+		# Jacobian of full_eq_of_motion (or full_eq_of_motion_conservative) at psi[2*N_wells] applied to v,
+		# v is [2*N_wells] or a batch [k, 2*N_wells]; the rate is frozen at psi as in SparseJacobianWithRelaxXY.
+		# psi, v may be torch tensors if stencil = get_tangent_stencil('torch') is passed (LyapunovSpectrumXY)
+		if conservative:
+			gamma = 0.
+		else:
+			gamma = self.get_relaxation_gamma(psi, time=time)
+		if stencil is None:
+			stencil = self.get_tangent_stencil()
+		beta_flat, e_disorder_flat, nn_ids = stencil
+		if isinstance(v, torch.Tensor):
+			if isinstance(gamma, np.ndarray):
+				gamma = torch.from_numpy(gamma).type(v.dtype).to(v.device)
+			cat = lambda a, b: torch.cat([a, b], dim=-1)
+		else:
+			cat = lambda a, b: np.concatenate((a, b), axis=-1)
+		x = psi[:self.N_wells]
+		y = psi[self.N_wells:]
+		dx = v[..., :self.N_wells]
+		dy = v[..., self.N_wells:]
+		xL = self.nn_sum_XY(x, nn_ids)
+		yL = self.nn_sum_XY(y, nn_ids)
+		dxL = self.nn_sum_XY(dx, nn_ids)
+		dyL = self.nn_sum_XY(dy, nn_ids)
+
+		c = (e_disorder_flat + beta_flat * (x ** 2 + y ** 2) + (self.h_ext_x * y - self.h_ext_y * x) +
+			 gamma * (xL * y - yL * x))
+		dc = (2. * beta_flat * (x * dx + y * dy) + (self.h_ext_x * dy - self.h_ext_y * dx) +
+			  gamma * (dxL * y + xL * dy - dyL * x - yL * dx))
+		return cat(dy * c + y * dc - dyL, - dx * c - x * dc + dxL)
+
+	def vjp(self, psi, u, time=0., conservative=False):
+		# u^T J, the transpose of jvp, for u [2*N_wells] or [k, 2*N_wells]
+		if conservative:
+			gamma = 0.
+		else:
+			gamma = self.get_relaxation_gamma(psi, time=time)
+		nn_ids = self.get_tangent_stencil()[2]
+		x = psi[:self.N_wells]
+		y = psi[self.N_wells:]
+		ux = u[..., :self.N_wells]
+		uy = u[..., self.N_wells:]
+		xL = self.nn_sum_XY(x, nn_ids)
+		yL = self.nn_sum_XY(y, nn_ids)
+
+		c = (self.e_disorder_flat + self.beta_flat * (x ** 2 + y ** 2) + (self.h_ext_x * y - self.h_ext_y * x) +
+			 gamma * (xL * y - yL * x))
+		# u^T J v = sum(q * dc) + sum(ux * c * dy - uy * c * dx) - sum(ux * dyL) + sum(uy * dxL)
+		q = ux * y - uy * x
+		wx = (q * (2. * self.beta_flat * x - self.h_ext_y - gamma * yL) + self.nn_sum_XY(gamma * q * y, nn_ids)
+			  - uy * c + self.nn_sum_XY(uy, nn_ids))
+		wy = (q * (2. * self.beta_flat * y + self.h_ext_x + gamma * xL) - self.nn_sum_XY(gamma * q * x, nn_ids)
+			  + ux * c - self.nn_sum_XY(ux, nn_ids))
+		return np.concatenate((wx, wy), axis=-1)
+
+	def calc_rotation_frequency(self, psi, time=0., conservative=False):
+		# frequency mu of the rotation (x, y) -> (y, -x) that best matches the right-hand side at psi:
+		# a stationary state of the DGPE evolves as exp(-i mu t) psi
+		f = self.HamiltonianWithRelaxationXY_fused(psi, np.empty_like(psi), time=time, conservative=conservative)
+		return (np.dot(f[:self.N_wells], psi[self.N_wells:]) - np.dot(f[self.N_wells:], psi[:self.N_wells])) / np.dot(psi, psi)
+
+	def stability_analysis(self, psi=None, k=6, sigma=None, mu=None, time=0., conservative=False, matrix_free=False,
+						   tol=0.):
+		# Linear stability of a (relaxed) state psi [2*N_wells], by default X/Y[..., icurr].
+		# The Jacobian of the equations of motion is taken in the frame rotating with mu (estimated by
+		# calc_rotation_frequency if not given), where the stationary state is a fixed point.
+		# ARPACK (scipy.sparse.linalg.eigs) returns the k eigenvalues with the largest real part or, with
+		# sigma given, the k eigenvalues closest to sigma by shift-invert (sigma = 1j * omega for a frequency omega).
+		# The Jacobian is the CSR matrix of SparseJacobianWithRelaxXY, or with matrix_free=True a LinearOperator
+		# over jvp (shift-invert then solves with GMRES).
+		# Returns the eigenvalues sorted by the growth rate (real part) and the modes [2*N_wells, k].
+		if psi is None:
+			psi = np.hstack((self.X[:,:,:,self.icurr].flatten(), self.Y[:,:,:,self.icurr].flatten()))
+		if mu is None:
+			mu = self.calc_rotation_frequency(psi, time=time, conservative=conservative)
+		N = self.N_wells
+		R = sparse.bmat([[None, sparse.identity(N)], [-sparse.identity(N), None]], format='csr')
+
+		if matrix_free:
+			def matvec(v):
+				v = np.asarray(v).ravel()
+				if np.iscomplexobj(v):
+					return (self.jvp(psi, v.real, time=time, conservative=conservative) +
+							1j * self.jvp(psi, v.imag, time=time, conservative=conservative) - mu * (R @ v))
+				return self.jvp(psi, v, time=time, conservative=conservative) - mu * (R @ v)
+			dtype = np.complex128 if np.iscomplexobj(sigma) else self.FloatPrecision
+			A = sparse_linalg.LinearOperator((2 * N, 2 * N), matvec=matvec, dtype=dtype)
+			if sigma is None:
+				eig_vals, eig_vecs = sparse_linalg.eigs(A, k=k, which='LR', tol=tol)
+			else:
+				shifted = sparse_linalg.LinearOperator((2 * N, 2 * N), matvec=lambda v: A.matvec(v) - sigma * np.asarray(v).ravel(),
+													   dtype=np.complex128 if np.iscomplexobj(sigma) else dtype)
+				# GMRES with the default restart of 20 stagnates on these operators, the Krylov space is kept
+				# up to 200 vectors (the whole space on small lattices)
+				def solve_shifted(v):
+					solution, info = sparse_linalg.gmres(shifted, v, rtol=1e-12, restart=min(2 * N, 200))
+					if info != 0:
+						warnings.warn('stability_analysis: the shift-invert GMRES solve did not converge, info = ' + str(info))
+					return solution
+				OPinv = sparse_linalg.LinearOperator((2 * N, 2 * N), matvec=solve_shifted, dtype=shifted.dtype)
+				eig_vals, eig_vecs = sparse_linalg.eigs(A, k=k, sigma=sigma, OPinv=OPinv, tol=tol)
+		else:
+			A = self.SparseJacobianWithRelaxXY(psi, time=time, conservative=conservative) - mu * R
+			if sigma is None:
+				eig_vals, eig_vecs = sparse_linalg.eigs(A, k=k, which='LR', tol=tol)
+			else:
+				if np.iscomplexobj(sigma):
+					A = A.astype(np.complex128)
+				eig_vals, eig_vecs = sparse_linalg.eigs(A.tocsc(), k=k, sigma=sigma, tol=tol)
+
+		order = np.argsort(-eig_vals.real)
+		self.stability_eigenvalues = eig_vals[order]
+		self.stability_modes = eig_vecs[:, order]
+		self.stability_growth_rate = np.max(eig_vals.real)
+		return self.stability_eigenvalues, self.stability_modes
+
 	def FullJacobianWithRelaxXY(self, X, Y):
 		dFdXY = np.zeros((2 * self.N_wells, 2 * self.N_wells))
 
-		X0 = np.array(X)
-		Y0 = np.array(Y)
+		X0 = np.array(X).flatten()
+		Y0 = np.array(Y).flatten()
 
 		# X0 = psi[:self.N_wells].reshape(self.N_tuple)
 		# Y0 = psi[self.N_wells:].reshape(self.N_tuple)
 
-		xL = np.zeros(self.N_tuple, dtype=self.FloatPrecision)
-		yL = np.zeros(self.N_tuple, dtype=self.FloatPrecision)
+		xL = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		yL = np.zeros(self.N_wells, dtype=self.FloatPrecision)
 
-		for i in self.wells_indices:
+		for i in range(self.N_wells):
 			# calculating the local field (xL, yL)
-			for idx, j in enumerate(self.nearest_neighbours(i)):
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					xL[i] += self.anisotropy * self.J * X0[j]
@@ -1169,34 +2038,31 @@ class DynamicsGenerator(object):
 					xL[i] += self.J * X0[j]
 					yL[i] += self.J * Y0[j]
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 			# dXi / dXj
-			dFdXY[i, i] += 2. * self.beta_flat[i] * X0[itup] * Y0[itup] + self.gamma * Y0[itup] * yL[itup]
+			dFdXY[i, i] += 2. * self.beta_flat[i] * X0[i] * Y0[i] + self.gamma * Y0[i] * yL[i]
 			# dXi / dYj
-			dFdXY[i,i + self.N_wells] += self.beta_flat[i] * (X0[itup] ** 2 + 3. * Y0[itup] **2) - self.gamma * (2. * xL[itup] * Y0[itup] - yL[itup] * X0[itup])
+			dFdXY[i,i + self.N_wells] += self.beta_flat[i] * (X0[i] ** 2 + 3. * Y0[i] **2) - self.gamma * (2. * xL[i] * Y0[i] - yL[i] * X0[i])
 
 			# dYi / dYj
-			dFdXY[i+ self.N_wells,i + self.N_wells] += - 2. * self.beta_flat[i] * X0[itup] * Y0[itup] - self.gamma * X0[itup] * xL[itup]
+			dFdXY[i+ self.N_wells,i + self.N_wells] += - 2. * self.beta_flat[i] * X0[i] * Y0[i] - self.gamma * X0[i] * xL[i]
 			# dYi / dXj
-			dFdXY[i+ self.N_wells,i] += - self.beta_flat[i] * (3. * X0[itup] ** 2 + Y0[itup] **2)  - self.gamma * (2. * yL[itup] * X0[itup] - xL[itup] * Y0[itup])
+			dFdXY[i+ self.N_wells,i] += - self.beta_flat[i] * (3. * X0[i] ** 2 + Y0[i] **2)  - self.gamma * (2. * yL[i] * X0[i] - xL[i] * Y0[i])
 
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
-					j = self.wells_index_tuple_to_num[jtup]
-					dFdXY[i, j + self.N_wells] += - self.anisotropy * self.J + self.anisotropy * self.gamma * X0[itup] * Y0[itup]
-					dFdXY[i+ self.N_wells, j] += self.anisotropy * self.J + self.anisotropy * self.gamma * X0[itup] * Y0[itup]
+					dFdXY[i, j + self.N_wells] += - self.anisotropy * self.J + self.anisotropy * self.gamma * X0[i] * Y0[i]
+					dFdXY[i+ self.N_wells, j] += self.anisotropy * self.J + self.anisotropy * self.gamma * X0[i] * Y0[i]
 
-					dFdXY[i, j] += - self.anisotropy * self.gamma * (Y0[itup] ** 2)
-					dFdXY[i + self.N_wells, j + self.N_wells] += self.anisotropy * self.gamma * (X0[itup] ** 2)
+					dFdXY[i, j] += - self.anisotropy * self.gamma * (Y0[i] ** 2)
+					dFdXY[i + self.N_wells, j + self.N_wells] += self.anisotropy * self.gamma * (X0[i] ** 2)
 				else:
-					j = self.wells_index_tuple_to_num[jtup]
-					dFdXY[i, j + self.N_wells] += -self.J + self.gamma * X0[itup] * Y0[itup]
-					dFdXY[i+ self.N_wells, j] += self.J + self.gamma * X0[itup] * Y0[itup]
+					dFdXY[i, j + self.N_wells] += -self.J + self.gamma * X0[i] * Y0[i]
+					dFdXY[i+ self.N_wells, j] += self.J + self.gamma * X0[i] * Y0[i]
 
-					dFdXY[i, j] += - self.gamma * (Y0[itup] ** 2)
-					dFdXY[i + self.N_wells, j + self.N_wells] += self.gamma * (X0[itup] ** 2)
+					dFdXY[i, j] += - self.gamma * (Y0[i] ** 2)
+					dFdXY[i + self.N_wells, j + self.N_wells] += self.gamma * (X0[i] ** 2)
 
 		#eig_vals = np.linalg.eigvals(dFdXY)
 
@@ -1204,31 +2070,28 @@ class DynamicsGenerator(object):
 
 
 	def JacobianXY(self, X, Y):
-		X0 = np.array(X)
-		Y0 = np.array(Y)
+		X0 = np.array(X).flatten()
+		Y0 = np.array(Y).flatten()
 
 		dFdXY = np.zeros((2 * self.N_wells, 2 * self.N_wells))
 
-		for itup in self.wells_indices:
-			i = self.wells_index_tuple_to_num[itup]
+		for i in range(self.N_wells):
 			# dXi / dXj
-			dFdXY[i, i] += 2. * self.beta_flat[i] * X0[itup] * Y0[itup]
+			dFdXY[i, i] += 2. * self.beta_flat[i] * X0[i] * Y0[i]
 			# dXi / dYj
-			dFdXY[i,i + self.N_wells] += self.beta_flat[i] * (X0[itup] ** 2 + 3. * Y0[itup] **2)
+			dFdXY[i,i + self.N_wells] += self.beta_flat[i] * (X0[i] ** 2 + 3. * Y0[i] **2)
 
 			# dYi / dYj
-			dFdXY[i+ self.N_wells,i + self.N_wells] += - 2. * self.beta_flat[i] * X0[itup] * Y0[itup]
+			dFdXY[i+ self.N_wells,i + self.N_wells] += - 2. * self.beta_flat[i] * X0[i] * Y0[i]
 			# dYi / dXj
-			dFdXY[i+ self.N_wells,i] += - self.beta_flat[i] * (3. * X0[itup] ** 2 + Y0[itup] **2)
+			dFdXY[i+ self.N_wells,i] += - self.beta_flat[i] * (3. * X0[i] ** 2 + Y0[i] **2)
 
-			for idx, jtup in enumerate(self.nearest_neighbours(itup)):
+			for idx, j in enumerate(self.neighbour_lists[i]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
-					j = self.wells_index_tuple_to_num[jtup]
 					dFdXY[i, j + self.N_wells] += - self.anisotropy * self.J
 					dFdXY[i+ self.N_wells, j] += self.anisotropy * self.J
 				else:
-					j = self.wells_index_tuple_to_num[jtup]
 					dFdXY[i, j + self.N_wells] += -self.J
 					dFdXY[i+ self.N_wells, j] += self.J
 
@@ -1241,10 +2104,15 @@ class DynamicsGenerator(object):
 		number_of_particles = np.sum(RHO ** 2, axis=(0,1,2))
 		energy = np.zeros(self.n_steps, dtype=self.FloatPrecision)
 		angular_momentum = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		for j in self.wells_indices:
-			energy += (self.beta_volume[j]/2. * np.abs(RHO[j]**4) +
-					   self.e_disorder[j] * np.abs(RHO[j]**2))
-			for idx, k in enumerate(self.nearest_neighbours(j)):
+		# wells along the first axis, time along the second
+		RHO = RHO.reshape((self.N_wells, -1))
+		THETA = THETA.reshape((self.N_wells, -1))
+		X = X.reshape((self.N_wells, -1))
+		Y = Y.reshape((self.N_wells, -1))
+		for j in range(self.N_wells):
+			energy += (self.beta_flat[j]/2. * np.abs(RHO[j]**4) +
+					   self.e_disorder_flat[j] * np.abs(RHO[j]**2))
+			for idx, k in enumerate(self.neighbour_lists[j]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					energy += (- self.anisotropy * self.J * (RHO[k] * RHO[j] * np.cos(THETA[k] - THETA[j])))
@@ -1259,36 +2127,49 @@ class DynamicsGenerator(object):
 		return energy, number_of_particles, angular_momentum
 
 	def calc_constants_of_motion_local(self, RHO, THETA, X, Y):
-		number_of_particles = np.sum(RHO ** 2, axis=(0,1,2))
-		energy = 0.#np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		angular_momentum = 0.#np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		for j in self.wells_indices:
-			energy += (self.beta_volume[j]/2. * np.abs(RHO[j]**4) +
-					   self.e_disorder[j] * np.abs(RHO[j]**2))
-
-			for idx, k in enumerate(self.nearest_neighbours(j)):
-				# Introduce anisotropy of J for the 3rd axis
-				if idx > 3:
-					energy += (- self.anisotropy * self.J * (RHO[k] * RHO[j] * np.cos(THETA[k] - THETA[j])))
-				else:
-					energy += (- self.J * (RHO[k] * RHO[j] * np.cos(THETA[k] - THETA[j])))
-			# angular_momentum += - 2 * self.J * (X[:,j] * (0*Y[:,self.NN(j-1)] + Y[:,self.NN(j+1)]) - Y[:,j] * (0*X[:,self.NN(j-1)] + X[:,self.NN(j+1)]))
-			# angular_momentum += - 2 * self.J * (X[:,j] * (0*Y[:,self.NN(j-1)] + Y[:,self.NN(j+1)]) - 0*Y[:,j] * (0*X[:,self.NN(j-1)] + X[:,self.NN(j+1)]))
-			# angular_momentum += - 2 * self.J * (X[:,j] * (1./3*X[:,j] ** 2 + Y[:,j] ** 2))
-			angular_momentum += - 2 * self.J * (X[j] * Y[k] - Y[j] * X[k])
-
+		# RHO, THETA are kept in the signature for the callers, the observables are computed from X, Y
+		energy, number_of_particles, angular_momentum, sum_rho4 = self.local_observables.compute(X, Y, self.J, self.anisotropy,
+																								  self.beta_flat, self.e_disorder_flat)
 		return energy, number_of_particles, angular_momentum
 
+	def hold_constants_of_motion_local(self, i):
+		# between two evaluations every observables_every steps the last values are repeated
+		return (i > 0) and (i % self.observables_every != 0)
+
 	def set_constants_of_motion_local(self, i, inext):
-		self.energy[i], self.number_of_particles[i], self.angular_momentum[i] = self.calc_constants_of_motion_local(self.RHO[:,:,:,inext], self.THETA[:,:,:,inext],
-																													self.X[:,:,:,inext], self.Y[:,:,:,inext])
+		if self.hold_constants_of_motion_local(i):
+			self.energy[i] = self.energy[i - 1]
+			self.number_of_particles[i] = self.number_of_particles[i - 1]
+			self.angular_momentum[i] = self.angular_momentum[i - 1]
+			self.participation_rate[i] = self.participation_rate[i - 1]
+			self.effective_nonlinearity[i] = self.effective_nonlinearity[i - 1]
+			return
+		self.energy[i], self.number_of_particles[i], self.angular_momentum[i], sum_rho4 = self.local_observables.compute(
+			self.X[:,:,:,inext], self.Y[:,:,:,inext], self.J, self.anisotropy, self.beta_flat, self.e_disorder_flat)
 		# for i in self.wells_indices:
 		# 	self.histograms[i] = np.histogram2d(np.float64(self.X[i]), np.float64(self.Y[i]), bins=100)
 		# 	self.rho_histograms[i] = np.histogram(np.float64(self.RHO[i] ** 2), bins=100)
 
-		self.participation_rate[i] = np.sum(self.RHO[:,:,:,inext] ** 4, axis=(0,1,2)) / (np.sum(self.RHO[:,:,:,inext] ** 2, axis=(0,1,2)) ** 2)
+		self.participation_rate[i] = sum_rho4 / (self.number_of_particles[i] ** 2)
 		self.effective_nonlinearity[i] = self.beta_amplitude * (self.participation_rate[i]) / self.N_wells
 
+	def push_snapshot(self, i, inext):
+		if self.streaming and (i % self.save_every == 0):
+			# the sinks copy the snapshot, so one buffer is reused
+			self.trajectory_sink.push(i, i * self.step, self.load_XY(inext, self.psi_snapshot))
+
+	def push_trajectory_block(self, ODE_result, n_steps):
+		# ODE_result holds the whole run in time-major XY form; every save_every-th row goes to the sink
+		# and the last state is kept in slot 0 of X, Y, RHO, THETA
+		steps = np.arange(0, n_steps, self.save_every)
+		self.trajectory_sink.push_block(steps, steps * self.step, ODE_result[steps])
+		psi = ODE_result[n_steps - 1]
+		self.X[:,:,:,0] = psi[:self.N_wells].reshape(self.N_tuple)
+		self.Y[:,:,:,0] = psi[self.N_wells:].reshape(self.N_tuple)
+		self.polar.invalidate(0)
+		self.icurr = 0
+		self.inext = 1
+
 	def set_constants_of_motion(self):
 		self.energy, self.number_of_particles, self.angular_momentum = self.calc_constants_of_motion(self.RHO, self.THETA, self.X, self.Y)
 		for i in self.wells_indices:
@@ -1328,13 +2209,15 @@ class DynamicsGenerator(object):
 							)
 			E_new += np.sum(self.h_dis_x_flat * x + self.h_dis_y_flat * y)
 		else:
-			for j in self.wells_indices:
-				E_new += (self.beta_volume[j]/2. * ((x[j]**2 + y[j]**2)**2) +
-						  self.e_disorder[j] * (x[j]**2 + y[j]**2) +
-						  self.h_dis_x_volume[j] * x[j] +
-						  self.h_dis_y_volume[j] * y[j]
+			x = x.reshape(-1)
+			y = y.reshape(-1)
+			for j in range(self.N_wells):
+				E_new += (self.beta_flat[j]/2. * ((x[j]**2 + y[j]**2)**2) +
+						  self.e_disorder_flat[j] * (x[j]**2 + y[j]**2) +
+						  self.h_dis_x_flat[j] * x[j] +
+						  self.h_dis_y_flat[j] * y[j]
 						  )
-				for idx, k in enumerate(self.nearest_neighbours(j)):
+				for idx, k in enumerate(self.neighbour_lists[j]):
 					# Introduce anisotropy of J for the 3rd axis
 					if idx > 3:
 						E_new += (-self.anisotropy * self.J * (x[j] * x[k] + y[j] * y[k]))
@@ -1342,8 +2225,63 @@ class DynamicsGenerator(object):
 						E_new += (-self.J * (x[j] * x[k] + y[j] * y[k]))
 		return E_new
 
+	def get_energy_nn(self):
+		# neighbours and bond weights of calc_energy_XY: all 6 nn_id* arrays with the matrix operations,
+		# the neighbours of nearest_neighbours otherwise
+		if self.use_matrix_operations:
+			nn_ids = np.vstack((self.nn_idx_1, self.nn_idx_2, self.nn_idy_1, self.nn_idy_2, self.nn_idz_1, self.nn_idz_2))
+			weights = self.J * np.array([1., 1., 1., 1., self.anisotropy, self.anisotropy])
+		else:
+			nn_ids = self.nn_ids_dim
+			weights = self.get_nn_weights_dim()
+		return nn_ids, weights
+
+	def get_energy_adjacency(self):
+		# CSR adjacency A of the bonds of calc_energy_XY (the neighbours of get_energy_nn), so that the bond
+		# energy is -(x A x + y A y); the same LatticeTopology as self.lattice without the matrix operations
+		return get_lattice_topology(self.N_tuple, self.kernel_dimensionality).adjacency(self.J, self.anisotropy)
+
+	def calc_energy_gradient_XY(self, x, y):
+		# analytic gradient of calc_energy_XY over (x, y) flattened, returned as [2*N_wells]
+		A = self.get_energy_adjacency()
+		x = x.flatten()
+		y = y.flatten()
+		rho2 = x ** 2 + y ** 2
+		dEdx = 2. * self.beta_flat * rho2 * x + 2. * self.e_disorder_flat * x + self.h_dis_x_flat
+		dEdy = 2. * self.beta_flat * rho2 * y + 2. * self.e_disorder_flat * y + self.h_dis_y_flat
+		# the bond term -w * x_i * x_j contributes to both ends of the bond, A is symmetric on the periodic lattice
+		dEdx -= 2. * A.dot(x)
+		dEdy -= 2. * A.dot(y)
+		return np.hstack((dEdx, dEdy))
+
+	def calc_energy_XY_abs_sum(self, x, y):
+		# sum of the absolute values of the terms of calc_energy_XY, the scale of its roundoff
+		nn_ids, weights = self.get_energy_nn()
+		rho2 = x ** 2 + y ** 2
+		E_abs = np.sum(np.abs(self.beta_flat) / 2. * (rho2 ** 2) + np.abs(self.e_disorder_flat) * rho2 +
+					   np.abs(self.h_dis_x_flat * x) + np.abs(self.h_dis_y_flat * y))
+		for k in range(nn_ids.shape[0]):
+			E_abs += np.abs(weights[k]) * np.sum(np.abs(x * x[nn_ids[k]] + y * y[nn_ids[k]]))
+		return E_abs
+
+	def calc_energy_XY_batch(self, X, Y):
+		# X, Y[n_samples, N_wells]: calc_energy_XY of every row
+		nn_ids, weights = self.get_energy_nn()
+		rho2 = X ** 2 + Y ** 2
+		E = np.sum(self.beta_flat / 2. * (rho2 ** 2) + self.e_disorder_flat * rho2 +
+				   self.h_dis_x_flat * X + self.h_dis_y_flat * Y, axis=1)
+		for k in range(nn_ids.shape[0]):
+			E -= weights[k] * np.sum(X * X[:, nn_ids[k]] + Y * Y[:, nn_ids[k]], axis=1)
+		return E
+
 	def calc_energy_XY_global(self, PSI):
 		# PSI[time, 2*N_wells]
+		PSI = PSI.astype(self.ReductionPrecision, copy=False)
+		if (self.use_matrix_operations_for_energy) and self.fft_hopping:
+			rho2 = PSI[:,:self.N_wells] ** 2 + PSI[:,self.N_wells:] ** 2
+			return (np.sum(self.beta_flat / 2. * (rho2 ** 2) + self.e_disorder_flat * rho2 +
+						   self.h_dis_x_flat * PSI[:,:self.N_wells] + self.h_dis_y_flat * PSI[:,self.N_wells:], axis=1) +
+					self.fft_hopper.kinetic_energy(PSI, self.J, self.anisotropy))
 		if (self.use_matrix_operations_for_energy):
 			return np.sum(self.beta_flat / 2. * ((PSI[:,:self.N_wells] ** 2 + PSI[:,self.N_wells:] ** 2) ** 2) +
 			self.e_disorder_flat * (PSI[:,:self.N_wells] ** 2 + PSI[:,self.N_wells:] ** 2)
@@ -1373,6 +2311,7 @@ class DynamicsGenerator(object):
 	def calc_nop_XY_global(self, PSI):
 		# PSI[time, 2*N_wells]
 		if (self.use_matrix_operations_for_energy):
+			PSI = PSI.astype(self.ReductionPrecision, copy=False)
 			return np.sum((PSI[:,:self.N_wells] ** 2 + PSI[:,self.N_wells:] ** 2), axis=1)
 		else:
 			return np.zeros(self.n_steps, dtype=self.FloatPrecision)
@@ -1380,8 +2319,10 @@ class DynamicsGenerator(object):
 
 	def calc_angular_momentum_XY(self, x, y):
 		L = 0
-		for j in self.wells_indices:
-			for k in self.nearest_neighbours(j):
+		x = x.reshape(-1)
+		y = y.reshape(-1)
+		for j in range(self.N_wells):
+			for k in self.neighbour_lists[j]:
 				L += - 2 * self.J * x[j] * y[k]
 		return L
 
@@ -1389,16 +2330,18 @@ class DynamicsGenerator(object):
 		E_kin = 0
 		E_pot = 0
 		E_noise = 0
-		for j in self.wells_indices:
-			for idx, k in enumerate(self.nearest_neighbours(j)):
+		x = x.reshape(-1)
+		y = y.reshape(-1)
+		for j in range(self.N_wells):
+			for idx, k in enumerate(self.neighbour_lists[j]):
 				# Introduce anisotropy of J for the 3rd axis
 				if idx > 3:
 					E_kin += (-self.anisotropy * self.J * (x[j] * x[k] + y[j] * y[k]))
 				else:
 					E_kin += (-self.J * (x[j] * x[k] + y[j] * y[k]))
 
-			E_pot += self.beta_volume[j]/2. * ((x[j]**2 + y[j]**2)**2)
-			E_noise += self.e_disorder[j] * (x[j]**2 + y[j]**2)
+			E_pot += self.beta_flat[j]/2. * ((x[j]**2 + y[j]**2)**2)
+			E_noise += self.e_disorder_flat[j] * (x[j]**2 + y[j]**2)
 
 		return E_kin, E_pot, E_noise
 
@@ -1409,7 +2352,52 @@ class DynamicsGenerator(object):
 		self.error_code += code
 		self.consistency_checksum = 1
 
-	def E_const_perturbation_XY(self, x0, y0, delta, degrees_of_freedom=30):
+	def E_const_perturbation_XY(self, x0, y0, delta, degrees_of_freedom=30, max_iter=50):
+		# A random perturbation of (x0, y0) of the size delta is projected onto the shell
+		# E = E_calibr, N = N_part by Newton steps along grad E and grad N (the minimal-norm
+		# correction of the two constraints linearised at the current point).
+		# degrees_of_freedom is unused, as in E_const_perturbation_XY_minimize.
+		# The iterations stop when dE, dN are at the roundoff of their sums (N_wells * eps * sum of |terms|),
+		# or when the Newton correction stops shrinking, i.e. the roundoff floor is reached anyway.
+		np.random.seed()
+		psi = np.hstack((x0.flatten(), y0.flatten())) + delta * np.random.randn(2 * self.N_wells)
+		eps = self.N_wells * np.finfo(psi.dtype).eps
+
+		col = 0
+		step_norm = np.inf
+		while col < max_iter:
+			x = psi[:self.N_wells]
+			y = psi[self.N_wells:]
+			dE = self.calc_energy_XY_batch(x.reshape(1, -1), y.reshape(1, -1))[0] - self.E_calibr
+			dN = np.sum(psi ** 2) - self.N_part
+			if (np.abs(dE) <= eps * self.calc_energy_XY_abs_sum(x, y)) and (np.abs(dN) <= eps * self.N_part):
+				break
+			grads = np.vstack((self.calc_energy_gradient_XY(x, y), 2. * psi))
+			correction = np.dot(grads.T, np.linalg.solve(np.dot(grads, grads.T), np.array([dE, dN])))
+			psi = psi - correction
+			col += 1
+			step_norm_prev = step_norm
+			step_norm = np.sqrt(np.sum(correction ** 2))
+			if step_norm >= step_norm_prev:
+				break
+
+		x1 = psi[:self.N_wells].reshape(self.N_tuple)
+		y1 = psi[self.N_wells:].reshape(self.N_tuple)
+		if self.use_matrix_operations:
+			E1 = self.calc_energy_XY(x1.flatten(), y1.flatten(), self.E_calibr)
+		else:
+			E1 = self.calc_energy_XY(x1, y1, self.E_calibr)
+		if np.abs(E1 / self.E_calibr) > self.E_eps:
+			self.make_exception('Could not find a new initial on-shell state\n')
+		if np.abs((self.calc_number_of_particles_XY(x1,y1)) / self.N_part) > 0.01:
+			self.make_exception('Could not find a new initial state with the same number of particles\n')
+		if col == max_iter:
+			self.make_exception('Exceeded number of attempts in E_const_perturbation\n')
+			return x1, y1, 1
+		else:
+			return x1, y1, 0
+
+	def E_const_perturbation_XY_minimize(self, x0, y0, delta, degrees_of_freedom=30):
 
 		bnds = np.hstack((x0.flatten(), y0.flatten()))
 
@@ -1651,26 +2639,26 @@ class DynamicsGenerator(object):
 		len_grad_len_grad_H_sqr = np.zeros(self.X.shape[-1])
 
 		for it in range(T.shape[0]):
-			x = self.X[:,:,:,it].copy()
-			y = self.Y[:,:,:,it].copy()
+			x = self.X[:,:,:,it].flatten()
+			y = self.Y[:,:,:,it].flatten()
 			grad_H = np.zeros(self.N_wells * 2)
 			len_grad_H_sqr = 0.
 			grad_len_grad_H_sqr = np.zeros(self.N_wells * 2)
 			# was wrong???
 			# laplacian_H = 4. * self.beta * self.N_part
 			laplacian_H = 8. * self.beta_amplitude * self.N_part
-			for ind, i in enumerate(self.wells_indices):
+			for i in range(self.N_wells):
 				# x_derivative
 				# was wrong???
-				# grad_H[ind] = self.beta * (x[i] ** 2 + y[i] ** 2) * x[i]
-				grad_H[ind] = 2. * self.beta_volume[i] * (x[i] ** 2 + y[i] ** 2) * x[i]
-				grad_len_grad_H_sqr[ind] = 6. * (self.beta_volume[i] ** 2) * np.power(x[i] ** 2 + y[i] ** 2, 2) * x[i]
+				# grad_H[i] = self.beta * (x[i] ** 2 + y[i] ** 2) * x[i]
+				grad_H[i] = 2. * self.beta_flat[i] * (x[i] ** 2 + y[i] ** 2) * x[i]
+				grad_len_grad_H_sqr[i] = 6. * (self.beta_flat[i] ** 2) * np.power(x[i] ** 2 + y[i] ** 2, 2) * x[i]
 
 				# y_derivative
 				# was wrong???
-				# grad_H[ind + self.N_wells] = self.beta * (x[i] ** 2 + y[i] ** 2) * y[i]
-				grad_H[ind + self.N_wells] = 2. * self.beta_volume[i] * (x[i] ** 2 + y[i] ** 2) * y[i]
-				grad_len_grad_H_sqr[ind + self.N_wells] = 6. * (self.beta_volume[i] ** 2) * np.power(x[i] ** 2 + y[i] ** 2, 2) * y[i]
+				# grad_H[i + self.N_wells] = self.beta * (x[i] ** 2 + y[i] ** 2) * y[i]
+				grad_H[i + self.N_wells] = 2. * self.beta_flat[i] * (x[i] ** 2 + y[i] ** 2) * y[i]
+				grad_len_grad_H_sqr[i + self.N_wells] = 6. * (self.beta_flat[i] ** 2) * np.power(x[i] ** 2 + y[i] ** 2, 2) * y[i]
 
 				xnn_sum = 0
 				ynn_sum = 0
@@ -1679,32 +2667,32 @@ class DynamicsGenerator(object):
 				xnnn_sum = 0
 				ynnn_sum = 0
 
-				for j in self.nearest_neighbours(i):
+				for j in self.neighbour_lists[i]:
 					xnn_sum += x[j]
 					ynn_sum += y[j]
 					#                 xnn_brack += (x[j] ** 2 + y[j] ** 2) * x[j]
 					#                 ynn_brack += (x[j] ** 2 + y[j] ** 2) * y[j]
 
-					for k in self.nearest_neighbours(j):
+					for k in self.neighbour_lists[j]:
 						xnnn_sum += x[k]
 						ynnn_sum += y[k]
 						xnn_brack += (x[k] ** 2 + y[k] ** 2) * x[k]
 						ynn_brack += (x[k] ** 2 + y[k] ** 2) * y[k]
 
-				grad_len_grad_H_sqr[ind] += 2. * (self.J ** 2) * xnnn_sum
-				grad_len_grad_H_sqr[ind + self.N_wells] += 2. * (self.J ** 2) * ynnn_sum
+				grad_len_grad_H_sqr[i] += 2. * (self.J ** 2) * xnnn_sum
+				grad_len_grad_H_sqr[i + self.N_wells] += 2. * (self.J ** 2) * ynnn_sum
 
-				grad_len_grad_H_sqr[ind] += - 4. * (self.J * self.beta_volume[i]) * x[i] * y[i] * ynn_sum
-				grad_len_grad_H_sqr[ind + self.N_wells] += - 4. * (self.J * self.beta_volume[i]) * x[i] * y[i] * xnn_sum
+				grad_len_grad_H_sqr[i] += - 4. * (self.J * self.beta_flat[i]) * x[i] * y[i] * ynn_sum
+				grad_len_grad_H_sqr[i + self.N_wells] += - 4. * (self.J * self.beta_flat[i]) * x[i] * y[i] * xnn_sum
 
-				grad_len_grad_H_sqr[ind] += - 2. * (self.J * self.beta_volume[i]) * (3 * (x[i] ** 2) + (y[i] ** 2)) * xnn_sum
-				grad_len_grad_H_sqr[ind + self.N_wells] += - 2. * (self.J * self.beta_volume[i]) * ((x[i] ** 2) + 3 *(y[i] ** 2)) * ynn_sum
+				grad_len_grad_H_sqr[i] += - 2. * (self.J * self.beta_flat[i]) * (3 * (x[i] ** 2) + (y[i] ** 2)) * xnn_sum
+				grad_len_grad_H_sqr[i + self.N_wells] += - 2. * (self.J * self.beta_flat[i]) * ((x[i] ** 2) + 3 *(y[i] ** 2)) * ynn_sum
 
-				grad_len_grad_H_sqr[ind] += - 2. * (self.J * self.beta_volume[i]) * xnn_brack
-				grad_len_grad_H_sqr[ind + self.N_wells] += - 2. * (self.J * self.beta_volume[i]) * ynn_brack
+				grad_len_grad_H_sqr[i] += - 2. * (self.J * self.beta_flat[i]) * xnn_brack
+				grad_len_grad_H_sqr[i + self.N_wells] += - 2. * (self.J * self.beta_flat[i]) * ynn_brack
 
-				grad_H[ind] -= self.J * xnn_sum
-				grad_H[ind + self.N_wells] -= self.J * ynn_sum
+				grad_H[i] -= self.J * xnn_sum
+				grad_H[i + self.N_wells] -= self.J * ynn_sum
 
 			len_grad_H_sqr = np.dot(grad_H, grad_H)
 			#         len_grad_H_sqr += (self.J ** 2) * ((xnn_sum ** 2) + (ynn_sum ** 2))
@@ -1718,83 +2706,104 @@ class DynamicsGenerator(object):
 			len_grad_len_grad_H_sqr = np.dot(grad_len_grad_H_sqr, grad_len_grad_H_sqr)
 		return T1 + T2, T1, T2, lapl, len_grad, len_grad_len_grad_H_sqr
 
-	def calc_temperature(self):
-		T = np.zeros(self.X.shape[-1])
-		T1 = np.zeros(self.X.shape[-1])
-		T2 = np.zeros(self.X.shape[-1])
-		lapl = np.zeros(self.X.shape[-1])
-		len_grad = np.zeros(self.X.shape[-1])
-		len_grad_len_grad_H_sqr = np.zeros(self.X.shape[-1])
-
-		for it in range(T.shape[0]):
-			x = self.X[:,:,:,it].copy()
-			y = self.Y[:,:,:,it].copy()
-			grad_H = np.zeros(self.N_wells * 2)
-			len_grad_H_sqr = 0.
-			grad_len_grad_H_sqr = np.zeros(self.N_wells * 2)
-			# was wrong???
-			# laplacian_H = 4. * self.beta * self.N_part
-			laplacian_H = 8. * self.beta_amplitude * self.N_part
-			for ind, i in enumerate(self.wells_indices):
-				# x_derivative
-				# was wrong???
-				# grad_H[ind] = self.beta * (x[i] ** 2 + y[i] ** 2) * x[i]
-				grad_H[ind] = 2. * self.beta_volume[i] * (x[i] ** 2 + y[i] ** 2) * x[i]
-				grad_len_grad_H_sqr[ind] = 6. * (self.beta_volume[i] ** 2) * np.power(x[i] ** 2 + y[i] ** 2, 2) * x[i]
-
-				# y_derivative
-				# was wrong???
-				# grad_H[ind + self.N_wells] = self.beta * (x[i] ** 2 + y[i] ** 2) * y[i]
-				grad_H[ind + self.N_wells] = 2. * self.beta_volume[i] * (x[i] ** 2 + y[i] ** 2) * y[i]
-				grad_len_grad_H_sqr[ind + self.N_wells] = 6. * (self.beta_volume[i] ** 2) * np.power(x[i] ** 2 + y[i] ** 2, 2) * y[i]
-
-				xnn_sum = 0
-				ynn_sum = 0
-				xnn_brack = 0
-				ynn_brack = 0
-				xnnn_sum = 0
-				ynnn_sum = 0
-
-				for j in self.nearest_neighbours(i):
-					xnn_sum += x[j]
-					ynn_sum += y[j]
-					#                 xnn_brack += (x[j] ** 2 + y[j] ** 2) * x[j]
-					#                 ynn_brack += (x[j] ** 2 + y[j] ** 2) * y[j]
+	def calc_temperature(self, chunk_size=1000):
+		# Vectorized calc_temperature_old over the stored time steps, chunk_size steps at a time.
+		# The sums over the nearest neighbours of the nearest neighbours are done by applying
+		# the neighbour sum (the unweighted adjacency of nearest_neighbours) twice.
+		n_times = self.X.shape[-1]
+		T1 = np.zeros(n_times)
+		T2 = np.zeros(n_times)
+		lapl = np.zeros(n_times)
+		len_grad = np.zeros(n_times)
+		len_grad_len_grad_H_sqr = 0.
+		laplacian_H = 8. * self.beta_amplitude * self.N_part
+
+		A = self.lattice.adjacency(1., 1.)
+
+		def nn_sum(V):
+			# V[time, wells]; A is symmetric
+			return A.dot(V.T).T
+
+		J = self.J
+		beta = self.beta_flat
+		for t0 in range(0, n_times, chunk_size):
+			t1 = min(t0 + chunk_size, n_times)
+			# x, y[time, wells]
+			x = self.X[:,:,:,t0:t1].reshape(self.N_wells, t1 - t0).T
+			y = self.Y[:,:,:,t0:t1].reshape(self.N_wells, t1 - t0).T
+			rho2 = x ** 2 + y ** 2
+			xnn_sum = nn_sum(x)
+			ynn_sum = nn_sum(y)
+			xnnn_sum = nn_sum(xnn_sum)
+			ynnn_sum = nn_sum(ynn_sum)
+			xnn_brack = nn_sum(nn_sum(rho2 * x))
+			ynn_brack = nn_sum(nn_sum(rho2 * y))
+
+			grad_H_x = 2. * beta * rho2 * x - J * xnn_sum
+			grad_H_y = 2. * beta * rho2 * y - J * ynn_sum
+
+			grad_len_grad_H_sqr_x = (6. * (beta ** 2) * (rho2 ** 2) * x + 2. * (J ** 2) * xnnn_sum
+									 - 4. * (J * beta) * x * y * ynn_sum
+									 - 2. * (J * beta) * (3 * (x ** 2) + (y ** 2)) * xnn_sum
+									 - 2. * (J * beta) * xnn_brack)
+			grad_len_grad_H_sqr_y = (6. * (beta ** 2) * (rho2 ** 2) * y + 2. * (J ** 2) * ynnn_sum
+									 - 4. * (J * beta) * x * y * xnn_sum
+									 - 2. * (J * beta) * ((x ** 2) + 3 * (y ** 2)) * ynn_sum
+									 - 2. * (J * beta) * ynn_brack)
+
+			len_grad_H_sqr = np.sum(grad_H_x ** 2 + grad_H_y ** 2, axis=1)
+			T1[t0:t1] = laplacian_H / len_grad_H_sqr
+			T2[t0:t1] = -np.sum(grad_H_x * grad_len_grad_H_sqr_x + grad_H_y * grad_len_grad_H_sqr_y, axis=1) / (len_grad_H_sqr ** 2)
+			lapl[t0:t1] = laplacian_H
+			len_grad[t0:t1] = len_grad_H_sqr
+			# as in calc_temperature_old, the value at the last time step is returned
+			len_grad_len_grad_H_sqr = np.sum(grad_len_grad_H_sqr_x[-1] ** 2 + grad_len_grad_H_sqr_y[-1] ** 2)
+		return T1 + T2, T1, T2, lapl, len_grad, len_grad_len_grad_H_sqr
 
-					for k in self.nearest_neighbours(j):
-						xnnn_sum += x[k]
-						ynnn_sum += y[k]
-						xnn_brack += (x[k] ** 2 + y[k] ** 2) * x[k]
-						ynn_brack += (x[k] ** 2 + y[k] ** 2) * y[k]
+	def calc_numerical_temperature(self, x, y, N_samples=1000, n_proc=None, pert_len=0.1, chunk_size=1000, seed=None):#pert_len=0.014):
+		# Monte Carlo estimate of (T, T_Amp, T_Ph) as in calc_numerical_temperature_serial: the perturbations of
+		# a chunk of samples are drawn as one [chunk_size, 2*N_wells] block, projected, normalised and their
+		# energies evaluated by one batched call. seed makes the estimate reproducible for any chunk_size;
+		# n_proc is ignored, it keeps the positional slot of the former process-based version (now _mp).
+		rng = np.random.RandomState(seed)
+		x = x.flatten()
+		y = y.flatten()
+		E0 = self.calc_energy_XY_batch(x.reshape(1, -1), y.reshape(1, -1))[0]
 
-				grad_len_grad_H_sqr[ind] += 2. * (self.J ** 2) * xnnn_sum
-				grad_len_grad_H_sqr[ind + self.N_wells] += 2. * (self.J ** 2) * ynnn_sum
+		total_part = np.sqrt(np.sum(x ** 2) + np.sum(y ** 2))
+		pert_len = pert_len * total_part
+		nx = x / total_part
+		ny = y / total_part
 
-				grad_len_grad_H_sqr[ind] += - 4. * (self.J * self.beta_volume[i]) * x[i] * y[i] * ynn_sum
-				grad_len_grad_H_sqr[ind + self.N_wells] += - 4. * (self.J * self.beta_volume[i]) * x[i] * y[i] * xnn_sum
+		parti = np.sqrt(x ** 2 + y ** 2)
+		nxi = x / parti
+		nyi = y / parti
 
-				grad_len_grad_H_sqr[ind] += - 2. * (self.J * self.beta_volume[i]) * (3 * (x[i] ** 2) + (y[i] ** 2)) * xnn_sum
-				grad_len_grad_H_sqr[ind + self.N_wells] += - 2. * (self.J * self.beta_volume[i]) * ((x[i] ** 2) + 3 *(y[i] ** 2)) * ynn_sum
+		Es = np.zeros(N_samples)
+		Es_Amp = np.zeros(N_samples)
+		Es_Ph = np.zeros(N_samples)
+		for start in range(0, N_samples, chunk_size):
+			n = min(chunk_size, N_samples - start)
+			dpsi = rng.randn(n, 2 * self.N_wells)
+			dx = dpsi[:, :self.N_wells]
+			dy = dpsi[:, self.N_wells:]
 
-				grad_len_grad_H_sqr[ind] += - 2. * (self.J * self.beta_volume[i]) * xnn_brack
-				grad_len_grad_H_sqr[ind + self.N_wells] += - 2. * (self.J * self.beta_volume[i]) * ynn_brack
+			diff = np.dot(dx, nx) + np.dot(dy, ny)
+			dx -= diff[:, np.newaxis] * nx
+			dy -= diff[:, np.newaxis] * ny
 
-				grad_H[ind] -= self.J * xnn_sum
-				grad_H[ind + self.N_wells] -= self.J * ynn_sum
+			dnorm = np.sqrt(np.sum(dx ** 2, axis=1) + np.sum(dy ** 2, axis=1))
+			dx *= (pert_len / dnorm)[:, np.newaxis]
+			dy *= (pert_len / dnorm)[:, np.newaxis]
 
-			len_grad_H_sqr = np.dot(grad_H, grad_H)
-			#         len_grad_H_sqr += (self.J ** 2) * ((xnn_sum ** 2) + (ynn_sum ** 2))
-			#         len_grad_H_sqr += (self.beta ** 2) * (np.power(x[i] ** 2 + y[i] ** 2, 3))
-			#         len_grad_H_sqr -= 2. * self.J * self.beta * (x[i] ** 2 + y[i] ** 2) * (x[i] * xnn_sum + y[i] * ynn_sum)
+			proj = dx * nxi + dy * nyi
+			Es[start:start + n] = self.calc_energy_XY_batch(x + dx, y + dy)
+			Es_Amp[start:start + n] = self.calc_energy_XY_batch(x + nxi * proj, y + nyi * proj)
+			Es_Ph[start:start + n] = self.calc_energy_XY_batch(x + dx - nxi * proj, y + dy - nyi * proj)
 
-			T1[it] = laplacian_H / len_grad_H_sqr
-			T2[it] = -np.dot(grad_H, grad_len_grad_H_sqr) / (len_grad_H_sqr ** 2)
-			lapl[it] = laplacian_H
-			len_grad[it] = len_grad_H_sqr
-			len_grad_len_grad_H_sqr = np.dot(grad_len_grad_H_sqr, grad_len_grad_H_sqr)
-		return T1 + T2, T1, T2, lapl, len_grad, len_grad_len_grad_H_sqr
+		return 0.5 * (np.std(Es - E0) ** 2) / np.mean(Es - E0), 0.5 * (np.std(Es_Amp - E0) ** 2) / np.mean(Es_Amp - E0), 0.5 * (np.std(Es_Ph - E0) ** 2) / np.mean(Es_Ph - E0)
 
-	def calc_numerical_temperature(self, x, y, N_samples=1000, n_proc=40, pert_len=0.1):#pert_len=0.014):
+	def calc_numerical_temperature_mp(self, x, y, N_samples=1000, n_proc=40, pert_len=0.1):#pert_len=0.014):
 
 		iters = int(N_samples / n_proc)
 		N_samples = int(iters * n_proc)
@@ -1955,3 +2964,10 @@ def one_realization_slow(t, self, x, y, nx, ny, nxi, nyi, pert_len, iters, Es, E
 		Es[ind] = self.calc_energy_XY(x + dx, y + dy, 0)
 		Es_Amp[ind] = self.calc_energy_XY(x + dx_Amp, y + dy_Amp, 0)
 		Es_Ph[ind] = self.calc_energy_XY(x + dx_Ph, y + dy_Ph, 0)
+
+#
+# the generator of run_energy_sweep, inherited by the forked pool workers
+_sweep_generator = None
+
+def one_energy_shell(task):
+	return _sweep_generator.run_energy_shell(*task)
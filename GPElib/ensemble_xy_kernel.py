@@ -0,0 +1,133 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+
+class EnsembleXYKernel(object):
+	# XY right-hand side and observables for a batch of trajectories PSI[batch, 2*N_wells]
+	# sharing the lattice (nn_id* index arrays), the same as FusedXYKernel for every member.
+	# The on-site parameters (beta_flat, e_disorder_flat, h_dis_x_flat, h_dis_y_flat) and gamma are either
+	# common over wells (scalar or [N_wells]) or per member [batch, N_wells].
+	#
+	# dX =  y * (e + beta * |psi|^2 + h_ext + gamma * (xL * y - yL * x)) - yL + h_dis_y
+	# dY = -x * (e + beta * |psi|^2 + h_ext + gamma * (xL * y - yL * x)) + xL - h_dis_x
+	# with h_ext = h_ext_x * y - h_ext_y * x; dimensionality < 3 drops the bonds along the remaining axes.
+	# The observables are accumulated in ReductionPrecision.
+	def __init__(self, batch, N_wells, nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2,
+				 FloatPrecision=np.float64, dimensionality=3, ReductionPrecision=np.float64):
+		self.batch = batch
+		self.N_wells = N_wells
+		self.FloatPrecision = FloatPrecision
+		self.ReductionPrecision = ReductionPrecision
+		self.nn_ids = np.vstack((nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2)).astype(np.int64)
+		self.nn_ids = self.nn_ids[:2 * dimensionality]
+		self.nn_is_z = np.array([False, False, False, False, True, True])[:2 * dimensionality]
+
+		self.xL = np.zeros((batch, N_wells), dtype=self.FloatPrecision)
+		self.yL = np.zeros((batch, N_wells), dtype=self.FloatPrecision)
+		self.c = np.zeros((batch, N_wells), dtype=self.FloatPrecision)
+		self.d = np.zeros((batch, N_wells), dtype=self.FloatPrecision)
+		self.tmp = np.zeros((batch, N_wells), dtype=self.FloatPrecision)
+
+	def gather_sum(self, V, out, anisotropy):
+		out[:] = 0
+		for k in range(self.nn_ids.shape[0]):
+			np.take(V, self.nn_ids[k], axis=1, out=self.tmp)
+			if self.nn_is_z[k] and (anisotropy != 1.):
+				self.tmp *= anisotropy
+			out += self.tmp
+
+	def local_field(self, PSI, J, anisotropy):
+		N = self.N_wells
+		self.gather_sum(PSI[:, :N], self.xL, anisotropy)
+		self.gather_sum(PSI[:, N:], self.yL, anisotropy)
+		self.xL *= J
+		self.yL *= J
+		return self.xL, self.yL
+
+	def __call__(self, PSI, out, J, anisotropy, beta_flat, e_disorder_flat, h_dis_x_flat, h_dis_y_flat, gamma=0.,
+				 h_ext_x=0., h_ext_y=0.):
+		N = self.N_wells
+		X = PSI[:, :N]
+		Y = PSI[:, N:]
+		xL, yL = self.local_field(PSI, J, anisotropy)
+		c = self.c
+		tmp = self.tmp
+
+		np.multiply(X, X, out=c)
+		np.multiply(Y, Y, out=tmp)
+		c += tmp
+		c *= beta_flat
+		c += e_disorder_flat
+		if (h_ext_x != 0.) or (h_ext_y != 0.):
+			np.multiply(Y, h_ext_x, out=tmp)
+			c += tmp
+			np.multiply(X, h_ext_y, out=tmp)
+			c -= tmp
+		if np.any(gamma != 0.):
+			np.multiply(xL, Y, out=tmp)
+			np.multiply(yL, X, out=self.d)
+			tmp -= self.d
+			tmp *= gamma
+			c += tmp
+
+		np.multiply(Y, c, out=out[:, :N])
+		out[:, :N] -= yL
+		out[:, :N] += h_dis_y_flat
+		np.multiply(X, c, out=out[:, N:])
+		np.subtract(xL, out[:, N:], out=out[:, N:])
+		out[:, N:] -= h_dis_x_flat
+		return out
+
+	def nn_sum(self, V, anisotropy):
+		# the neighbour sum of gather_sum into a new array of the dtype of V
+		out = np.zeros_like(V)
+		for k in range(self.nn_ids.shape[0]):
+			out += (anisotropy if self.nn_is_z[k] else 1.) * V[:, self.nn_ids[k]]
+		return out
+
+	def calc_energy(self, PSI, J, anisotropy, beta_flat, e_disorder_flat, h_dis_x_flat, h_dis_y_flat):
+		# the same energy as DynamicsGenerator.calc_energy_XY_global, one value per member
+		N = self.N_wells
+		PSI = PSI.astype(self.ReductionPrecision, copy=False)
+		X = PSI[:, :N]
+		Y = PSI[:, N:]
+		xL = J * self.nn_sum(X, anisotropy)
+		yL = J * self.nn_sum(Y, anisotropy)
+		rho2 = X ** 2 + Y ** 2
+		return np.sum(beta_flat / 2. * rho2 ** 2 + e_disorder_flat * rho2 - (X * xL + Y * yL) +
+					  h_dis_x_flat * X + h_dis_y_flat * Y, axis=1)
+
+	def calc_nop(self, PSI):
+		N = self.N_wells
+		PSI = PSI.astype(self.ReductionPrecision, copy=False)
+		return np.sum(PSI[:, :N] ** 2 + PSI[:, N:] ** 2, axis=1)
+
+	def calc_participation_rate(self, PSI):
+		N = self.N_wells
+		PSI = PSI.astype(self.ReductionPrecision, copy=False)
+		rho2 = PSI[:, :N] ** 2 + PSI[:, N:] ** 2
+		return np.sum(rho2 ** 2, axis=1) / (np.sum(rho2, axis=1) ** 2)
@@ -0,0 +1,124 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+from scipy import fft
+
+class FFTHoppingXY(object):
+	# Exact propagator of the hopping part of the XY equations on the periodic lattice N_tuple:
+	#
+	# 	dX = -J S y + h_dis_y,  dY = J S x - h_dis_x,
+	#
+	# S = sum over the x, y neighbours + anisotropy * sum over the z neighbours. S is diagonal in Fourier space,
+	# 	a(k) = 2 J (cos(kx) + cos(ky) + anisotropy * cos(kz)),
+	# and for z = x + i y the flow is z(dt) = exp(i a dt) z + (exp(i a dt) - 1) / a * (-h), h = h_dis_x + i h_dis_y.
+	# The symbols of exp(i a dt) are real and even in k, so x and y are transformed separately by rfftn.
+	# Axes of size 1 count the well itself twice, as the roll-based neighbour indices do.
+	# Only valid for the clean periodic lattice: no hopping disorder, no open boundaries.
+	def __init__(self, N_tuple, workers=None, FloatPrecision=np.float64):
+		self.N_tuple = tuple(N_tuple)
+		self.N_wells = int(np.prod(self.N_tuple))
+		self.axes = tuple(range(-len(self.N_tuple), 0))
+		self.workers = workers
+		self.FloatPrecision = FloatPrecision
+
+		# rfftn halves the last axis
+		self.k = []
+		for ax, n in enumerate(self.N_tuple):
+			freq = fft.rfftfreq(n) if (ax == len(self.N_tuple) - 1) else fft.fftfreq(n)
+			shape = [1] * len(self.N_tuple)
+			shape[ax] = len(freq)
+			self.k.append((2. * np.pi * freq).reshape(shape))
+		# multiplicity of every rfftn mode in the full spectrum, for Parseval sums
+		n_last = self.N_tuple[-1]
+		mult = np.full(n_last // 2 + 1, 2.)
+		mult[0] = 1.
+		if (n_last % 2 == 0):
+			mult[-1] = 1.
+		self.multiplicity = mult
+		self.dispersion_cache = {}
+		self.propagator_cache = {}
+
+	def rfftn(self, v):
+		return fft.rfftn(v.reshape(v.shape[:-1] + self.N_tuple), axes=self.axes, workers=self.workers)
+
+	def irfftn(self, v_k, out_shape):
+		return fft.irfftn(v_k, s=self.N_tuple, axes=self.axes, workers=self.workers).reshape(out_shape)
+
+	def dispersion(self, J, anisotropy):
+		key = (J, anisotropy)
+		if key not in self.dispersion_cache:
+			a = 0.
+			for ax, k in enumerate(self.k):
+				a = a + (anisotropy if (ax == 2) else 1.) * 2. * np.cos(k)
+			self.dispersion_cache[key] = J * a
+		return self.dispersion_cache[key]
+
+	def propagator(self, dt, J, anisotropy, h_dis_x_flat, h_dis_y_flat):
+		# cos(a dt), sin(a dt) on the rfftn grid and the real-space displacement due to the static fields,
+		# cached for every (dt, J, anisotropy); the fields are fixed for the lifetime of a generator
+		key = (dt, J, anisotropy)
+		if key not in self.propagator_cache:
+			a = self.dispersion(J, anisotropy)
+			cos = np.cos(a * dt)
+			sin = np.sin(a * dt)
+			if np.any(h_dis_x_flat != 0) or np.any(h_dis_y_flat != 0):
+				# (exp(i a dt) - 1) / (i a) = s1 + i c1, with the limit dt at a = 0
+				small = np.abs(a) < 1e-12
+				a_safe = np.where(small, 1., a)
+				s1 = np.where(small, dt, sin / a_safe)
+				c1 = np.where(small, 0., (1. - cos) / a_safe)
+				hx = self.rfftn(np.asarray(h_dis_x_flat, dtype=self.FloatPrecision))
+				hy = self.rfftn(np.asarray(h_dis_y_flat, dtype=self.FloatPrecision))
+				shift_x = self.irfftn(s1 * hy + c1 * hx, self.N_wells).astype(self.FloatPrecision)
+				shift_y = self.irfftn(c1 * hy - s1 * hx, self.N_wells).astype(self.FloatPrecision)
+			else:
+				shift_x = None
+				shift_y = None
+			self.propagator_cache[key] = (cos, sin, shift_x, shift_y)
+		return self.propagator_cache[key]
+
+	def propagate(self, psi, dt, J, anisotropy, h_dis_x_flat, h_dis_y_flat):
+		# in place on psi[2 * N_wells]
+		N = self.N_wells
+		cos, sin, shift_x, shift_y = self.propagator(dt, J, anisotropy, h_dis_x_flat, h_dis_y_flat)
+		x_k = self.rfftn(psi[:N])
+		y_k = self.rfftn(psi[N:])
+		psi[:N] = self.irfftn(cos * x_k - sin * y_k, N)
+		psi[N:] = self.irfftn(sin * x_k + cos * y_k, N)
+		if shift_x is not None:
+			psi[:N] += shift_x
+			psi[N:] += shift_y
+		return psi
+
+	def kinetic_energy(self, PSI, J, anisotropy):
+		# -J sum_i (x_i (S x)_i + y_i (S y)_i) for PSI[..., 2 * N_wells], by Parseval
+		N = self.N_wells
+		a = self.dispersion(J, anisotropy)
+		x_k = self.rfftn(PSI[..., :N])
+		y_k = self.rfftn(PSI[..., N:])
+		power = (x_k.real ** 2 + x_k.imag ** 2 + y_k.real ** 2 + y_k.imag ** 2) * (a * self.multiplicity)
+		return - np.sum(power, axis=self.axes) / N
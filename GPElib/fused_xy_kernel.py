@@ -0,0 +1,203 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+import warnings
+
+try:
+	import numba
+except ImportError:
+	numba = None
+
+if numba is not None:
+	@numba.njit(cache=True)
+	def numba_fused_rhs(psi, out, nn_ids, weights, beta_flat, e_disorder_flat, h_dis_x_flat, h_dis_y_flat,
+						h_ext_x, h_ext_y, gamma_flat):
+		N = beta_flat.shape[0]
+		for i in range(N):
+			x = psi[i]
+			y = psi[i + N]
+			xL = 0.
+			yL = 0.
+			for k in range(nn_ids.shape[0]):
+				j = nn_ids[k, i]
+				xL += weights[k] * psi[j]
+				yL += weights[k] * psi[j + N]
+			c = (e_disorder_flat[i] + beta_flat[i] * (x * x + y * y) + (h_ext_x * y - h_ext_y * x) +
+				 gamma_flat[i] * (xL * y - yL * x))
+			out[i] = y * c - yL + h_dis_y_flat[i]
+			out[i + N] = - x * c + xL - h_dis_x_flat[i]
+
+class FusedXYKernel(object):
+	# Conservative + relaxational XY right-hand side in a single pass:
+	# the local field (xL, yL) is computed once and shared by both terms,
+	# the result is written into a caller-supplied buffer.
+	#
+	# dX =  y * (e + beta * |psi|^2 + h_ext + gamma * (xL * y - yL * x)) - yL + h_dis_y
+	# dY = -x * (e + beta * |psi|^2 + h_ext + gamma * (xL * y - yL * x)) + xL - h_dis_x
+	#
+	# Backends for the neighbour sums: 'gather' (nn_id* index arrays), 'roll' (shifted slices of
+	# the periodic N_tuple view) and 'numba' (compiled single loop over wells, if numba is installed).
+	# The neighbours are taken along the first dimensionality axes; dimensionality < 3 drops the on-site
+	# bonds of the axes of size 1, as the loop versions do.
+	def __init__(self, N_tuple, nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2,
+				 backend='gather', FloatPrecision=np.float64, dimensionality=3):
+		self.N_tuple = N_tuple
+		self.N_wells = int(np.prod(N_tuple))
+		self.FloatPrecision = FloatPrecision
+		self.dimensionality = dimensionality
+		self.nn_ids = np.vstack((nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2)).astype(np.int64)
+		self.nn_ids = self.nn_ids[:2 * dimensionality]
+		self.nn_is_z = np.array([False, False, False, False, True, True])[:2 * dimensionality]
+
+		if (backend == 'numba') and (numba is None):
+			warnings.warn('Numba is not installed, using the roll backend')
+			backend = 'roll'
+		if (backend == 'numba') and (np.finfo(FloatPrecision).eps < np.finfo(np.float64).eps):
+			warnings.warn('Numba does not support extended precision, using the roll backend')
+			backend = 'roll'
+		self.backend = backend
+
+		self.xL = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.yL = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.c = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.d = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.tmp = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.gamma_flat = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+
+	def gather_sum(self, v, out, anisotropy):
+		out[:] = 0
+		for k in range(self.nn_ids.shape[0]):
+			np.take(v, self.nn_ids[k], out=self.tmp)
+			if self.nn_is_z[k] and (anisotropy != 1.):
+				self.tmp *= anisotropy
+			out += self.tmp
+
+	def shift_add(self, v3, out3, axis):
+		# out[i] += v[i + 1] + v[i - 1] along the axis with periodic boundaries,
+		# the same neighbours as np.roll(wells_enumeration, -+1, axis)
+		lo = [slice(None)] * 3
+		hi = [slice(None)] * 3
+		first = [slice(None)] * 3
+		last = [slice(None)] * 3
+		lo[axis] = slice(None, -1)
+		hi[axis] = slice(1, None)
+		first[axis] = slice(0, 1)
+		last[axis] = slice(-1, None)
+		lo, hi, first, last = tuple(lo), tuple(hi), tuple(first), tuple(last)
+		out3[lo] += v3[hi]
+		out3[last] += v3[first]
+		out3[hi] += v3[lo]
+		out3[first] += v3[last]
+
+	def roll_sum(self, v, out, anisotropy):
+		v3 = v.reshape(self.N_tuple)
+		out[:] = 0
+		for axis in range(min(self.dimensionality, 2)):
+			self.shift_add(v3, out.reshape(self.N_tuple), axis)
+		if self.dimensionality == 3:
+			self.tmp[:] = 0
+			self.shift_add(v3, self.tmp.reshape(self.N_tuple), 2)
+			if anisotropy != 1.:
+				self.tmp *= anisotropy
+			out += self.tmp
+
+	def nn_sum(self, v, out, J, anisotropy):
+		# out = J * (sum of v over the neighbours) for a single component v[N_wells]
+		if self.backend in ['roll', 'numba']:
+			self.roll_sum(v, out, anisotropy)
+		else:
+			self.gather_sum(v, out, anisotropy)
+		out *= J
+		return out
+
+	def local_field(self, psi, J, anisotropy):
+		N = self.N_wells
+		if self.backend in ['roll', 'numba']:
+			self.roll_sum(psi[:N], self.xL, anisotropy)
+			self.roll_sum(psi[N:], self.yL, anisotropy)
+		else:
+			self.gather_sum(psi[:N], self.xL, anisotropy)
+			self.gather_sum(psi[N:], self.yL, anisotropy)
+		self.xL *= J
+		self.yL *= J
+		return self.xL, self.yL
+
+	def __call__(self, psi, out, J, anisotropy, beta_flat, e_disorder_flat, h_dis_x_flat, h_dis_y_flat,
+				 h_ext_x=0., h_ext_y=0., gamma=0., hamiltonian=True):
+		# gamma may be a scalar or an array over wells (tempered cooling), already multiplied by
+		# the time- or energy-dependent quenching factor;
+		# hamiltonian=False leaves only the relaxational term, as in RelaxationXY_fast
+		N = self.N_wells
+		x = psi[:N]
+		y = psi[N:]
+
+		if not hamiltonian:
+			xL, yL = self.local_field(psi, J, anisotropy)
+			np.multiply(xL, y, out=self.c)
+			np.multiply(yL, x, out=self.d)
+			self.c -= self.d
+			self.c *= gamma
+			np.multiply(y, self.c, out=out[:N])
+			np.multiply(x, self.c, out=out[N:])
+			out[N:] *= -1.
+			return out
+
+		if self.backend == 'numba':
+			self.gamma_flat[:] = gamma
+			weights = J * np.where(self.nn_is_z, anisotropy, 1.)
+			numba_fused_rhs(psi, out, self.nn_ids, weights, beta_flat, e_disorder_flat, h_dis_x_flat,
+							h_dis_y_flat, h_ext_x, h_ext_y, self.gamma_flat)
+			return out
+
+		xL, yL = self.local_field(psi, J, anisotropy)
+		c = self.c
+		tmp = self.tmp
+
+		np.multiply(x, x, out=c)
+		np.multiply(y, y, out=tmp)
+		c += tmp
+		c *= beta_flat
+		c += e_disorder_flat
+		if (h_ext_x != 0.) or (h_ext_y != 0.):
+			np.multiply(y, h_ext_x, out=tmp)
+			c += tmp
+			np.multiply(x, h_ext_y, out=tmp)
+			c -= tmp
+		if np.any(gamma != 0.):
+			np.multiply(xL, y, out=tmp)
+			np.multiply(yL, x, out=self.d)
+			tmp -= self.d
+			tmp *= gamma
+			c += tmp
+
+		np.multiply(y, c, out=out[:N])
+		out[:N] -= yL
+		out[:N] += h_dis_y_flat
+		np.multiply(x, c, out=out[N:])
+		np.subtract(xL, out[N:], out=out[N:])
+		out[N:] -= h_dis_x_flat
+		return out
@@ -0,0 +1,55 @@
+import torch
+
+
+class DGPE_ODE_BATCH(torch.nn.Module):
+	# XY equations of motion (conservative part with the external field h_ext + relaxation with gamma,
+	# a scalar or an array over wells) for a batch of trajectories y[batch, 2*N_wells] on a common lattice;
+	# e_disorder_flat may be either [N_wells] or per member [batch, N_wells].
+	# dimensionality < 3 drops the bonds along the remaining axes, as FusedXYKernel
+
+	def __init__(self, device, N_wells, J, anisotropy, gamma,
+				 nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2,
+				 h_dis_x_flat, h_dis_y_flat,
+				 beta_flat, e_disorder_flat,
+				 h_ext_x=0., h_ext_y=0., dimensionality=3
+				 ):
+		super(DGPE_ODE_BATCH, self).__init__()
+		self.h_ext_x = h_ext_x
+		self.h_ext_y = h_ext_y
+		self.dimensionality = dimensionality
+
+		self.J = torch.nn.Parameter(torch.tensor(J).to(device), requires_grad=False)
+		self.anisotropy = torch.nn.Parameter(torch.tensor(anisotropy).to(device), requires_grad=False)
+		self.gamma = torch.nn.Parameter(torch.tensor(gamma).to(device), requires_grad=False)
+
+		self.nn_idx_1 = torch.nn.Parameter(torch.tensor(nn_idx_1, dtype=torch.int64).to(device), requires_grad=False)
+		self.nn_idx_2 = torch.nn.Parameter(torch.tensor(nn_idx_2, dtype=torch.int64).to(device), requires_grad=False)
+		self.nn_idy_1 = torch.nn.Parameter(torch.tensor(nn_idy_1, dtype=torch.int64).to(device), requires_grad=False)
+		self.nn_idy_2 = torch.nn.Parameter(torch.tensor(nn_idy_2, dtype=torch.int64).to(device), requires_grad=False)
+		self.nn_idz_1 = torch.nn.Parameter(torch.tensor(nn_idz_1, dtype=torch.int64).to(device), requires_grad=False)
+		self.nn_idz_2 = torch.nn.Parameter(torch.tensor(nn_idz_2, dtype=torch.int64).to(device), requires_grad=False)
+
+		self.N_wells = N_wells
+
+		self.h_dis_x_flat = torch.nn.Parameter(torch.tensor(h_dis_x_flat).to(device), requires_grad=False)
+		self.h_dis_y_flat = torch.nn.Parameter(torch.tensor(h_dis_y_flat).to(device), requires_grad=False)
+		self.beta = torch.nn.Parameter(torch.tensor(beta_flat).to(device), requires_grad=False)
+		self.e_disorder = torch.nn.Parameter(torch.tensor(e_disorder_flat).to(device), requires_grad=False)
+
+	def local_field(self, v):
+		field = v[:, self.nn_idx_1] + v[:, self.nn_idx_2]
+		if self.dimensionality > 1:
+			field = field + v[:, self.nn_idy_1] + v[:, self.nn_idy_2]
+		if self.dimensionality > 2:
+			field = field + self.anisotropy * (v[:, self.nn_idz_1] + v[:, self.nn_idz_2])
+		return self.J * field
+
+	def forward(self, t, y):
+		x = y[:, :self.N_wells]
+		p = y[:, self.N_wells:]
+		xL = self.local_field(x)
+		yL = self.local_field(p)
+		c = (self.e_disorder + self.beta * (x * x + p * p) + (self.h_ext_x * p - self.h_ext_y * x) +
+			 self.gamma * (xL * p - yL * x))
+		return torch.cat([p * c - yL + self.h_dis_y_flat,
+						  -x * c + xL - self.h_dis_x_flat], dim=1)
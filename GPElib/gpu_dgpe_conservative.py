@@ -77,4 +77,19 @@ class DGPE_ODE(torch.nn.Module):
 									   )
 			)) - self.h_dis_x_flat -self.beta *
 			(torch.pow(y[self.N_wells:], 2) + torch.pow(y[:self.N_wells], 2)) * y[:self.N_wells]], dim=0)
-		)
\ No newline at end of file
+		)
+
+	def jvp(self, t, y, v):
+		# Jacobian of forward(t, .) at y applied to v [2*N_wells] or [k, 2*N_wells],
+		# by forward-mode differentiation through the same gather stencil
+		f = lambda z: self.forward(t, z)
+		if v.dim() == 1:
+			return torch.func.jvp(f, (y,), (v,))[1]
+		return torch.func.vmap(lambda w: torch.func.jvp(f, (y,), (w,))[1])(v)
+
+	def vjp(self, t, y, u):
+		# u^T J for u [2*N_wells] or [k, 2*N_wells]
+		_, f_vjp = torch.func.vjp(lambda z: self.forward(t, z), y)
+		if u.dim() == 1:
+			return f_vjp(u)[0]
+		return torch.func.vmap(lambda w: f_vjp(w)[0])(u)
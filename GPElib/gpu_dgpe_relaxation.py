@@ -125,6 +125,44 @@ class DGPE_ODE_RELAXATION(torch.nn.Module):
 									 y[self.N_wells:] * yL) + self.h_dis_x_flat * y[:self.N_wells] + self.h_dis_y_flat * y[self.N_wells:]
 						 )
 
+	def jvp(self, t, y, v):
+		# Jacobian of forward(t, .) at y applied to v [2*N_wells] or [k, 2*N_wells],
+		# by forward-mode differentiation through the same gather stencil
+		f = lambda z: self.forward(t, z)
+		if v.dim() == 1:
+			return torch.func.jvp(f, (y,), (v,))[1]
+		return torch.func.vmap(lambda w: torch.func.jvp(f, (y,), (w,))[1])(v)
+
+	def vjp(self, t, y, u):
+		# u^T J for u [2*N_wells] or [k, 2*N_wells]
+		_, f_vjp = torch.func.vjp(lambda z: self.forward(t, z), y)
+		if u.dim() == 1:
+			return f_vjp(u)[0]
+		return torch.func.vmap(lambda w: f_vjp(w)[0])(u)
+
+	def energy_event(self, t, y):
+		# event function for torchdiffeq.odeint_event: changes sign when the energy crosses E_desired
+		xL = (self.J * (
+							torch.gather(y[:self.N_wells], 0, self.nn_idx_1) +
+							torch.gather(y[:self.N_wells], 0, self.nn_idx_2) +
+							torch.gather(y[:self.N_wells], 0, self.nn_idy_1) +
+							torch.gather(y[:self.N_wells], 0, self.nn_idy_2) +
+							self.anisotropy * (torch.gather(y[:self.N_wells], 0, self.nn_idz_1) +
+											   torch.gather(y[:self.N_wells], 0, self.nn_idz_2)
+											   )
+					))
+
+		yL = (self.J * (
+					torch.gather(y[self.N_wells:], 0, self.nn_idx_1) +
+					torch.gather(y[self.N_wells:], 0, self.nn_idx_2) +
+					torch.gather(y[self.N_wells:], 0, self.nn_idy_1) +
+					torch.gather(y[self.N_wells:], 0, self.nn_idy_2) +
+					self.anisotropy * (torch.gather(y[self.N_wells:], 0, self.nn_idz_1) +
+									   torch.gather(y[self.N_wells:], 0, self.nn_idz_2)
+									   )
+			))
+		return self.calc_energy_XY(y, xL, yL) - self.E_desired
+
 	def quenching_profile(self, time):
 		return -self.gamma * torch.pow(self.lam1-self.lam2, -1) * (self.lam1 * torch.exp(-self.lam1 * time) - self.lam2 * torch.exp(-self.lam2 * time))
 
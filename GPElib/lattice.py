@@ -0,0 +1,80 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+from scipy.sparse import csr_matrix
+
+class LatticeTopology(object):
+	# Neighbour structure of the periodic N_tuple lattice, built once per (N_tuple, dimensionality):
+	#
+	# nn_idx_1, ..., nn_idz_2 - the 6 neighbours of every well along all three axes
+	# 	(an axis of size 1 gives the well itself), used by the vectorized kernels;
+	# neighbours[N_wells, z] - int32 table of the z = 2 * dimensionality neighbours in the order
+	# 	x+1, x-1, y+1, y-1, z-1, z+1 of the former nearest_neighbours(), and its rows as lists for the loop versions;
+	# is_z_bond[z] - bonds along z, which get the anisotropy factor.
+	def __init__(self, N_tuple, dimensionality):
+		self.N_tuple = tuple(N_tuple)
+		self.dimensionality = dimensionality
+		self.N_wells = int(np.prod(self.N_tuple))
+		self.z = 2 * dimensionality
+
+		wells_enumeration = np.arange(self.N_wells).reshape(self.N_tuple)
+		self.nn_idx_1 = np.roll(wells_enumeration, -1, axis=0).flatten()
+		self.nn_idx_2 = np.roll(wells_enumeration, 1, axis=0).flatten()
+		self.nn_idy_1 = np.roll(wells_enumeration, -1, axis=1).flatten()
+		self.nn_idy_2 = np.roll(wells_enumeration, 1, axis=1).flatten()
+		self.nn_idz_1 = np.roll(wells_enumeration, -1, axis=2).flatten()
+		self.nn_idz_2 = np.roll(wells_enumeration, 1, axis=2).flatten()
+
+		self.neighbours = np.ascontiguousarray(np.vstack((self.nn_idx_1, self.nn_idx_2, self.nn_idy_1, self.nn_idy_2,
+														  self.nn_idz_2, self.nn_idz_1))[:self.z].T, dtype=np.int32)
+		# the same table as Python lists: the loop versions index faster with Python ints than with numpy scalars
+		self.neighbour_lists = self.neighbours.tolist()
+		self.is_z_bond = np.arange(self.z) > 3
+		self.adjacency_cache = {}
+
+	def bond_weights(self, J, anisotropy):
+		# coupling of every bond of a well, J or anisotropy * J
+		return J * np.where(self.is_z_bond, anisotropy, 1.)
+
+	def adjacency(self, J, anisotropy):
+		# A[i, j] = sum of the couplings of the bonds i - j, as CSR; cached per (J, anisotropy)
+		key = (J, anisotropy)
+		if key not in self.adjacency_cache:
+			rows = np.repeat(np.arange(self.N_wells, dtype=np.int32), self.z)
+			weights = np.tile(self.bond_weights(J, anisotropy), self.N_wells)
+			A = csr_matrix((weights, (rows, self.neighbours.flatten())), shape=(self.N_wells, self.N_wells))
+			A.sum_duplicates()
+			self.adjacency_cache[key] = A
+		return self.adjacency_cache[key]
+
+lattice_cache = {}
+
+def get_lattice_topology(N_tuple, dimensionality):
+	key = (tuple(N_tuple), dimensionality)
+	if key not in lattice_cache:
+		lattice_cache[key] = LatticeTopology(N_tuple, dimensionality)
+	return lattice_cache[key]
@@ -0,0 +1,95 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+
+class LocalObservablesXY(object):
+	# Constants of motion of a single XY state in one vectorized pass over the lattice neighbour table,
+	# all intermediate arrays are preallocated and the sums are accumulated in ReductionPrecision:
+	#
+	# E = sum_j (beta_j / 2 * |psi_j|^4 + e_j * |psi_j|^2) - sum_j sum_k w_k * (x_j * x_k + y_j * y_k)
+	# N = sum_j |psi_j|^2, sum_rho4 = sum_j |psi_j|^4 (for the participation rate)
+	# L = -2 * J * sum_j (x_j * y_k - y_j * x_k) with k the last neighbour of j, as in the loop version
+	#
+	# The bonds are the 2 * dimensionality neighbours of LatticeTopology with w_k = J or anisotropy * J.
+	def __init__(self, lattice, FloatPrecision=np.float64, ReductionPrecision=np.float64):
+		self.N_tuple = lattice.N_tuple
+		self.N_wells = lattice.N_wells
+		self.FloatPrecision = FloatPrecision
+		self.ReductionPrecision = ReductionPrecision
+		self.lattice = lattice
+		self.nn_ids = np.ascontiguousarray(lattice.neighbours.T)
+
+		self.x = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.y = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.gx = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.gy = np.zeros(self.N_wells, dtype=self.FloatPrecision)
+		self.rho2 = np.zeros(self.N_wells, dtype=self.ReductionPrecision)
+		self.p = np.zeros(self.N_wells, dtype=self.ReductionPrecision)
+		self.q = np.zeros(self.N_wells, dtype=self.ReductionPrecision)
+		self.hopping = np.zeros(self.N_wells, dtype=self.ReductionPrecision)
+
+	def load(self, X, Y):
+		# X, Y - any view with N_wells elements (e.g. X[:,:,:,inext]), copied without temporaries
+		np.copyto(self.x.reshape(X.shape), X, casting='same_kind')
+		np.copyto(self.y.reshape(Y.shape), Y, casting='same_kind')
+
+	def compute(self, X, Y, J, anisotropy, beta_flat, e_disorder_flat):
+		# returns energy, number_of_particles, angular_momentum, sum_rho4
+		R = self.ReductionPrecision
+		self.load(X, Y)
+		x, y, p, q = self.x, self.y, self.p, self.q
+
+		np.multiply(x, x, out=self.rho2, dtype=R)
+		np.multiply(y, y, out=q, dtype=R)
+		self.rho2 += q
+		number_of_particles = self.rho2.sum()
+
+		np.multiply(self.rho2, self.rho2, out=p)
+		sum_rho4 = p.sum()
+		np.multiply(p, beta_flat, out=p, dtype=R)
+		np.multiply(self.rho2, e_disorder_flat, out=q, dtype=R)
+		energy = 0.5 * p.sum() + q.sum()
+
+		weights = self.lattice.bond_weights(J, anisotropy)
+		self.hopping[:] = 0
+		for k in range(self.nn_ids.shape[0]):
+			np.take(x, self.nn_ids[k], out=self.gx)
+			np.take(y, self.nn_ids[k], out=self.gy)
+			np.multiply(x, self.gx, out=p, dtype=R)
+			np.multiply(y, self.gy, out=q, dtype=R)
+			p += q
+			p *= weights[k]
+			self.hopping += p
+		energy -= self.hopping.sum()
+
+		# gx, gy still hold the last neighbour of every well
+		np.multiply(x, self.gy, out=p, dtype=R)
+		np.multiply(y, self.gx, out=q, dtype=R)
+		p -= q
+		angular_momentum = - 2 * J * p.sum()
+
+		return energy, number_of_particles, angular_momentum, sum_rho4
@@ -27,6 +27,7 @@ SOFTWARE.
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from .two_trajs_generator import TwoTrajsGenerator
+from .lyapunov_spectrum import LyapunovSpectrumXY
 
 class LyapunovGenerator(TwoTrajsGenerator):
 	def __init__(self, **kwargs):
@@ -69,34 +70,33 @@ class LyapunovGenerator(TwoTrajsGenerator):
 		self.icurr = 0
 		self.inext = 1
 
-		for i in xrange(1, self.n_steps):
+		for i in range(1, self.n_steps):
 
-			if (np.any(self.RHO[:,:,:,icurr] ** 2 < self.threshold_XY_to_polar) or (np.any(self.RHO1[:,:,:,icurr] ** 2 < self.threshold_XY_to_polar))):
-				psi = self.rk4_step_exp_XY(np.hstack((self.X[:,:,:,icurr].flatten(), self.Y[:,:,:,icurr].flatten())))
-				psi1 = self.rk4_step_exp_XY(np.hstack((self.X1[:,:,:,icurr].flatten(), self.Y1[:,:,:,icurr].flatten())))
+			if (self.polar.below_threshold(icurr, self.threshold_XY_to_polar) or
+					self.polar1.below_threshold(icurr, self.threshold_XY_to_polar)):
+				psi = self.rk4_step_exp_XY(self.load_XY(icurr, self.psiNextXY))
+				psi1 = self.rk4_step_exp_XY(self.load_XY1(icurr, self.psiNextXY1))
 				self.X[:,:,:,inext] = psi[:self.N_wells].reshape(self.N_tuple)
 				self.Y[:,:,:,inext] = psi[self.N_wells:].reshape(self.N_tuple)
-				self.RHO[:,:,:,inext], self.THETA[:,:,:,inext] = self.from_XY_to_polar(self.X[:,:,:,inext], self.Y[:,:,:,inext])
+				self.polar.invalidate(inext)
 				self.X1[:,:,:,inext] = psi1[:self.N_wells].reshape(self.N_tuple)
 				self.Y1[:,:,:,inext] = psi1[self.N_wells:].reshape(self.N_tuple)
-				self.RHO1[:,:,:,inext], self.THETA1[:,:,:,inext] = self.from_XY_to_polar(self.X1[:,:,:,inext], self.Y1[:,:,:,inext])
+				self.polar1.invalidate(inext)
 				# self.X1[:,:,:,i], self.Y1[:,:,:,i] = self.from_polar_to_XY(self.RHO1[:,:,:,i], self.THETA1[:,:,:,i])
 			else:
-				psi = self.rk4_step_exp(np.hstack((self.RHO[:,:,:,icurr].flatten(), self.THETA[:,:,:,icurr].flatten())))
-				psi1 = self.rk4_step_exp(np.hstack((self.RHO1[:,:,:,icurr].flatten(), self.THETA1[:,:,:,icurr].flatten())))
-				self.RHO[:,:,:,inext] = psi[:self.N_wells].reshape(self.N_tuple)
-				self.THETA[:,:,:,inext] = psi[self.N_wells:].reshape(self.N_tuple)
-				self.X[:,:,:,inext], self.Y[:,:,:,inext] = self.from_polar_to_XY(self.RHO[:,:,:,inext], self.THETA[:,:,:,inext])
-				self.RHO1[:,:,:,inext] = psi1[:self.N_wells].reshape(self.N_tuple)
-				self.THETA1[:,:,:,inext] = psi1[self.N_wells:].reshape(self.N_tuple)
-				self.X1[:,:,:,inext], self.Y1[:,:,:,inext] = self.from_polar_to_XY(self.RHO1[:,:,:,inext], self.THETA1[:,:,:,inext])
+				psi = self.rk4_step_exp(self.load_polar(icurr, self.psiNext))
+				psi1 = self.rk4_step_exp(self.load_polar1(icurr, self.psiNext1))
+				self.polar.store(inext, psi[:self.N_wells], psi[self.N_wells:])
+				self.X[:,:,:,inext], self.Y[:,:,:,inext] = self.from_polar_to_XY(*self.polar.slot(inext))
+				self.polar1.store(inext, psi1[:self.N_wells], psi1[self.N_wells:])
+				self.X1[:,:,:,inext], self.Y1[:,:,:,inext] = self.from_polar_to_XY(*self.polar1.slot(inext))
 			dist = self.calc_traj_shift_XY(self.X[:,:,:,inext], self.Y[:,:,:,inext], self.X1[:,:,:,inext], self.Y1[:,:,:,inext])
 			self.distance[i] = dist
 			self.distance_check.append(dist)
 			# if (dist > self.Lyapunov_EPS) or (i - self.instability_stops[-1] > self.reset_steps_duration):
 			if (i - self.instability_stops[-1] > self.reset_steps_duration):
 				self.X1[:,:,:,inext], self.Y1[:,:,:,inext] = self.reset_perturbation_XY(self.X[:,:,:,inext], self.Y[:,:,:,inext], self.X1[:,:,:,inext], self.Y1[:,:,:,inext])
-				self.RHO1[:,:,:,inext], self.THETA1[:,:,:,inext] = self.from_XY_to_polar(self.X1[:,:,:,inext], self.Y1[:,:,:,inext])
+				self.polar1.invalidate(inext)
 				self.instability_stops.append(i)
 			self.set_constants_of_motion_local(i, inext)
 
@@ -124,6 +124,18 @@ class LyapunovGenerator(TwoTrajsGenerator):
 			self.make_exception('Discontinuity during the calculations (distance b/w trajectories > 1)\n')
 		self.calculate_lambdas()
 
+	def run_lyapunov_spectrum(self, k=1, n_steps=None, qr_every=10, backend='numpy', seed=None):
+		# First k Lyapunov exponents of the conservative dynamics from the initial state X/Y[..., 0]
+		# by the tangent-space engine LyapunovSpectrumXY (no second trajectory, no PERT_EPS)
+		if n_steps is None:
+			n_steps = self.n_steps
+		engine = LyapunovSpectrumXY(self, k, qr_every=qr_every, backend=backend)
+		psi0 = np.hstack((self.X[:,:,:,0].flatten(), self.Y[:,:,:,0].flatten()))
+		self.lyapunov_spectrum = engine.run(psi0, n_steps, seed=seed)
+		self.lyapunov_spectrum_history = engine.exponents_history
+		self.lyapunov_spectrum_T = engine.T_history
+		return self.lyapunov_spectrum
+
 	def calculate_lambdas(self):
 		self.lambdas = []
 		self.lambdas_no_regr = []
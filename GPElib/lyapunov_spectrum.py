@@ -0,0 +1,148 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+import torch
+
+class LyapunovSpectrumXY(object):
+	# Tangent-space (Benettin) estimate of the first k Lyapunov exponents of the conservative XY dynamics
+	# of a DynamicsGenerator. The reference trajectory psi[2*N_wells] and k deviation vectors V[k, 2*N_wells]
+	# are advanced together by RK4 with the generator's step; the deviations follow DynamicsGenerator.jvp
+	# (conservative, with the same nn_id* gather stencil as the right-hand side, no Jacobian matrix).
+	# Every qr_every steps V is re-orthonormalised by a QR decomposition and log|diag R| is accumulated.
+	# Memory is O(k * N_wells); backend='numpy' or 'torch' (on the generator's torch_device).
+	def __init__(self, generator, k, qr_every=10, backend='numpy'):
+		self.generator = generator
+		self.N_wells = generator.N_wells
+		self.k = k
+		self.qr_every = qr_every
+		self.step = generator.step
+		self.backend = backend
+
+		self.h_ext_x = generator.h_ext_x
+		self.h_ext_y = generator.h_ext_y
+		self.stencil = generator.get_tangent_stencil(backend)
+		params = [generator.h_dis_x_flat, generator.h_dis_y_flat]
+		if backend == 'torch':
+			self.device = generator.torch_device
+			self.FloatPrecision = generator.torch_FloatPrecision
+			params = [torch.from_numpy(np.array(p, dtype=np.float64)).type(self.FloatPrecision).to(self.device) for p in params]
+		else:
+			self.FloatPrecision = generator.FloatPrecision
+		self.h_dis_x_flat, self.h_dis_y_flat = params
+
+	def cat(self, a, b):
+		if self.backend == 'torch':
+			return torch.cat([a, b], dim=-1)
+		return np.concatenate((a, b), axis=-1)
+
+	def rhs(self, psi):
+		beta_flat, e_disorder_flat, nn_ids = self.stencil
+		x = psi[..., :self.N_wells]
+		y = psi[..., self.N_wells:]
+		c = e_disorder_flat + beta_flat * (x * x + y * y) + self.h_ext_x * y - self.h_ext_y * x
+		return self.cat(y * c - self.generator.nn_sum_XY(y, nn_ids) + self.h_dis_y_flat,
+						-x * c + self.generator.nn_sum_XY(x, nn_ids) - self.h_dis_x_flat)
+
+	def jvp(self, psi, V):
+		# Jacobian of rhs at psi[2*N_wells] applied to the rows of V[k, 2*N_wells]
+		return self.generator.jvp(psi, V, conservative=True, stencil=self.stencil)
+
+	def rk4_step(self, psi, V):
+		h = self.step
+		k1 = self.rhs(psi)
+		l1 = self.jvp(psi, V)
+		psi2 = psi + 0.5 * h * k1
+		V2 = V + 0.5 * h * l1
+		k2 = self.rhs(psi2)
+		l2 = self.jvp(psi2, V2)
+		psi3 = psi + 0.5 * h * k2
+		V3 = V + 0.5 * h * l2
+		k3 = self.rhs(psi3)
+		l3 = self.jvp(psi3, V3)
+		psi4 = psi + h * k3
+		V4 = V + h * l3
+		k4 = self.rhs(psi4)
+		l4 = self.jvp(psi4, V4)
+		return (psi + h / 6. * (k1 + 2. * k2 + 2. * k3 + k4),
+				V + h / 6. * (l1 + 2. * l2 + 2. * l3 + l4))
+
+	def orthonormalize(self, V):
+		# V[k, 2*N_wells] -> orthonormal rows and log of the stretching factors
+		if self.backend == 'torch':
+			Q, R = torch.linalg.qr(V.T)
+			return Q.T.contiguous(), torch.log(torch.abs(torch.diagonal(R))).cpu().numpy()
+		if np.finfo(V.dtype).eps < np.finfo(np.float64).eps:
+			return self.gram_schmidt(V)
+		Q, R = np.linalg.qr(V.T)
+		return np.ascontiguousarray(Q.T), np.log(np.abs(np.diagonal(R)))
+
+	def gram_schmidt(self, V):
+		# modified Gram-Schmidt on the rows of V, for the extended precision that np.linalg.qr does not support
+		Q = V.copy()
+		log_r = np.zeros(self.k, dtype=V.dtype)
+		for i in range(self.k):
+			for j in range(i):
+				Q[i] -= np.dot(Q[j], Q[i]) * Q[j]
+			r = np.sqrt(np.dot(Q[i], Q[i]))
+			Q[i] /= r
+			log_r[i] = np.log(r)
+		return Q, log_r
+
+	def run(self, psi0, n_steps, V0=None, seed=None):
+		# Returns the first k exponents; the running estimates after every QR are kept
+		# in exponents_history[n_qr, k] at the times T_history.
+		if n_steps < 2:
+			raise ValueError('LyapunovSpectrumXY.run needs n_steps >= 2, got %s' % n_steps)
+		if V0 is None:
+			V0 = np.random.RandomState(seed).randn(self.k, 2 * self.N_wells)
+		if self.backend == 'torch':
+			psi = torch.from_numpy(np.array(psi0, dtype=np.float64)).type(self.FloatPrecision).to(self.device)
+			V = torch.from_numpy(np.array(V0, dtype=np.float64)).type(self.FloatPrecision).to(self.device)
+		else:
+			psi = np.array(psi0, dtype=self.FloatPrecision)
+			V = np.array(V0, dtype=self.FloatPrecision)
+		V, log_r = self.orthonormalize(V)
+
+		log_sum = np.zeros(self.k, dtype=np.float64 if self.backend == 'torch' else np.promote_types(self.FloatPrecision, np.float64))
+		history = []
+		times = []
+		for i in range(1, n_steps):
+			psi, V = self.rk4_step(psi, V)
+			if (i % self.qr_every == 0) or (i == n_steps - 1):
+				V, log_r = self.orthonormalize(V)
+				log_sum += log_r
+				times.append(i * self.step)
+				history.append(log_sum / times[-1])
+
+		self.exponents_history = np.array(history)
+		self.T_history = np.array(times)
+		if self.backend == 'torch':
+			self.psi = psi.cpu().numpy()
+		else:
+			self.psi = psi
+		self.V = V
+		return self.exponents_history[-1]
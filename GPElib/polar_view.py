@@ -0,0 +1,111 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+
+class LazyPolarXY(object):
+	# RHO, THETA of a stored XY trajectory X, Y[N_tuple + (n_slots,)], derived from X, Y only when they are read:
+	#
+	# every time slot is marked stale when X, Y are written there (invalidate), reading rho() / theta()
+	# converts the stale slots in contiguous blocks of at most block_size slots;
+	# slots produced by the polar integrator are stored directly (store) and keep its unwrapped phases.
+	#
+	# A new X or Y array (e.g. the reshaped scipy result) is picked up by attach and invalidates all slots.
+	def __init__(self, block_size=256):
+		self.block_size = block_size
+		self.X = None
+		self.Y = None
+		self.RHO = None
+		self.THETA = None
+		self.valid = None
+
+	def attach(self, X, Y):
+		if (X is not self.X) or (Y is not self.Y):
+			self.X = X
+			self.Y = Y
+			if (self.RHO is None) or (self.RHO.shape != X.shape) or (self.RHO.dtype != X.dtype):
+				self.RHO = np.zeros(X.shape, dtype=X.dtype)
+				self.THETA = np.zeros(X.shape, dtype=X.dtype)
+			self.valid = np.zeros(X.shape[-1], dtype=bool)
+		return self
+
+	def invalidate(self, slot=None):
+		if slot is None:
+			self.valid[:] = False
+		else:
+			self.valid[slot] = False
+
+	def convert(self, a, b):
+		# the same arithmetic as DynamicsGenerator.from_XY_to_polar
+		x = self.X[..., a:b]
+		y = self.Y[..., a:b]
+		self.RHO[..., a:b] = np.sqrt((x ** 2) + (y ** 2))
+		self.THETA[..., a:b] = np.arctan2(y, x)
+		self.valid[a:b] = True
+
+	def sync(self):
+		stale = np.flatnonzero(~self.valid)
+		if stale.size == 0:
+			return
+		for block in np.split(stale, np.flatnonzero(np.diff(stale) != 1) + 1):
+			for a in range(block[0], block[-1] + 1, self.block_size):
+				self.convert(a, min(a + self.block_size, block[-1] + 1))
+
+	def rho(self):
+		self.sync()
+		return self.RHO
+
+	def theta(self):
+		self.sync()
+		return self.THETA
+
+	def set_rho(self, value):
+		# assignment of the whole array, as in generator.RHO = ...; the values are taken as they are
+		self.RHO = value
+		self.valid[:] = True
+
+	def set_theta(self, value):
+		self.THETA = value
+		self.valid[:] = True
+
+	def slot(self, slot):
+		# RHO, THETA of a single slot, converting only this slot if it is stale
+		if not self.valid[slot]:
+			self.convert(slot, slot + 1)
+		return self.RHO[..., slot], self.THETA[..., slot]
+
+	def store(self, slot, rho, theta):
+		self.RHO[..., slot] = rho.reshape(self.RHO.shape[:-1])
+		self.THETA[..., slot] = theta.reshape(self.THETA.shape[:-1])
+		self.valid[slot] = True
+
+	def below_threshold(self, slot, threshold):
+		# np.any(RHO[..., slot] ** 2 < threshold) without converting a stale slot
+		if self.valid[slot]:
+			return np.any(self.RHO[..., slot] ** 2 < threshold)
+		x = self.X[..., slot]
+		y = self.Y[..., slot]
+		return np.any((x ** 2) + (y ** 2) < threshold)
@@ -0,0 +1,160 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import os
+import json
+import glob
+import shutil
+import tempfile
+import numpy as np
+
+class ResultsStore(object):
+	# Append-only on-disk store of per-trajectory results of an ensemble driver:
+	#
+	# <directory>/writer_<writer_id>/record_<n>/<name>.npy - the arrays of the n-th record of a writer,
+	# <directory>/writer_<writer_id>/index.jsonl           - one line per record: n, names, shapes, dtypes, meta.
+	#
+	# Every job (my_id) writes only into its own writer_<writer_id>, so parallel jobs need no locking.
+	# A record is written into a temporary directory and renamed into place before its index line is
+	# appended, so a killed job leaves no partial record; appending costs the same for the first and the
+	# thousandth trajectory. read / merge combine the records of all writers (or of the given ones).
+	# has(**meta) tells whether this writer already holds a record with the given meta values, so that a
+	# restarted job can skip the trajectories it appended before it was killed.
+	def __init__(self, directory, writer_id=0):
+		self.directory = directory
+		self.writer_id = writer_id
+		self.writer_dir = os.path.join(self.directory, 'writer_' + str(writer_id))
+		if not os.path.isdir(self.writer_dir):
+			os.makedirs(self.writer_dir)
+		self.index_file = os.path.join(self.writer_dir, 'index.jsonl')
+		if os.path.exists(self.index_file) and (os.path.getsize(self.index_file) > 0):
+			with open(self.index_file, 'rb+') as f:
+				f.seek(-1, os.SEEK_END)
+				if f.read(1) != b'\n':
+					# terminate a line cut by a killed job, so that the next entry starts on its own line
+					f.write(b'\n')
+		entries = self.read_index(self.writer_dir)
+		self.n_records = (entries[-1]['n'] + 1) if len(entries) > 0 else 0
+		self.metas = [entry['meta'] for entry in entries]
+
+	def record_dir(self, writer_dir, n):
+		return os.path.join(writer_dir, 'record_%08d' % n)
+
+	def append(self, record, **meta):
+		# record - dict name -> array of one trajectory, meta - JSON-serialisable scalars (seed, energy, ...)
+		n = self.n_records
+		tmp = tempfile.mkdtemp(prefix='.record_', dir=self.writer_dir)
+		try:
+			for name, value in record.items():
+				np.save(os.path.join(tmp, name + '.npy'), np.asarray(value))
+			path = self.record_dir(self.writer_dir, n)
+			if os.path.isdir(path):
+				# left by a job killed between the rename and the index line
+				shutil.rmtree(path)
+			os.rename(tmp, path)
+		except BaseException:
+			shutil.rmtree(tmp, ignore_errors=True)
+			raise
+		entry = {'n': n, 'names': list(record.keys()),
+				 'shapes': [list(np.shape(v)) for v in record.values()],
+				 'dtypes': [np.asarray(v).dtype.str for v in record.values()], 'meta': meta}
+		with open(self.index_file, 'a') as f:
+			f.write(json.dumps(entry) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+		self.n_records += 1
+		self.metas.append(meta)
+		return n
+
+	def has(self, **meta):
+		# a record of this writer whose meta has all the given key-value pairs, e.g. has(traj_seed=3, k_traj=0)
+		return any(all(m.get(key) == value for key, value in meta.items()) for m in self.metas)
+
+	def read_index(self, writer_dir):
+		entries = []
+		index_file = os.path.join(writer_dir, 'index.jsonl')
+		if not os.path.exists(index_file):
+			return entries
+		with open(index_file) as f:
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# a line cut by a killed job
+					continue
+				entry['writer_id'] = os.path.basename(writer_dir)[len('writer_'):]
+				entry['path'] = self.record_dir(writer_dir, entry['n'])
+				entries.append(entry)
+		return entries
+
+	def writers(self):
+		return sorted(glob.glob(os.path.join(self.directory, 'writer_*')))
+
+	def records(self, writer_ids=None):
+		# index entries of all records, ordered by writer and record number
+		entries = []
+		for writer_dir in self.writers():
+			if (writer_ids is None) or (os.path.basename(writer_dir)[len('writer_'):] in [str(w) for w in writer_ids]):
+				entries += self.read_index(writer_dir)
+		return entries
+
+	def load(self, entry, mmap_mode=None):
+		return {name: np.load(os.path.join(entry['path'], name + '.npy'), mmap_mode=mmap_mode) for name in entry['names']}
+
+	def read(self, name, writer_ids=None, concatenate=False):
+		# the array `name` of all records, stacked along a new first axis
+		# (or concatenated along the first axis, as the drivers' np.concatenate accumulation did)
+		return self.read_entries([entry for entry in self.records(writer_ids) if name in entry['names']],
+								 name, concatenate)
+
+	def read_entries(self, entries, name, concatenate=False):
+		arrays = [np.load(os.path.join(entry['path'], name + '.npy'), mmap_mode='r') for entry in entries]
+		if concatenate:
+			return np.concatenate(arrays, axis=0)
+		return np.stack(arrays, axis=0)
+
+	def read_meta(self, key, writer_ids=None):
+		return np.array([entry['meta'].get(key) for entry in self.records(writer_ids)])
+
+	def merge(self, filename, writer_ids=None, concatenate=False, names=None):
+		# writes the records into a single .npz: every array name stacked (or concatenated) over the records
+		# and every meta key as an array, in a temporary file renamed into place.
+		# All arrays run over the same records, those that have every one of names
+		# (by default the names that all records have)
+		entries = self.records(writer_ids)
+		if names is None:
+			names = [name for name in (entries[0]['names'] if len(entries) > 0 else [])
+					 if all(name in entry['names'] for entry in entries)]
+		entries = [entry for entry in entries if all(name in entry['names'] for name in names)]
+		merged = {name: self.read_entries(entries, name, concatenate) for name in names}
+		for key in set(key for entry in entries for key in entry['meta']):
+			merged['meta_' + key] = np.array([entry['meta'].get(key) for entry in entries])
+		merged['writer_id'] = np.array([entry['writer_id'] for entry in entries])
+		fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+		with os.fdopen(fd, 'wb') as f:
+			np.savez(f, **merged)
+		os.replace(tmp, filename)
+		return merged
@@ -0,0 +1,68 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+
+class RK4Stepper(object):
+	# Classical 4-th order Runge-Kutta step with preallocated stage buffers.
+	# The right-hand side is a pure function f(t, y, out) writing dy/dt into out.
+	def __init__(self, size, FloatPrecision=np.float64):
+		self.size = size
+		self.FloatPrecision = FloatPrecision
+		self.k1 = np.zeros(size, dtype=self.FloatPrecision)
+		self.k2 = np.zeros(size, dtype=self.FloatPrecision)
+		self.k3 = np.zeros(size, dtype=self.FloatPrecision)
+		self.k4 = np.zeros(size, dtype=self.FloatPrecision)
+		self.y_stage = np.zeros(size, dtype=self.FloatPrecision)
+
+	def step(self, f, t, y, h, out=None):
+		# out may be y itself, then the step is done in place
+		if out is None:
+			out = np.empty_like(y)
+		k1, k2, k3, k4, y_stage = self.k1, self.k2, self.k3, self.k4, self.y_stage
+
+		f(t, y, k1)
+
+		np.multiply(k1, 0.5 * h, out=y_stage)
+		y_stage += y
+		f(t + 0.5 * h, y_stage, k2)
+
+		np.multiply(k2, 0.5 * h, out=y_stage)
+		y_stage += y
+		f(t + 0.5 * h, y_stage, k3)
+
+		np.multiply(k3, h, out=y_stage)
+		y_stage += y
+		f(t + h, y_stage, k4)
+
+		# y + h / 6 * (k1 + 2 k2 + 2 k3 + k4)
+		k2 += k3
+		k2 *= 2.
+		k1 += k2
+		k1 += k4
+		k1 *= h / 6.
+		np.add(y, k1, out=out)
+		return out
@@ -0,0 +1,114 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+from scipy.sparse import csr_matrix
+
+class SparseJacobianXY(object):
+	# Jacobian of the XY equations of motion (HamiltonianXY_fast + RelaxationXY_fast)
+	# in CSR format. The sparsity pattern is built once from the neighbour index arrays,
+	# every call only refreshes the values of the nonzero entries.
+	def __init__(self, N_wells, nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2,
+				 FloatPrecision=np.float64, dimensionality=3):
+		self.N_wells = N_wells
+		self.FloatPrecision = FloatPrecision
+
+		# neighbours along x, y, z; the last two get the anisotropy factor.
+		# dimensionality < 3 drops the bonds along the remaining axes, as the loop versions do
+		self.nn_ids = np.vstack((nn_idx_1, nn_idx_2, nn_idy_1, nn_idy_2, nn_idz_1, nn_idz_2)).astype(np.int64)
+		self.nn_ids = self.nn_ids[:2 * dimensionality]
+		self.nn_is_z = np.array([False, False, False, False, True, True])[:2 * dimensionality]
+		self.z = self.nn_ids.shape[0]
+
+		N = self.N_wells
+		wells = np.arange(N, dtype=np.int64)
+		nn = self.nn_ids.flatten()
+		wells_nn = np.tile(wells, self.z)
+
+		# COO layout, values are filled in the same block order in calc_values():
+		# (X_i, x_i), (X_i, y_i), (Y_i, x_i), (Y_i, y_i),
+		# (X_i, x_j), (X_i, y_j), (Y_i, x_j), (Y_i, y_j) for all neighbours j of i
+		rows = np.hstack((wells, wells, wells + N, wells + N,
+						  wells_nn, wells_nn, wells_nn + N, wells_nn + N))
+		cols = np.hstack((wells, wells + N, wells, wells + N,
+						  nn, nn + N, nn, nn + N))
+
+		# neighbours may coincide with each other or with the well itself
+		# (lattices with 1 or 2 sites along an axis), such entries are summed up
+		keys = rows * (2 * N) + cols
+		unique_keys, self.coo_to_csr = np.unique(keys, return_inverse=True)
+		self.nnz = unique_keys.shape[0]
+		self.indices = (unique_keys % (2 * N)).astype(np.int32)
+		self.indptr = np.zeros(2 * N + 1, dtype=np.int32)
+		self.indptr[1:] = np.cumsum(np.bincount(unique_keys // (2 * N), minlength=2 * N))
+
+		self.coo_values = np.zeros(keys.shape[0], dtype=self.FloatPrecision)
+
+	def calc_local_field(self, x, y, J, anisotropy):
+		weights = J * np.where(self.nn_is_z, anisotropy, 1.)
+		return weights, np.dot(weights, x[self.nn_ids]), np.dot(weights, y[self.nn_ids])
+
+	def calc_values(self, psi, J, anisotropy, beta_flat, e_disorder_flat, h_ext_x=0., h_ext_y=0., gamma=0.,
+					relaxation_factor=1.):
+		N = self.N_wells
+		x = psi[:N]
+		y = psi[N:]
+		g = relaxation_factor * gamma
+		weights, xL, yL = self.calc_local_field(x, y, J, anisotropy)
+		v = self.coo_values
+		zN = self.z * N
+
+		# dXi / dxi
+		v[:N] = - h_ext_y * y + 2. * beta_flat * x * y - g * y * yL
+		# dXi / dyi
+		v[N:2*N] = (e_disorder_flat + 2. * h_ext_x * y - h_ext_y * x + beta_flat * (x ** 2 + 3. * y ** 2) +
+					g * (2. * xL * y - yL * x))
+		# dYi / dxi
+		v[2*N:3*N] = (- e_disorder_flat - h_ext_x * y + 2. * h_ext_y * x - beta_flat * (3. * x ** 2 + y ** 2) -
+					  g * (xL * y - 2. * yL * x))
+		# dYi / dyi
+		v[3*N:4*N] = - h_ext_x * x - 2. * beta_flat * x * y - g * x * xL
+
+		w = weights[:, np.newaxis]
+		# dXi / dxj, dXi / dyj, dYi / dxj, dYi / dyj
+		v[4*N:4*N+zN] = (w * (g * y ** 2)).flatten()
+		v[4*N+zN:4*N+2*zN] = (w * (-1. - g * x * y)).flatten()
+		v[4*N+2*zN:4*N+3*zN] = (w * (1. - g * x * y)).flatten()
+		v[4*N+3*zN:] = (w * (g * x ** 2)).flatten()
+
+		if np.finfo(self.FloatPrecision).eps < np.finfo(np.float64).eps:
+			# bincount accumulates in float64, keep the extended precision
+			data = np.zeros(self.nnz, dtype=self.FloatPrecision)
+			np.add.at(data, self.coo_to_csr, v)
+			return data
+		return np.bincount(self.coo_to_csr, weights=v, minlength=self.nnz).astype(self.FloatPrecision, copy=False)
+
+	def __call__(self, psi, J, anisotropy, beta_flat, e_disorder_flat, h_ext_x=0., h_ext_y=0., gamma=0.,
+				 relaxation_factor=1.):
+		data = self.calc_values(psi, J, anisotropy, beta_flat, e_disorder_flat, h_ext_x, h_ext_y, gamma,
+								relaxation_factor)
+		# the pattern arrays are shared, only data is new on every call
+		return csr_matrix((data, self.indices, self.indptr), shape=(2 * self.N_wells, 2 * self.N_wells), copy=False)
@@ -0,0 +1,110 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import numpy as np
+
+class SplitStepXY(object):
+	# Symplectic Strang splitting of the conservative XY equations of motion:
+	#
+	# on-site part, exact: |psi_i| is conserved and psi_i rotates with the frequency
+	# 	c_i = e_i + beta_i * |psi_i|^2:  x -> x cos(c dt) + y sin(c dt),  y -> -x sin(c dt) + y cos(c dt)
+	# hopping part, linear: dX = -yL + h_dis_y, dY = xL - h_dis_x, integrated by n_substeps
+	# 	Stoermer-Verlet (leapfrog) sub-steps, which are symplectic for this Hamiltonian flow
+	#
+	# step = onsite(dt / 2) hopping(dt) onsite(dt / 2), second order with a bounded energy error.
+	# nn_sum(v, out) writes J * (sum of v over the neighbours) into out.
+	# exact_hopping(psi, dt, h_dis_x_flat, h_dis_y_flat), if given, replaces the leapfrog sub-steps
+	# by an exact hopping propagator acting in place (FFTHoppingXY on the periodic lattice).
+	def __init__(self, N_wells, nn_sum, n_substeps=1, FloatPrecision=np.float64, exact_hopping=None):
+		self.N_wells = N_wells
+		self.nn_sum = nn_sum
+		self.n_substeps = n_substeps
+		self.exact_hopping = exact_hopping
+		self.FloatPrecision = FloatPrecision
+
+		self.c = np.zeros(N_wells, dtype=self.FloatPrecision)
+		self.cos = np.zeros(N_wells, dtype=self.FloatPrecision)
+		self.sin = np.zeros(N_wells, dtype=self.FloatPrecision)
+		self.tmp = np.zeros(N_wells, dtype=self.FloatPrecision)
+		self.field = np.zeros(N_wells, dtype=self.FloatPrecision)
+
+	def onsite(self, psi, dt, beta_flat, e_disorder_flat):
+		N = self.N_wells
+		x = psi[:N]
+		y = psi[N:]
+		c = self.c
+		np.multiply(x, x, out=c)
+		np.multiply(y, y, out=self.tmp)
+		c += self.tmp
+		c *= beta_flat
+		c += e_disorder_flat
+		c *= dt
+		np.cos(c, out=self.cos)
+		np.sin(c, out=self.sin)
+		# tmp keeps the old x
+		self.tmp[:] = x
+		x *= self.cos
+		np.multiply(y, self.sin, out=c)
+		x += c
+		y *= self.cos
+		np.multiply(self.tmp, self.sin, out=c)
+		y -= c
+		return psi
+
+	def hopping(self, psi, dt, h_dis_x_flat, h_dis_y_flat):
+		if self.exact_hopping is not None:
+			return self.exact_hopping(psi, dt, h_dis_x_flat, h_dis_y_flat)
+		N = self.N_wells
+		x = psi[:N]
+		y = psi[N:]
+		h = dt / self.n_substeps
+		field = self.field
+		for i in range(self.n_substeps):
+			# x += h/2 * (-yL + h_dis_y);  y += h * (xL - h_dis_x);  x += h/2 * (-yL + h_dis_y)
+			self.nn_sum(y, field)
+			field -= h_dis_y_flat
+			field *= 0.5 * h
+			x -= field
+			self.nn_sum(x, field)
+			field -= h_dis_x_flat
+			field *= h
+			y += field
+			self.nn_sum(y, field)
+			field -= h_dis_y_flat
+			field *= 0.5 * h
+			x -= field
+		return psi
+
+	def step(self, psi, dt, beta_flat, e_disorder_flat, h_dis_x_flat, h_dis_y_flat, out=None):
+		# out may be psi itself, then the step is done in place
+		if out is None:
+			out = psi.copy()
+		elif out is not psi:
+			out[:] = psi
+		self.onsite(out, 0.5 * dt, beta_flat, e_disorder_flat)
+		self.hopping(out, dt, h_dis_x_flat, h_dis_y_flat)
+		self.onsite(out, 0.5 * dt, beta_flat, e_disorder_flat)
+		return out
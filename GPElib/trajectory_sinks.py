@@ -0,0 +1,243 @@
+'''
+Copyright <2019> <Andrei E. Tarkhov, Skolkovo Institute of Science and Technology, https://github.com/TarkhovAndrei/DGPE>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following 2 conditions:
+
+1) If any part of the present source code is used for any purposes with subsequent publication of obtained results,
+the GitHub repository shall be cited in all publications, according to the citation rule:
+	"Andrei E. Tarkhov, Skolkovo Institute of Science and Technology,
+	 source code from the GitHub repository https://github.com/TarkhovAndrei/DGPE, 2019."
+
+2) The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import os
+from abc import ABC, abstractmethod
+import numpy as np
+
+class TrajectorySink(ABC):
+	# Receives snapshots psi = (X, Y) of a running trajectory from DynamicsGenerator
+	# in the streaming output mode (trajectory_sink=...), instead of the full-history X/Y/RHO/THETA arrays.
+	# Subclasses implement push and read; seek(n) rewinds the sink to its first n snapshots when a run is
+	# resumed from a checkpoint (DynamicsGenerator stores n_pushed with every checkpoint).
+	def __init__(self):
+		self.N_tuple = None
+		self.N_wells = 0
+		self.FloatPrecision = np.float64
+		self.n_pushed = 0
+
+	def open(self, N_tuple, FloatPrecision=np.float64):
+		self.N_tuple = N_tuple
+		self.N_wells = int(np.prod(N_tuple))
+		self.FloatPrecision = FloatPrecision
+
+	@abstractmethod
+	def push(self, i, t, psi):
+		pass
+
+	def push_block(self, steps, ts, PSI):
+		# PSI[time, 2*N_wells]
+		for i, t, psi in zip(steps, ts, PSI):
+			self.push(i, t, psi)
+
+	@abstractmethod
+	def read(self):
+		# returns steps, times and PSI[time, 2*N_wells] in chronological order
+		pass
+
+	def seek(self, n):
+		raise NotImplementedError(type(self).__name__ + ' cannot be resumed from a checkpoint')
+
+	def close(self):
+		pass
+
+	def get_XY(self):
+		steps, ts, PSI = self.read()
+		X = np.moveaxis(PSI[:, :self.N_wells], 0, -1).reshape(self.N_tuple + (PSI.shape[0],))
+		Y = np.moveaxis(PSI[:, self.N_wells:], 0, -1).reshape(self.N_tuple + (PSI.shape[0],))
+		return X, Y
+
+	def get_polar(self):
+		# RHO and THETA are derived from the stored X, Y only on request
+		X, Y = self.get_XY()
+		return np.sqrt(X ** 2 + Y ** 2), np.arctan2(Y, X)
+
+class RingBufferSink(TrajectorySink):
+	# keeps the last `capacity` snapshots in memory; snapshots n_first, ... are the ones still held after a seek
+	def __init__(self, capacity=100):
+		TrajectorySink.__init__(self)
+		self.capacity = capacity
+		self.n_first = 0
+
+	def open(self, N_tuple, FloatPrecision=np.float64):
+		TrajectorySink.open(self, N_tuple, FloatPrecision)
+		self.PSI = np.zeros((self.capacity, 2 * self.N_wells), dtype=self.FloatPrecision)
+		self.steps = np.zeros(self.capacity, dtype=np.int64)
+		self.ts = np.zeros(self.capacity, dtype=np.float64)
+		self.n_pushed = 0
+		self.n_first = 0
+
+	def push(self, i, t, psi):
+		pos = self.n_pushed % self.capacity
+		self.PSI[pos] = psi
+		self.steps[pos] = i
+		self.ts[pos] = t
+		self.n_pushed += 1
+
+	def read(self):
+		idx = np.arange(max(self.n_first, self.n_pushed - self.capacity), self.n_pushed) % self.capacity
+		return self.steps[idx], self.ts[idx], self.PSI[idx]
+
+	def seek(self, n):
+		# the snapshots before n that were overwritten by the pushes after n (or never held, e.g. in a new
+		# process) are lost
+		if n > self.n_pushed:
+			self.n_first = n
+		else:
+			self.n_first = max(self.n_first, self.n_pushed - self.capacity)
+		self.n_pushed = n
+
+class MemmapSink(TrajectorySink):
+	# writes the snapshots into a memory-mapped .npy file of shape (max_snapshots, 2*N_wells);
+	# steps and times are stored next to it in <filename>_steps.npy and <filename>_times.npy.
+	# open reuses existing files of the same shape and dtype (without clearing them), so that seek can
+	# resume the run of a previous process
+	def __init__(self, filename, max_snapshots):
+		TrajectorySink.__init__(self)
+		self.filename = filename
+		self.max_snapshots = max_snapshots
+
+	def open(self, N_tuple, FloatPrecision=np.float64):
+		TrajectorySink.open(self, N_tuple, FloatPrecision)
+		self.PSI = self.open_memmap(self.filename, self.FloatPrecision, (self.max_snapshots, 2 * self.N_wells))
+		prefix = self.filename[:-4] if self.filename.endswith('.npy') else self.filename
+		self.steps = self.open_memmap(prefix + '_steps.npy', np.int64, (self.max_snapshots,))
+		self.ts = self.open_memmap(prefix + '_times.npy', np.float64, (self.max_snapshots,))
+		self.n_pushed = 0
+
+	def open_memmap(self, filename, dtype, shape):
+		if os.path.exists(filename):
+			array = np.load(filename, mmap_mode='r+')
+			if (array.shape == shape) and (array.dtype == dtype):
+				return array
+			del array
+		return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+
+	def push(self, i, t, psi):
+		if self.n_pushed >= self.max_snapshots:
+			raise IndexError('MemmapSink is full: ' + str(self.max_snapshots) + ' snapshots')
+		self.PSI[self.n_pushed] = psi
+		self.steps[self.n_pushed] = i
+		self.ts[self.n_pushed] = t
+		self.n_pushed += 1
+
+	def push_block(self, steps, ts, PSI):
+		n = PSI.shape[0]
+		if self.n_pushed + n > self.max_snapshots:
+			raise IndexError('MemmapSink is full: ' + str(self.max_snapshots) + ' snapshots')
+		self.PSI[self.n_pushed:self.n_pushed + n] = PSI
+		self.steps[self.n_pushed:self.n_pushed + n] = steps
+		self.ts[self.n_pushed:self.n_pushed + n] = ts
+		self.n_pushed += n
+
+	def read(self):
+		return self.steps[:self.n_pushed], self.ts[:self.n_pushed], self.PSI[:self.n_pushed]
+
+	def seek(self, n):
+		# the rows from n on are overwritten by the next pushes
+		if n > self.max_snapshots:
+			raise IndexError('MemmapSink is full: ' + str(self.max_snapshots) + ' snapshots')
+		self.n_pushed = n
+
+	def close(self):
+		self.PSI.flush()
+		self.steps.flush()
+		self.ts.flush()
+
+class HDF5Sink(TrajectorySink):
+	# appends the snapshots to a chunked, resizable HDF5 dataset (requires h5py).
+	# open reuses an existing group of the same shape and dtype: the datasets are cut to the pushed snapshots
+	# on the next push and on close, so that seek(n) can resume the run of a previous process from its first
+	# n snapshots
+	def __init__(self, filename, chunk_size=64, group='trajectory'):
+		TrajectorySink.__init__(self)
+		self.filename = filename
+		self.chunk_size = chunk_size
+		self.group = group
+		# the open file while writing; read() of a sink that is not open reads filename from disk
+		self.file = None
+
+	def open(self, N_tuple, FloatPrecision=np.float64):
+		import h5py
+		TrajectorySink.open(self, N_tuple, FloatPrecision)
+		self.file = h5py.File(self.filename, 'a')
+		if self.group in self.file:
+			grp = self.file[self.group]
+			if ('psi' in grp) and (grp['psi'].shape[1] == 2 * self.N_wells) and (grp['psi'].dtype == self.FloatPrecision):
+				self.PSI = grp['psi']
+				self.steps = grp['steps']
+				self.ts = grp['times']
+				grp.attrs['N_tuple'] = self.N_tuple
+				self.n_pushed = 0
+				return
+			del self.file[self.group]
+		grp = self.file.create_group(self.group)
+		grp.attrs['N_tuple'] = self.N_tuple
+		self.PSI = grp.create_dataset('psi', shape=(0, 2 * self.N_wells), maxshape=(None, 2 * self.N_wells),
+									  chunks=(self.chunk_size, 2 * self.N_wells), dtype=self.FloatPrecision)
+		self.steps = grp.create_dataset('steps', shape=(0,), maxshape=(None,), chunks=(self.chunk_size,),
+										dtype=np.int64)
+		self.ts = grp.create_dataset('times', shape=(0,), maxshape=(None,), chunks=(self.chunk_size,),
+									 dtype=np.float64)
+		self.n_pushed = 0
+
+	def push(self, i, t, psi):
+		self.push_block(np.array([i]), np.array([t]), psi.reshape(1, -1))
+
+	def push_block(self, steps, ts, PSI):
+		n = PSI.shape[0]
+		for dset in [self.PSI, self.steps, self.ts]:
+			dset.resize(self.n_pushed + n, axis=0)
+		self.PSI[self.n_pushed:self.n_pushed + n] = PSI
+		self.steps[self.n_pushed:self.n_pushed + n] = steps
+		self.ts[self.n_pushed:self.n_pushed + n] = ts
+		self.n_pushed += n
+
+	def seek(self, n):
+		if n > self.PSI.shape[0]:
+			raise IndexError('HDF5Sink holds ' + str(self.PSI.shape[0]) + ' snapshots, cannot seek to ' + str(n))
+		for dset in [self.PSI, self.steps, self.ts]:
+			dset.resize(n, axis=0)
+		self.n_pushed = n
+
+	def read(self):
+		if self.file is not None:
+			return self.steps[:self.n_pushed], self.ts[:self.n_pushed], self.PSI[:self.n_pushed]
+		import h5py
+		with h5py.File(self.filename, 'r') as f:
+			grp = f[self.group]
+			if self.N_tuple is None:
+				self.N_tuple = tuple(int(n) for n in grp.attrs['N_tuple'])
+				self.N_wells = int(np.prod(self.N_tuple))
+			return grp['steps'][:], grp['times'][:], grp['psi'][:]
+
+	def close(self):
+		if self.file is not None:
+			# drops what is left of a reused group beyond the pushed snapshots
+			for dset in [self.PSI, self.steps, self.ts]:
+				dset.resize(self.n_pushed, axis=0)
+			self.file.close()
+			self.file = None
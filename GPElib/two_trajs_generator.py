@@ -27,40 +27,84 @@ SOFTWARE.
 import numpy as np
 import matplotlib.pyplot as plt
 from .dynamics_generator import DynamicsGenerator
+from .polar_view import LazyPolarXY
 
 class TwoTrajsGenerator(DynamicsGenerator):
 	def __init__(self, **kwargs):
 		DynamicsGenerator.__init__(self, **kwargs)
-		self.RHO1 = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
-		self.THETA1 = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
 		self.X1 = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
 		self.Y1 = np.zeros(self.N_tuple + (self.n_steps_savings,), dtype=self.FloatPrecision)
-		self.energy1 = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.participation_rate1 = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.angular_momentum1 = np.zeros(self.n_steps, dtype=self.FloatPrecision)
-		self.effective_nonlinearity1 = np.zeros(self.n_steps, dtype=self.FloatPrecision)
+		self.polar_view1 = LazyPolarXY()
+		self.psiNextXY1 = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
+		self.psiNext1 = np.zeros(2 * self.N_wells, dtype=self.FloatPrecision)
+		self.energy1 = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.participation_rate1 = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.angular_momentum1 = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
+		self.effective_nonlinearity1 = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
 		self.histograms1 = {}
 		self.rho_histograms1 = {}
 
-		self.number_of_particles1 = np.zeros(self.n_steps, dtype=self.FloatPrecision)
+		self.number_of_particles1 = np.zeros(self.n_steps, dtype=self.ReductionPrecision)
 		self.lambdas = []
 		self.lambdas_no_regr = []
 
 	def calc_traj_shift_matrix_cartesian_XY(self, X, Y, X1, Y1):
 		return np.sqrt(np.sum((X - X1) ** 2 + (Y - Y1) ** 2, axis=(0,1,2)))
 
+	@property
+	def polar1(self):
+		return self.polar_view1.attach(self.X1, self.Y1)
+
+	def invalidate(self, slot=None):
+		DynamicsGenerator.invalidate(self, slot)
+		self.polar1.invalidate(slot)
+
+	@property
+	def RHO1(self):
+		return self.polar1.rho()
+
+	@RHO1.setter
+	def RHO1(self, value):
+		self.polar1.set_rho(value)
+
+	@property
+	def THETA1(self):
+		return self.polar1.theta()
+
+	@THETA1.setter
+	def THETA1(self, value):
+		self.polar1.set_theta(value)
+
+	def load_XY1(self, slot, out):
+		np.copyto(out[:self.N_wells].reshape(self.N_tuple), self.X1[:,:,:,slot])
+		np.copyto(out[self.N_wells:].reshape(self.N_tuple), self.Y1[:,:,:,slot])
+		return out
+
+	def load_polar1(self, slot, out):
+		rho, theta = self.polar1.slot(slot)
+		np.copyto(out[:self.N_wells].reshape(self.N_tuple), rho)
+		np.copyto(out[self.N_wells:].reshape(self.N_tuple), theta)
+		return out
+
 	def set_init_XY(self, x, y, x1, y1):
 		DynamicsGenerator.set_init_XY(self, x,y)
 		self.X1[:,:,:,0] = x1.reshape(self.N_tuple)
 		self.Y1[:,:,:,0] = y1.reshape(self.N_tuple)
-		self.RHO1[:,:,:,0], self.THETA1[:,:,:,0] = self.from_XY_to_polar(self.X1[:,:,:,0], self.Y1[:,:,:,0])
+		self.polar1.invalidate(0)
 
 	def set_constants_of_motion_local(self, i, inext):
 		DynamicsGenerator.set_constants_of_motion_local(self, i, inext)
-		self.energy1[i], self.number_of_particles1[i], self.angular_momentum1[i] = self.calc_constants_of_motion_local(self.RHO1[:,:,:,inext], self.THETA1[:,:,:,inext],
-																										self.X1[:,:,:,inext], self.Y1[:,:,:,inext])
-		self.participation_rate1[i] = np.sum(self.RHO1[:,:,:,inext] ** 4, axis=(0,1,2)) / (1e-8 + np.sum(self.RHO1[:,:,:,inext] ** 2, axis=(0,1,2)) ** 2)
-		self.effective_nonlinearity1[i] = self.beta * self.participation_rate1[i] / self.N_wells
+		if self.hold_constants_of_motion_local(i):
+			self.energy1[i] = self.energy1[i - 1]
+			self.number_of_particles1[i] = self.number_of_particles1[i - 1]
+			self.angular_momentum1[i] = self.angular_momentum1[i - 1]
+			self.participation_rate1[i] = self.participation_rate1[i - 1]
+			self.effective_nonlinearity1[i] = self.effective_nonlinearity1[i - 1]
+			return
+		self.energy1[i], self.number_of_particles1[i], self.angular_momentum1[i], sum_rho4 = self.local_observables.compute(
+			self.X1[:,:,:,inext], self.Y1[:,:,:,inext], self.J, self.anisotropy, self.beta_flat, self.e_disorder_flat)
+		self.participation_rate1[i] = sum_rho4 / (1e-8 + self.number_of_particles1[i] ** 2)
+		self.effective_nonlinearity1[i] = self.beta_amplitude * self.participation_rate1[i] / self.N_wells
 		# for iwell in self.wells_indices:
 		# 	self.histograms1[iwell] = np.histogram2d(np.float64(self.X1[iwell]), np.float64(self.Y1[iwell]), bins=100)
 		# 	self.rho_histograms1[iwell] = np.histogram(np.float64(self.RHO1[iwell] ** 2), bins=100)
@@ -0,0 +1,38 @@
+# AdaptiveRKStepper in single and double precision against the exact rotation y' = (y_2, -y_1)
+import numpy as np
+import pytest
+
+from GPElib.adaptive_stepper import AdaptiveRKStepper
+from GPElib.dynamics_generator import DynamicsGenerator
+
+
+def rotation(t, y, out):
+	out[0::2] = y[1::2]
+	out[1::2] = -y[0::2]
+	return out
+
+
+@pytest.mark.parametrize('method', ['RK45', 'DOP853'])
+@pytest.mark.parametrize('FloatPrecision, tol', [(np.float64, 1e-8), (np.float32, 1e-4)])
+def test_rotation(method, FloatPrecision, tol):
+	y0 = np.array([1., 0., 0.5, -0.5], dtype=FloatPrecision)
+	stepper = AdaptiveRKStepper(4, method=method, rtol=tol, atol=tol, FloatPrecision=FloatPrecision)
+	stepper.reset(rotation, 0., y0)
+	out = np.empty_like(y0)
+	for t in [0.3, 1., 2.5]:
+		stepper.advance_to(t, out)
+		assert out.dtype == FloatPrecision
+		exact = np.array([np.cos(t), -np.sin(t), 0.5 * np.cos(t) - 0.5 * np.sin(t), -0.5 * np.sin(t) - 0.5 * np.cos(t)])
+		np.testing.assert_allclose(out, exact, rtol=0, atol=100 * tol)
+
+
+@pytest.mark.parametrize('method', ['RK45', 'DOP853'])
+def test_generator_float32(method):
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, time=0.1, step=0.01, N_part_per_well=1.,
+						  FloatPrecision=np.float32, adaptive_method=method, rtol=1e-5, atol=1e-5,
+						  use_matrix_operations_for_energy=False)
+	g.set_init_XY(np.ones(g.N_tuple), np.zeros(g.N_tuple))
+	g.run_dynamics()
+	assert g.X.dtype == np.float32
+	assert np.all(np.isfinite(g.energy))
+	assert np.abs(g.energy[-1] - g.energy[0]) < 1e-3 * np.abs(g.energy[0])
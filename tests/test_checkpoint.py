@@ -0,0 +1,88 @@
+# CheckpointStore writes atomically and run_dynamics(resume=True) rewinds the trajectory_sink
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from GPElib.checkpoint import CheckpointStore
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib.trajectory_sinks import MemmapSink, HDF5Sink
+
+N_STEPS = 30
+
+
+def test_save_removes_temporary_file_on_interrupt(tmp_path, monkeypatch):
+	store = CheckpointStore(str(tmp_path))
+
+	def interrupted(*args, **kwargs):
+		raise KeyboardInterrupt()
+
+	monkeypatch.setattr(np, 'savez', interrupted)
+	with pytest.raises(KeyboardInterrupt):
+		store.save(1, {'a': np.zeros(3)})
+	assert os.listdir(str(tmp_path)) == []
+
+
+def run(sink, checkpoint_store=None, resume=False):
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, step=0.01, n_steps=N_STEPS, time=N_STEPS * 0.01,
+						  N_part_per_well=1., use_matrix_operations_for_energy=False, trajectory_sink=sink,
+						  checkpoint_store=checkpoint_store)
+	rng = np.random.RandomState(1)
+	g.set_init_XY(rng.randn(*g.N_tuple) + 1., rng.randn(*g.N_tuple))
+	g.run_dynamics(resume=resume)
+	sink.close()
+	return sink.read()
+
+
+@pytest.mark.parametrize('kind', ['memmap', 'hdf5'])
+def test_resume_rewinds_sink(tmp_path, kind):
+	if kind == 'hdf5':
+		pytest.importorskip('h5py')
+		make_sink = lambda name: HDF5Sink(str(tmp_path / (name + '.h5')))
+	else:
+		make_sink = lambda name: MemmapSink(str(tmp_path / (name + '.npy')), max_snapshots=N_STEPS)
+	steps, ts, PSI = run(make_sink('reference'))
+
+	# the interrupted run got to the end, but its last checkpoint is at step 20
+	directory = str(tmp_path / 'checkpoints')
+	run(make_sink('resumed'), CheckpointStore(directory, every_steps=10))
+	assert len(glob.glob(os.path.join(directory, 'checkpoint_*.npz'))) == 2
+	steps_resumed, ts_resumed, PSI_resumed = run(make_sink('resumed'), CheckpointStore(directory, every_steps=10),
+												 resume=True)
+	np.testing.assert_array_equal(steps_resumed, steps)
+	np.testing.assert_array_equal(PSI_resumed, PSI)
+
+
+def run_full(checkpoint_store=None, resume=False):
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, step=0.01, n_steps=N_STEPS, time=N_STEPS * 0.01,
+						  N_part_per_well=1., use_matrix_operations_for_energy=False, calculation_type='dyn',
+						  checkpoint_store=checkpoint_store)
+	rng = np.random.RandomState(1)
+	g.set_init_XY(rng.randn(*g.N_tuple) + 1., rng.randn(*g.N_tuple))
+	g.run_dynamics(resume=resume)
+	return g
+
+
+def test_checkpoints_hold_the_steps_since_the_previous_one(tmp_path):
+	directory = str(tmp_path / 'checkpoints')
+	g = run_full()
+	run_full(CheckpointStore(directory, every_steps=10))
+	store = CheckpointStore(directory)
+	states = [store.load(path) for path in store.list()]
+	assert [(int(s['first_step']), int(s['step_index'])) for s in states] == [(0, 11), (11, 21)]
+	for s in states:
+		assert 'X' not in s and 'RHO' not in s and 'THETA' not in s
+		assert s['X_block'].shape[-1] == s['energy_block'].shape[0] == s['step_index'] - s['first_step']
+
+	resumed = run_full(CheckpointStore(directory, every_steps=10), resume=True)
+	np.testing.assert_array_equal(resumed.X, g.X)
+	np.testing.assert_array_equal(resumed.Y, g.Y)
+	np.testing.assert_array_equal(resumed.energy, g.energy)
+
+
+def test_resume_needs_the_whole_history(tmp_path):
+	directory = str(tmp_path / 'checkpoints')
+	run_full(CheckpointStore(directory, every_steps=10, keep_last=1))
+	with pytest.raises(ValueError, match='keep_last'):
+		run_full(CheckpointStore(directory, every_steps=10), resume=True)
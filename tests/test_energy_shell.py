@@ -0,0 +1,69 @@
+# run_energy_shell reports whether the relaxation reached the target shell and checks its step budget
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib.trajectory_sinks import RingBufferSink
+
+
+def make_generator():
+	return DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, gamma=0.1, step=0.01, n_steps=40, time=0.4,
+							 N_part_per_well=1., use_matrix_operations_for_energy=False, calculation_type='dyn')
+
+
+def initial_state(g):
+	rng = np.random.RandomState(1)
+	return rng.randn(*g.N_tuple) + 1., rng.randn(*g.N_tuple)
+
+
+def test_target_reached():
+	g = make_generator()
+	x0, y0 = initial_state(g)
+	E0 = g.calc_energy_XY(x0, y0, 0)
+	point = g.run_energy_shell(x0, y0, E0 - 0.5, relaxation_N_max=40, n_steps=20, N_samples=50, seed=1)
+	assert point['reached']
+	assert point['E_relaxed'] <= E0 - 0.5
+
+
+def test_target_not_reached_warns():
+	g = make_generator()
+	x0, y0 = initial_state(g)
+	E0 = g.calc_energy_XY(x0, y0, 0)
+	with pytest.warns(UserWarning, match='not reached'):
+		table = g.run_energy_sweep([E0 - 0.5, E0 - 50.], x0, y0, relaxation_N_max=10, n_steps=20, N_samples=50,
+								   seed=1, n_proc=1)
+	np.testing.assert_array_equal(table['reached'], [True, False])
+	assert table['relaxation_steps'][1] == 10
+
+
+@pytest.mark.parametrize('relaxation_N_max, n_steps', [(41, 20), (10, 41)])
+def test_step_budget(relaxation_N_max, n_steps):
+	g = make_generator()
+	x0, y0 = initial_state(g)
+	with pytest.raises(ValueError):
+		g.run_energy_shell(x0, y0, 0., relaxation_N_max=relaxation_N_max, n_steps=n_steps)
+
+
+@pytest.mark.parametrize('sweep_kwargs', [dict(warm_start=True), dict(n_proc=2)])
+def test_sweep_on_matrix_energy_path(sweep_kwargs):
+	# run_relaxation / run_dynamics replace the observables by arrays as long as the run on this path
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, gamma=0.1, step=0.01, n_steps=40, time=0.4,
+						  N_part_per_well=1., integrator='scipy', calculation_type='dyn')
+	x0, y0 = initial_state(g)
+	E0 = g.calc_energy_XY_global(np.hstack((x0.ravel(), y0.ravel())).reshape(1, -1))[0]
+	X = g.X.copy()
+	energies = [E0 - 0.5, E0 - 1., E0 - 1.5, E0 - 2.]
+	table = g.run_energy_sweep(energies, x0, y0, relaxation_N_max=40, n_steps=20, N_samples=50, seed=1,
+							   **sweep_kwargs)
+	assert np.all(table['reached'])
+	np.testing.assert_allclose(table['E_relaxed'], energies, rtol=1e-10)
+	assert g.gamma == 0.1
+	np.testing.assert_array_equal(g.X, X)
+
+
+def test_sweep_rejects_trajectory_sink():
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, gamma=0.1, step=0.01, n_steps=40, time=0.4,
+						  N_part_per_well=1., use_matrix_operations_for_energy=False, trajectory_sink=RingBufferSink(4))
+	x0, y0 = initial_state(g)
+	with pytest.raises(ValueError):
+		g.run_energy_sweep([0.], x0, y0, relaxation_N_max=10, n_steps=20, n_proc=1)
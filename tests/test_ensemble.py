@@ -0,0 +1,53 @@
+# run_ensemble against stepping every member through the single-trajectory right-hand side
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib.rk4_stepper import RK4Stepper
+
+N_STEPS = 10
+
+
+def make_generator(N_tuple, **kwargs):
+	params = dict(N_wells=N_tuple, W=0.5, J=1.0, anisotropy=0.7, beta=0.1, gamma=0.3, time=0.1, step=0.01,
+				  h_ext_x=0.5, h_ext_y=-0.2, local_disorder_amplitude=0.3, disorder_seed=5,
+				  gamma_slow=0.1, gamma_fast=1.)
+	params.update(kwargs)
+	return DynamicsGenerator(**params)
+
+
+def single_trajectories(g, PSI0, relaxation):
+	rhs = g.full_XY_out if relaxation else g.conservative_XY_out
+	stepper = RK4Stepper(PSI0.shape[1])
+	PSI = PSI0.copy()
+	for psi in PSI:
+		for i in range(1, N_STEPS):
+			stepper.step(rhs, (i - 1) * g.step, psi, g.step, out=psi)
+	return PSI
+
+
+@pytest.mark.parametrize('N_tuple', [(4, 5, 1), (3, 4, 5)])
+@pytest.mark.parametrize('use_matrix_operations', [True, False])
+@pytest.mark.parametrize('relaxation, tempered', [(False, False), (True, False), (True, True)])
+def test_ensemble_matches_single_trajectories(N_tuple, use_matrix_operations, relaxation, tempered):
+	g = make_generator(N_tuple, use_matrix_operations=use_matrix_operations, tempered=tempered)
+	PSI0 = np.random.RandomState(1).randn(3, 2 * g.N_wells)
+	reference = single_trajectories(g, PSI0, relaxation)
+
+	PSI = g.run_ensemble(PSI0, n_steps=N_STEPS, relaxation=relaxation)
+	np.testing.assert_allclose(PSI, reference, rtol=0, atol=1e-12)
+
+	# torchdiffeq's rk4 is the 3/8-rule variant, so it agrees only to the truncation error
+	PSI = g.run_ensemble(PSI0, n_steps=N_STEPS, relaxation=relaxation, backend='torch')
+	np.testing.assert_allclose(PSI, reference, rtol=0, atol=1e-5)
+
+
+def test_float32_ensemble_reduces_in_float64():
+	g = make_generator((4, 5, 1), FloatPrecision=np.float32)
+	PSI0 = np.random.RandomState(1).randn(3, 2 * g.N_wells).astype(np.float32)
+	PSI = g.run_ensemble(PSI0, n_steps=N_STEPS)
+	assert PSI.dtype == np.float32
+	for observable in [g.ensemble_energy, g.ensemble_number_of_particles, g.ensemble_participation_rate]:
+		assert observable.dtype == np.float64
+	np.testing.assert_allclose(g.ensemble_energy[-1], g.calc_energy_XY_global(PSI), rtol=1e-14)
+	np.testing.assert_allclose(g.ensemble_number_of_particles[-1], g.calc_nop_XY_global(PSI), rtol=1e-14)
@@ -0,0 +1,29 @@
+# fft_hopping is only accepted on the lattices where the FFT propagator is the exact hopping flow
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+
+def make_generator(**kwargs):
+	params = dict(N_wells=(4, 5, 1), W=0.5, beta=0.1, time=0.1, step=0.01, fft_hopping=True, split_step=True)
+	params.update(kwargs)
+	return DynamicsGenerator(**params)
+
+
+@pytest.mark.parametrize('kwargs', [dict(anisotropy=0.7), dict(J=np.ones(20)), dict(use_matrix_operations=False)])
+def test_fft_hopping_rejects(kwargs):
+	with pytest.raises(ValueError):
+		make_generator(**kwargs)
+
+
+def test_fft_hopping_matches_nn_sum():
+	g = make_generator()
+	psi = np.random.RandomState(1).randn(2 * g.N_wells)
+	zero = np.zeros(g.N_wells)
+	dt = 1e-4
+	exact = g.fft_hopping_XY(psi.copy(), dt, zero, zero)
+	x, y = psi[:g.N_wells], psi[g.N_wells:]
+	# first order of dX = -J S y, dY = J S x
+	first_order = psi + dt * np.hstack((-g.nn_sum_XY(y), g.nn_sum_XY(x)))
+	np.testing.assert_allclose(exact, first_order, rtol=0, atol=1e-6)
@@ -0,0 +1,33 @@
+# jvp and vjp against central differences of the right-hand side they linearise
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+
+def make_generator(N_tuple, **kwargs):
+	params = dict(N_wells=N_tuple, W=0.5, J=1.0, anisotropy=0.7, beta=0.1, gamma=0.3, time=0.1, step=0.01,
+				  h_ext_x=0.2, h_ext_y=-0.1, local_disorder_amplitude=0.3, disorder_seed=5)
+	params.update(kwargs)
+	return DynamicsGenerator(**params)
+
+
+def fd_jacobian(g, psi, conservative, h=1e-6):
+	rhs = lambda p: g.HamiltonianWithRelaxationXY_fused(p, np.empty_like(p), conservative=conservative)
+	return np.array([(rhs(psi + h * e) - rhs(psi - h * e)) / (2. * h) for e in np.eye(psi.shape[0])]).T
+
+
+@pytest.mark.parametrize('N_tuple', [(7, 1, 1), (4, 5, 1), (3, 4, 2)])
+@pytest.mark.parametrize('use_matrix_operations', [True, False])
+@pytest.mark.parametrize('conservative, tempered', [(True, False), (False, False), (False, True)])
+def test_jvp_vjp(N_tuple, use_matrix_operations, conservative, tempered):
+	g = make_generator(N_tuple, use_matrix_operations=use_matrix_operations, tempered=tempered)
+	rng = np.random.RandomState(1)
+	psi = rng.randn(2 * g.N_wells)
+	V = rng.randn(3, 2 * g.N_wells)
+	jac = fd_jacobian(g, psi, conservative)
+	atol = 1e-7 * np.max(np.abs(jac))
+
+	np.testing.assert_allclose(g.jvp(psi, V, conservative=conservative), V.dot(jac.T), rtol=0, atol=atol)
+	np.testing.assert_allclose(g.vjp(psi, V, conservative=conservative), V.dot(jac), rtol=0, atol=atol)
+	np.testing.assert_allclose(g.vjp(psi, V[0], conservative=conservative), V[0].dot(jac), rtol=0, atol=atol)
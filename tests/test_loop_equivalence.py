@@ -0,0 +1,148 @@
+# The vectorized, fused and sparse kernels against the loop versions they replace
+# (use_matrix_operations=False) on small 1D, 2D and 3D lattices.
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+LATTICES = [(7, 1, 1), (4, 5, 1), (3, 4, 5)]
+RTOL = 1e-12
+
+
+def make_generator(N_tuple, **kwargs):
+	params = dict(N_wells=N_tuple, W=0.5, J=1.0, anisotropy=0.7, beta=0.1, gamma=0.3, time=0.1, step=0.01,
+				  use_matrix_operations=False, disorder_seed=5)
+	params.update(kwargs)
+	return DynamicsGenerator(**params)
+
+
+def random_XY(g, seed=0):
+	return np.random.RandomState(seed).randn(2 * g.N_wells)
+
+
+def random_polar(g, seed=0):
+	rng = np.random.RandomState(seed)
+	return np.hstack((0.5 + rng.rand(g.N_wells), 2. * np.pi * rng.rand(g.N_wells)))
+
+
+def loop_XY(g, psi):
+	g.psi = psi.copy()
+	dH = g.HamiltonianXY_fast()
+	g.psi = psi.copy()
+	return dH, g.RelaxationXY_fast()
+
+
+def assert_close(a, b, rtol=RTOL):
+	np.testing.assert_allclose(a, b, rtol=rtol, atol=rtol * np.max(np.abs(b)))
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+@pytest.mark.parametrize('tempered', [False, True])
+def test_polar_rhs_vectorized(N_tuple, tempered):
+	results = []
+	for use_matrix_operations in [False, True]:
+		g = make_generator(N_tuple, tempered=tempered, use_matrix_operations=use_matrix_operations)
+		psi = random_polar(g)
+		g.psi = psi.copy()
+		dH = g.Hamiltonian_fast()
+		g.psi = psi.copy()
+		results.append((dH, g.Relaxation_fast()))
+	for vectorized, loop in zip(results[1], results[0]):
+		assert_close(vectorized, loop)
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+@pytest.mark.parametrize('tempered', [False, True])
+def test_polar_rhs(N_tuple, tempered):
+	g = make_generator(N_tuple, tempered=tempered)
+	psi = random_polar(g)
+	g.psi = psi.copy()
+	dH = g.Hamiltonian_fast()
+	g.psi = psi.copy()
+	dR = g.Relaxation_fast()
+	gamma = g.gamma_tempered if tempered else g.gamma
+	out = np.zeros_like(psi)
+	assert_close(g.HamiltonianWithRelaxationPolar(psi, out).copy(), dH)
+	assert_close(g.HamiltonianWithRelaxationPolar(psi, out, gamma=gamma, hamiltonian=False).copy(), dR)
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+@pytest.mark.parametrize('backend', ['gather', 'roll', 'numba'])
+def test_fused_XY_rhs(N_tuple, backend):
+	g = make_generator(N_tuple, rhs_backend=backend, h_ext_x=0.2, h_ext_y=-0.1, local_disorder_amplitude=0.3)
+	psi = random_XY(g)
+	dH, dR = loop_XY(g, psi)
+	out = np.zeros_like(psi)
+	assert_close(g.HamiltonianWithRelaxationXY_fused(psi, out, conservative=True).copy(), dH)
+	assert_close(g.HamiltonianWithRelaxationXY_fused(psi, out).copy(), dH + dR)
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+@pytest.mark.parametrize('backend', ['gather', 'roll', 'numba'])
+def test_XY_out_rhs(N_tuple, backend):
+	g = make_generator(N_tuple, rhs_backend=backend, h_ext_x=0.2, h_ext_y=-0.1, local_disorder_amplitude=0.3)
+	psi = random_XY(g)
+	dH, dR = loop_XY(g, psi)
+	out = np.zeros_like(psi)
+	assert_close(g.conservative_XY_out(0., psi, out).copy(), dH)
+	assert_close(g.relaxation_XY_out(0., psi, out).copy(), dR)
+	assert_close(g.full_XY_out(0., psi, out).copy(), dH + dR)
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+def test_sparse_jacobian_conservative(N_tuple):
+	# the loop Jacobians leave out the on-site disorder, so they are compared on the clean lattice
+	g = make_generator(N_tuple, W=0., gamma=0.)
+	psi = random_XY(g)
+	x = psi[:g.N_wells].reshape(g.N_tuple)
+	y = psi[g.N_wells:].reshape(g.N_tuple)
+	assert_close(g.SparseJacobianWithRelaxXY(psi).toarray(), g.FullJacobianWithRelaxXY(x, y))
+	assert_close(g.SparseJacobianWithRelaxXY(psi, conservative=True).toarray(), g.JacobianXY(x, y))
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+def test_sparse_jacobian_relaxation(N_tuple):
+	# the relaxational and disorder terms against central differences of the loop right-hand side
+	g = make_generator(N_tuple, h_ext_x=0.2, h_ext_y=-0.1)
+	psi = random_XY(g)
+	h = 1e-6
+	columns = []
+	for e in np.eye(2 * g.N_wells):
+		columns.append((np.sum(loop_XY(g, psi + h * e), axis=0) - np.sum(loop_XY(g, psi - h * e), axis=0)) / (2. * h))
+	np.testing.assert_allclose(g.SparseJacobianWithRelaxXY(psi).toarray(), np.array(columns).T, atol=1e-7)
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+def test_energy(N_tuple):
+	g = make_generator(N_tuple, local_disorder_amplitude=0.3)
+	psi = random_XY(g)
+	x = psi[:g.N_wells]
+	y = psi[g.N_wells:]
+	E_loop = g.calc_energy_XY(x.reshape(g.N_tuple), y.reshape(g.N_tuple), 0)
+	assert_close(g.calc_energy_XY_batch(x.reshape(1, -1), y.reshape(1, -1))[0], E_loop)
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+def test_local_observables(N_tuple):
+	# the per-step energy leaves out the local field h_dis, as the former loop version did
+	g = make_generator(N_tuple)
+	psi = random_XY(g)
+	x = psi[:g.N_wells]
+	y = psi[g.N_wells:]
+	g.set_init_XY(x, y)
+	g.set_constants_of_motion_local(0, 0)
+	assert_close(g.energy[0], g.calc_energy_XY(x, y, 0))
+	assert_close(g.number_of_particles[0], np.sum(x ** 2 + y ** 2))
+
+
+@pytest.mark.parametrize('N_tuple', LATTICES)
+@pytest.mark.parametrize('chunk_size', [1, 1000])
+def test_calc_temperature(N_tuple, chunk_size):
+	g = make_generator(N_tuple, calculation_type='dyn', time=0.05, beta_disorder_amplitude=0.02)
+	rng = np.random.RandomState(2)
+	g.X[:] = rng.randn(*g.X.shape)
+	g.Y[:] = rng.randn(*g.Y.shape)
+	vectorized = g.calc_temperature(chunk_size=chunk_size)
+	loop = g.calc_temperature_old()
+	for a, b in zip(vectorized, loop):
+		assert_close(np.asarray(a), np.asarray(b))
@@ -0,0 +1,45 @@
+# LyapunovSpectrumXY propagates the tangent vectors with DynamicsGenerator.jvp on both backends
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib.lyapunov_spectrum import LyapunovSpectrumXY
+
+
+def make_generator(N_tuple, **kwargs):
+	params = dict(N_wells=N_tuple, W=0.5, J=1.0, anisotropy=0.7, beta=0.1, time=0.1, step=0.01,
+				  h_ext_x=0.2, h_ext_y=-0.1, local_disorder_amplitude=0.3, disorder_seed=5)
+	params.update(kwargs)
+	return DynamicsGenerator(**params)
+
+
+@pytest.mark.parametrize('N_tuple', [(7, 1, 1), (4, 5, 1), (3, 4, 5)])
+@pytest.mark.parametrize('use_matrix_operations', [True, False])
+def test_rhs_and_jvp(N_tuple, use_matrix_operations):
+	g = make_generator(N_tuple, use_matrix_operations=use_matrix_operations)
+	engine = LyapunovSpectrumXY(g, 3)
+	rng = np.random.RandomState(1)
+	psi = rng.randn(2 * g.N_wells)
+	V = rng.randn(3, 2 * g.N_wells)
+
+	reference = g.HamiltonianWithRelaxationXY_fused(psi, np.empty_like(psi), conservative=True)
+	np.testing.assert_allclose(engine.rhs(psi), reference, rtol=0, atol=1e-12 * np.max(np.abs(reference)))
+
+	h = 1e-6
+	fd = np.array([(engine.rhs(psi + h * v) - engine.rhs(psi - h * v)) / (2. * h) for v in V])
+	np.testing.assert_allclose(engine.jvp(psi, V), fd, rtol=0, atol=1e-7 * np.max(np.abs(fd)))
+
+
+def test_torch_backend_matches_numpy():
+	g = make_generator((3, 4, 5))
+	psi0 = np.random.RandomState(1).randn(2 * g.N_wells)
+	exponents = LyapunovSpectrumXY(g, 3, qr_every=5).run(psi0, 20, seed=2)
+	exponents_torch = LyapunovSpectrumXY(g, 3, qr_every=5, backend='torch').run(psi0, 20, seed=2)
+	np.testing.assert_allclose(exponents_torch, exponents, rtol=0, atol=1e-10)
+
+
+@pytest.mark.parametrize('n_steps', [0, 1])
+def test_run_needs_two_steps(n_steps):
+	g = make_generator((4, 5, 1))
+	with pytest.raises(ValueError):
+		LyapunovSpectrumXY(g, 2).run(np.ones(2 * g.N_wells), n_steps)
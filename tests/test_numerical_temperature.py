@@ -0,0 +1,15 @@
+# calc_numerical_temperature keeps the (x, y, N_samples, n_proc, pert_len) signature of the process-based version
+import numpy as np
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+
+def test_n_proc_is_ignored():
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, step=0.01, n_steps=10, time=0.1, N_part_per_well=1.)
+	rng = np.random.RandomState(1)
+	x = rng.randn(*g.N_tuple) + 1.
+	y = rng.randn(*g.N_tuple)
+	reference = g.calc_numerical_temperature(x, y, 200, seed=3)
+	np.testing.assert_array_equal(g.calc_numerical_temperature(x, y, 200, 40, seed=3), reference)
+	np.testing.assert_array_equal(g.calc_numerical_temperature(x, y, 200, n_proc=40, seed=3), reference)
+	assert not np.allclose(g.calc_numerical_temperature(x, y, 200, 40, 0.05, seed=3), reference)
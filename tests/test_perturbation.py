@@ -0,0 +1,41 @@
+# E_const_perturbation_XY lands on the E = E_calibr, N = N_part shell within the roundoff of the energy sum
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+
+@pytest.mark.parametrize('N_part_per_well', [1., 1e4])
+@pytest.mark.parametrize('N_tuple', [(50, 1, 1), (12, 12, 12)])
+def test_E_const_perturbation_XY(N_tuple, N_part_per_well):
+	g = DynamicsGenerator(N_wells=N_tuple, W=0.5, beta=0.1, time=0.02, step=0.01, h_ext_x=0.3,
+						  local_disorder_amplitude=0.2, disorder_seed=5, N_part_per_well=N_part_per_well)
+	rng = np.random.RandomState(0)
+	x = rng.randn(g.N_wells)
+	y = rng.randn(g.N_wells)
+	norm = np.sqrt(g.N_part / np.sum(x ** 2 + y ** 2))
+	x, y = x * norm, y * norm
+	g.E_calibr = g.calc_energy_XY_batch(x.reshape(1, -1), y.reshape(1, -1))[0]
+
+	x1, y1, err = g.E_const_perturbation_XY(x, y, 0.01 * np.sqrt(N_part_per_well))
+	assert err == 0
+	assert not np.allclose(x1.flatten(), x)
+	x1, y1 = x1.flatten(), y1.flatten()
+	eps = 10 * g.N_wells * np.finfo(np.float64).eps
+	dE = g.calc_energy_XY_batch(x1.reshape(1, -1), y1.reshape(1, -1))[0] - g.E_calibr
+	assert np.abs(dE) <= eps * g.calc_energy_XY_abs_sum(x1, y1)
+	assert np.abs(np.sum(x1 ** 2 + y1 ** 2) - g.N_part) <= eps * g.N_part
+
+
+@pytest.mark.parametrize('N_tuple', [(7, 1, 1), (4, 5, 1), (3, 4, 5)])
+@pytest.mark.parametrize('use_matrix_operations', [True, False])
+def test_calc_energy_gradient_XY(N_tuple, use_matrix_operations):
+	g = DynamicsGenerator(N_wells=N_tuple, W=0.5, beta=0.1, anisotropy=0.7, time=0.02, step=0.01,
+						  local_disorder_amplitude=0.2, disorder_seed=5, use_matrix_operations=use_matrix_operations)
+	rng = np.random.RandomState(0)
+	psi = rng.randn(2 * g.N_wells)
+	energy = lambda p: g.calc_energy_XY_batch(p[:g.N_wells].reshape(1, -1), p[g.N_wells:].reshape(1, -1))[0]
+	h = 1e-6
+	fd = np.array([(energy(psi + h * e) - energy(psi - h * e)) / (2. * h) for e in np.eye(2 * g.N_wells)])
+	grad = g.calc_energy_gradient_XY(psi[:g.N_wells], psi[g.N_wells:])
+	np.testing.assert_allclose(grad, fd, rtol=0, atol=1e-7 * np.max(np.abs(fd)))
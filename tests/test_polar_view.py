@@ -0,0 +1,39 @@
+# RHO, THETA follow the writes into X, Y once the slots are invalidated
+import numpy as np
+
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib.two_trajs_generator import TwoTrajsGenerator
+
+
+def make_state(g, seed):
+	rng = np.random.RandomState(seed)
+	return rng.randn(*g.N_tuple), rng.randn(*g.N_tuple)
+
+
+def test_invalidate_after_external_write():
+	g = DynamicsGenerator(N_wells=(4, 5, 1), time=0.05, step=0.01, calculation_type='dyn')
+	g.set_init_XY(*make_state(g, 1))
+	assert np.all(g.RHO[..., 0] > 0)
+	g.X *= 0
+	g.Y *= 0
+	g.invalidate()
+	np.testing.assert_array_equal(g.RHO, 0.)
+	x, y = make_state(g, 2)
+	g.X[..., 3] = x
+	g.Y[..., 3] = y
+	g.invalidate(3)
+	np.testing.assert_array_equal(g.RHO[..., 3], np.sqrt(x ** 2 + y ** 2))
+	np.testing.assert_array_equal(g.THETA[..., 3], np.arctan2(y, x))
+
+
+def test_invalidate_both_trajectories():
+	g = TwoTrajsGenerator(N_wells=(4, 5, 1), time=0.05, step=0.01)
+	g.set_init_XY(*make_state(g, 1), *make_state(g, 2))
+	assert np.all(g.RHO[..., 0] > 0) and np.all(g.RHO1[..., 0] > 0)
+	g.X *= 0
+	g.X1 *= 0
+	g.Y *= 0
+	g.Y1 *= 0
+	g.invalidate(0)
+	np.testing.assert_array_equal(g.RHO[..., 0], 0.)
+	np.testing.assert_array_equal(g.RHO1[..., 0], 0.)
@@ -0,0 +1,11 @@
+# extended FloatPrecision with an integrator that works in float64 is reported as a warning
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+
+@pytest.mark.parametrize('kwargs', [dict(integrator='scipy'), dict(gpu_integrator='torch')])
+def test_extended_precision_warning(kwargs):
+	with pytest.warns(UserWarning, match='Extended precision'):
+		DynamicsGenerator(N_wells=(4, 5, 1), time=0.1, step=0.01, FloatPrecision=np.longdouble, **kwargs)
@@ -0,0 +1,47 @@
+# run_relaxation stops at the E_desired crossing (scipy terminal event, torch odeint_event)
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+N_STEPS = 60
+STEP = 0.01
+
+
+def make_generator(n_steps=N_STEPS, **kwargs):
+	g = DynamicsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, gamma=0.05, step=STEP, n_steps=n_steps,
+						  time=n_steps * STEP, N_part_per_well=1., calculation_type='dyn', **kwargs)
+	rng = np.random.RandomState(1)
+	g.set_init_XY(rng.randn(*g.N_tuple) + 1., rng.randn(*g.N_tuple))
+	return g
+
+
+def initial_energy(g):
+	return g.calc_energy_XY_global(np.hstack((g.X[..., 0].ravel(), g.Y[..., 0].ravel())).reshape(1, -1))[0]
+
+
+# the torch event root is found to the tolerance of odeint_event
+@pytest.mark.parametrize('kwargs, rtol', [(dict(integrator='scipy'), 1e-8), (dict(gpu_integrator='torch'), 1e-6)])
+def test_stops_on_the_shell(kwargs, rtol):
+	g = make_generator(**kwargs)
+	E_desired = initial_energy(g) - 2.
+	g.run_relaxation(E_desired=E_desired, N_max=N_STEPS)
+	assert g.t_crossing is not None
+	assert g.n_steps < N_STEPS
+	assert (g.n_steps - 2) * STEP < g.t_crossing <= (g.n_steps - 1) * STEP
+	assert g.T[g.n_steps - 1] == g.t_crossing
+	np.testing.assert_allclose(g.energy[g.n_steps - 1], E_desired, rtol=rtol)
+
+
+def test_crossing_after_the_last_output_time():
+	# the crossing lies between the last output time and the former span end ts[-1] + 0.01
+	g = make_generator(integrator='scipy')
+	E_desired = initial_energy(g) - 2.
+	g.run_relaxation(E_desired=E_desired, N_max=N_STEPS)
+	N_max = int(np.floor(g.t_crossing / STEP)) + 1
+
+	g = make_generator(n_steps=N_max, integrator='scipy')
+	g.run_relaxation(E_desired=E_desired, N_max=N_max)
+	assert g.t_crossing is None
+	assert g.energy.shape[0] == N_max
+	assert g.energy[-1] > E_desired
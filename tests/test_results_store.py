@@ -0,0 +1,40 @@
+# ResultsStore: restarted writers skip their records, merge keeps arrays and meta on the same records
+import numpy as np
+
+from GPElib.results_store import ResultsStore
+
+
+def test_has_survives_reopen(tmp_path):
+	store = ResultsStore(str(tmp_path), writer_id=3)
+	store.append({'energies': np.arange(4.)}, traj_seed=7, k_traj=0)
+	assert store.has(traj_seed=7, k_traj=0)
+	assert not store.has(traj_seed=7, k_traj=1)
+	store = ResultsStore(str(tmp_path), writer_id=3)
+	assert store.has(traj_seed=7, k_traj=0)
+	assert not ResultsStore(str(tmp_path), writer_id=4).has(traj_seed=7, k_traj=0)
+
+
+def test_read_concatenate(tmp_path):
+	store = ResultsStore(str(tmp_path))
+	for k in range(3):
+		store.append({'energies': k + np.arange(4.), 'temperatures': k * np.ones((2, 5))}, k_traj=k)
+	np.testing.assert_array_equal(store.read('energies', concatenate=True), np.hstack([k + np.arange(4.) for k in range(3)]))
+	assert store.read('temperatures').shape == (3, 2, 5)
+
+
+def test_merge_aligns_arrays_and_meta(tmp_path):
+	store = ResultsStore(str(tmp_path))
+	store.append({'a': np.zeros(2), 'b': np.zeros(3)}, k_traj=0)
+	store.append({'a': np.ones(2)}, k_traj=1)
+	store.append({'a': 2 * np.ones(2), 'b': np.ones(3)}, k_traj=2)
+
+	merged = store.merge(str(tmp_path / 'merged.npz'))
+	assert sorted(merged) == ['a', 'meta_k_traj', 'writer_id']
+	np.testing.assert_array_equal(merged['meta_k_traj'], [0, 1, 2])
+	assert merged['a'].shape == (3, 2)
+
+	merged = store.merge(str(tmp_path / 'merged.npz'), names=['a', 'b'])
+	np.testing.assert_array_equal(merged['meta_k_traj'], [0, 2])
+	np.testing.assert_array_equal(merged['a'][:, 0], [0, 2])
+	assert merged['b'].shape == (2, 3)
+	assert merged['writer_id'].shape == (2,)
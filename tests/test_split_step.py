@@ -0,0 +1,64 @@
+# split_step_XY is a second-order integrator of the conservative dynamics with a bounded energy error
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+from GPElib.rk4_stepper import RK4Stepper
+
+TIME = 0.4
+
+
+def make_generator(N_tuple, step, **kwargs):
+	return DynamicsGenerator(N_wells=N_tuple, W=0.5, J=1.0, anisotropy=0.7, beta=0.1, step=step, time=TIME,
+							 disorder_seed=5, split_step=True, **kwargs)
+
+
+def initial_state(g):
+	rng = np.random.RandomState(1)
+	return np.hstack((rng.randn(g.N_wells) + 1., rng.randn(g.N_wells)))
+
+
+def split_step_run(g, psi, n_steps):
+	psi = psi.copy()
+	for i in range(n_steps):
+		g.split_step_XY(psi, t=i * g.step, out=psi)
+	return psi
+
+
+def energy(g, psi):
+	return g.calc_energy_XY_global(psi.reshape(1, -1))[0]
+
+
+@pytest.mark.parametrize('N_tuple', [(7, 1, 1), (4, 5, 1), (3, 4, 2)])
+@pytest.mark.parametrize('use_matrix_operations', [True, False])
+def test_second_order(N_tuple, use_matrix_operations):
+	g = make_generator(N_tuple, 1e-3, use_matrix_operations=use_matrix_operations)
+	psi0 = initial_state(g)
+	reference = psi0.copy()
+	stepper = RK4Stepper(reference.shape[0])
+	for i in range(int(round(TIME / g.step))):
+		stepper.step(g.conservative_XY_out, i * g.step, reference, g.step, out=reference)
+
+	errors = []
+	for step in [0.04, 0.02, 0.01]:
+		g.step = step
+		errors.append(np.max(np.abs(split_step_run(g, psi0, int(round(TIME / step))) - reference)))
+	orders = np.log2(np.array(errors[:-1]) / np.array(errors[1:]))
+	np.testing.assert_allclose(orders, 2., atol=0.15)
+
+
+def test_bounded_energy_error():
+	max_errors = []
+	for step in [0.02, 0.01]:
+		g = make_generator((4, 5, 1), step)
+		psi = initial_state(g)
+		E0 = energy(g, psi)
+		dE = []
+		for i in range(20):
+			psi = split_step_run(g, psi, int(round(1. / step)))
+			dE.append(abs(energy(g, psi) - E0))
+		# no secular drift: the error over the second half of the run is no larger than over the first
+		assert max(dE[10:]) < 1.5 * max(dE[:10])
+		max_errors.append(max(dE))
+	# the bounded error itself is O(step^2)
+	assert 3. < max_errors[0] / max_errors[1] < 5.
@@ -0,0 +1,56 @@
+# stability_analysis against the dense spectrum of the Jacobian in the rotating frame
+import numpy as np
+import pytest
+
+from GPElib.dynamics_generator import DynamicsGenerator
+
+K = 4
+
+
+def make_generator(**kwargs):
+	return DynamicsGenerator(N_wells=(3, 4, 1), W=0.5, J=1.0, beta=0.1, gamma=0.3, time=0.1, step=0.01,
+							 local_disorder_amplitude=0.3, disorder_seed=5, **kwargs)
+
+
+def dense_spectrum(g, psi, mu, conservative, h=1e-6):
+	# central differences of the right-hand side minus the rotation mu * (x, y) -> (y, -x)
+	rhs = lambda p: g.HamiltonianWithRelaxationXY_fused(p, np.empty_like(p), conservative=conservative)
+	jac = np.array([(rhs(psi + h * e) - rhs(psi - h * e)) / (2. * h) for e in np.eye(psi.shape[0])]).T
+	N = g.N_wells
+	jac[:N, N:] -= mu * np.eye(N)
+	jac[N:, :N] += mu * np.eye(N)
+	return np.linalg.eigvals(jac)
+
+
+def assert_in_spectrum(eig_vals, spectrum, atol=1e-6):
+	for ev in eig_vals:
+		assert np.min(np.abs(spectrum - ev)) < atol
+
+
+@pytest.mark.parametrize('matrix_free', [False, True])
+@pytest.mark.parametrize('conservative', [True, False])
+def test_largest_real_part(matrix_free, conservative):
+	g = make_generator()
+	psi = np.random.RandomState(1).randn(2 * g.N_wells)
+	mu = g.calc_rotation_frequency(psi, conservative=conservative)
+	spectrum = dense_spectrum(g, psi, mu, conservative)
+
+	eig_vals, modes = g.stability_analysis(psi, k=K, conservative=conservative, matrix_free=matrix_free)
+	assert modes.shape == (2 * g.N_wells, K)
+	assert_in_spectrum(eig_vals, spectrum)
+	np.testing.assert_allclose(eig_vals.real, np.sort(spectrum.real)[::-1][:K], rtol=0, atol=1e-6)
+	assert g.stability_growth_rate == eig_vals[0].real
+
+
+@pytest.mark.parametrize('matrix_free', [False, True])
+def test_shift_invert(matrix_free):
+	g = make_generator()
+	psi = np.random.RandomState(1).randn(2 * g.N_wells)
+	mu = g.calc_rotation_frequency(psi, conservative=True)
+	spectrum = dense_spectrum(g, psi, mu, True)
+	sigma = 0.5j
+
+	eig_vals, modes = g.stability_analysis(psi, k=K, sigma=sigma, conservative=True, matrix_free=matrix_free)
+	assert_in_spectrum(eig_vals, spectrum)
+	closest = spectrum[np.argsort(np.abs(spectrum - sigma))[:K]]
+	np.testing.assert_allclose(np.sort(np.abs(eig_vals - sigma)), np.sort(np.abs(closest - sigma)), rtol=0, atol=1e-6)
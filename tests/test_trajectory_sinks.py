@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pytest
+
+from GPElib.trajectory_sinks import TrajectorySink, RingBufferSink, MemmapSink, HDF5Sink
+
+N_TUPLE = (3, 2, 1)
+
+
+def push_snapshots(sink, n):
+	sink.open(N_TUPLE)
+	PSI = np.arange(n * 12, dtype=np.float64).reshape(n, 12)
+	for i in range(n):
+		sink.push(i, 0.1 * i, PSI[i])
+	return PSI
+
+
+def test_sink_is_abstract():
+	with pytest.raises(TypeError):
+		TrajectorySink()
+
+
+def test_ring_buffer_keeps_last_snapshots():
+	sink = RingBufferSink(capacity=3)
+	PSI = push_snapshots(sink, 5)
+	steps, ts, stored = sink.read()
+	np.testing.assert_array_equal(steps, [2, 3, 4])
+	np.testing.assert_array_equal(stored, PSI[2:])
+
+
+def test_memmap_sink(tmp_path):
+	sink = MemmapSink(str(tmp_path / 'psi.npy'), max_snapshots=4)
+	PSI = push_snapshots(sink, 4)
+	with pytest.raises(IndexError):
+		sink.push(4, 0.4, PSI[0])
+	sink.close()
+	X, Y = sink.get_XY()
+	np.testing.assert_array_equal(X[..., 1].flatten(), PSI[1, :6])
+	np.testing.assert_array_equal(Y[..., 1].flatten(), PSI[1, 6:])
+
+
+def test_hdf5_sink_reopen_from_disk(tmp_path):
+	pytest.importorskip('h5py')
+	filename = str(tmp_path / 'traj.h5')
+	sink = HDF5Sink(filename)
+	PSI = push_snapshots(sink, 5)
+	sink.close()
+	sink.close()
+
+	reopened = HDF5Sink(filename)
+	steps, ts, stored = reopened.read()
+	np.testing.assert_array_equal(steps, np.arange(5))
+	np.testing.assert_array_equal(stored, PSI)
+	X, Y = reopened.get_XY()
+	assert X.shape == N_TUPLE + (5,)
+	reopened.close()
+	assert os.path.exists(filename)
+
+
+def test_ring_buffer_seek():
+	sink = RingBufferSink(capacity=4)
+	PSI = push_snapshots(sink, 6)
+	# the pushes 4, 5 overwrote the snapshots 0, 1
+	sink.seek(4)
+	steps, ts, stored = sink.read()
+	np.testing.assert_array_equal(steps, [2, 3])
+	sink.push(4, 0.4, PSI[4])
+	np.testing.assert_array_equal(sink.read()[0], [2, 3, 4])
+	# a new sink does not hold the snapshots of a previous process
+	sink = RingBufferSink(capacity=4)
+	sink.open(N_TUPLE)
+	sink.seek(3)
+	assert sink.read()[0].size == 0
+
+
+@pytest.mark.parametrize('kind', ['memmap', 'hdf5'])
+def test_file_sinks_seek_after_reopen(tmp_path, kind):
+	if kind == 'hdf5':
+		pytest.importorskip('h5py')
+		make_sink = lambda: HDF5Sink(str(tmp_path / 'traj.h5'))
+	else:
+		make_sink = lambda: MemmapSink(str(tmp_path / 'traj.npy'), max_snapshots=10)
+	sink = make_sink()
+	PSI = push_snapshots(sink, 6)
+	sink.close()
+
+	sink = make_sink()
+	sink.open(N_TUPLE)
+	sink.seek(4)
+	sink.push(4, 0.4, -PSI[4])
+	steps, ts, stored = sink.read()
+	np.testing.assert_array_equal(steps, [0, 1, 2, 3, 4])
+	np.testing.assert_array_equal(stored[:4], PSI[:4])
+	np.testing.assert_array_equal(stored[4], -PSI[4])
+	sink.close()
@@ -0,0 +1,12 @@
+# the observables of the second trajectory are accumulated in ReductionPrecision, as those of the first
+import numpy as np
+
+from GPElib.two_trajs_generator import TwoTrajsGenerator
+
+
+def test_second_trajectory_observables_precision():
+	g = TwoTrajsGenerator(N_wells=(4, 5, 1), W=0.5, beta=0.1, time=0.1, step=0.01, FloatPrecision=np.float32)
+	assert g.X1.dtype == np.float32
+	for name in ['energy', 'participation_rate', 'angular_momentum', 'effective_nonlinearity', 'number_of_particles']:
+		assert getattr(g, name).dtype == np.float64
+		assert getattr(g, name + '1').dtype == np.float64